@@ -0,0 +1,186 @@
+"""
+Message coalescing and admission control for the text messages.
+
+Students often split a question over a few quick messages. MessageCoalescer
+lets a message through at once when nothing else of the same user is being
+handled; messages that arrive while the previous one is still queued or
+running are held and merged, so the next turn answers the whole follow-up in
+one memory read, one placeholder and one agent run. A lone message never
+waits unless a debounce window is configured. AdmissionController bounds the
+messages that need the LLM: beyond the running agent calls plus a bounded
+queue, new messages are shed with a "busy" reply instead of piling up.
+Queue depth, coalesced and shed messages are exported through aida_tracing.
+
+Configuration (environment variables):
+    AIDA_DEBOUNCE=0          extra seconds of silence a burst waits for before its turn (0: no added wait)
+    AIDA_DEBOUNCE_MAX=4      with a window, a burst is closed after this many seconds even if messages keep arriving
+    AIDA_ADMISSION_QUEUE=32  messages that may wait for an agent run before new ones are shed
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+
+from aida_runner import AGENT_CONCURRENCY
+from aida_tracing import metrics, record_span
+
+
+DEBOUNCE_SECONDS = float(os.environ.get("AIDA_DEBOUNCE", 0.0))
+DEBOUNCE_MAX_SECONDS = float(os.environ.get("AIDA_DEBOUNCE_MAX", 4.0))
+ADMISSION_QUEUE = int(os.environ.get("AIDA_ADMISSION_QUEUE", 32))
+BUSY_MESSAGE = ("In questo momento sto rispondendo a molte persone e non riesco a seguire anche la tua domanda. "
+                "Riprova tra qualche minuto, per favore!")
+
+
+####### Raggruppamento dei messaggi ravvicinati di uno stesso utente
+#
+# turn() tiene in ordine i messaggi di ogni utente. Un messaggio che trova l'utente libero apre un gruppo e lo
+# chiude subito (nessuna attesa, salvo una finestra window configurata): il suo handler (il leader) prosegue.
+# Un messaggio che arriva mentre il precedente è in coda o in esecuzione apre un nuovo gruppo e attende la fine
+# del precedente; i messaggi successivi vengono aggiunti a quel gruppo e i loro handler (follower) terminano
+# subito. Quando il precedente termina (e sono passati window secondi senza messaggi, o max_wait dall'apertura)
+# il gruppo si chiude e il leader prosegue con i testi uniti da un a capo. I leader entrano quindi nel turno
+# dell'utente (AgentRunner.user_turn) già in ordine di arrivo, uno alla volta.
+
+class _Burst:
+    __slots__ = ("texts", "opened", "last")
+
+    def __init__(self, text, now):
+        self.texts = [text]
+        self.opened = now
+        self.last = now
+
+
+class _UserQueue:
+    __slots__ = ("burst", "current")
+
+    def __init__(self):
+        self.burst = None     # gruppo aperto, in attesa del turno
+        self.current = None   # future completato quando termina l'ultimo leader
+
+
+class MessageCoalescer:
+    """Per-user merging of the messages that arrive while the previous one is being handled."""
+
+    def __init__(self, window=DEBOUNCE_SECONDS, max_wait=DEBOUNCE_MAX_SECONDS, merge=True, registry=metrics):
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.merge = merge
+        self.registry = registry
+        self._users = {}   # user_id -> _UserQueue
+        self._open = 0     # gruppi aperti
+
+    @property
+    def pending_users(self):
+        """Number of users with an open burst."""
+        return self._open
+
+    @contextlib.asynccontextmanager
+    async def turn(self, user_id, text):
+        """Yield the merged text while this message leads its burst, or None if it was added to an open one.
+
+        The handler must do all its work inside the block: the next burst of
+        the user starts when the block is left.
+        """
+        if not self.merge:
+            yield text
+            return
+        loop = asyncio.get_running_loop()
+        queue = self._users.get(user_id)
+        if queue is not None and queue.burst is not None:
+            queue.burst.texts.append(text)
+            queue.burst.last = loop.time()
+            self.registry.inc("aida_coalesced_messages_total")
+            yield None
+            return
+
+        if queue is None:
+            queue = self._users[user_id] = _UserQueue()
+        burst = queue.burst = _Burst(text, loop.time())
+        previous, done = queue.current, loop.create_future()
+        queue.current = done
+        self._set_open(1)
+        try:
+            # Nessuna attesa per un messaggio che trova l'utente libero (senza finestra di debounce)
+            if previous is not None or self.window > 0:
+                waiting = time.perf_counter()
+                if previous is not None:
+                    await previous
+                while True:
+                    delay = min(burst.last + self.window, burst.opened + self.max_wait) - loop.time()
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                record_span("debounce.wait", time.perf_counter() - waiting, start=waiting, messages=len(burst.texts))
+            self._close(queue, burst)
+            yield "\n".join(burst.texts)
+        finally:
+            self._close(queue, burst)
+            done.set_result(None)
+            if queue.current is done:
+                del self._users[user_id]
+
+    def _close(self, queue, burst):
+        if queue.burst is burst:
+            queue.burst = None
+            self._set_open(-1)
+
+    def _set_open(self, delta):
+        self._open += delta
+        self.registry.set_gauge("aida_debounce_pending_users", self._open)
+
+
+####### Controllo di ammissione globale
+#
+# Ogni messaggio che richiede l'LLM occupa un posto dall'ingresso nel turno dell'utente fino alla risposta.
+# I posti sono max_active (le esecuzioni dell'agente in parallelo) più max_queue (i messaggi in attesa, del
+# proprio turno o di un thread del pool): quando sono tutti occupati il messaggio viene scartato e l'utente
+# riceve BUSY_MESSAGE. Le risposte da template del router non passano da qui: costano poco anche sotto carico.
+
+class AdmissionController:
+    """Bounded admission of the messages that need an agent run."""
+
+    def __init__(self, max_active=AGENT_CONCURRENCY, max_queue=ADMISSION_QUEUE, registry=metrics):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.registry = registry
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.max_queue_depth = 0
+
+    @property
+    def capacity(self):
+        return self.max_active + self.max_queue
+
+    @property
+    def queue_depth(self):
+        """Admitted messages beyond those that can run at the same time."""
+        return max(0, self.in_flight - self.max_active)
+
+    @contextlib.contextmanager
+    def admit(self):
+        """Yield True while holding a slot, or False (without a slot) if the message has to be shed."""
+        if self.in_flight >= self.capacity:
+            self.shed += 1
+            self.registry.inc("aida_admission_shed_total")
+            yield False
+            return
+        self.in_flight += 1
+        self.admitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self._export()
+        try:
+            yield True
+        finally:
+            self.in_flight -= 1
+            self._export()
+
+    def _export(self):
+        self.registry.set_gauge("aida_admission_in_flight", self.in_flight)
+        self.registry.set_gauge("aida_admission_queue_depth", self.queue_depth)
+
+    def stats(self):
+        return {"admitted": self.admitted, "shed": self.shed, "in_flight": self.in_flight,
+                "max_queue_depth": self.max_queue_depth}
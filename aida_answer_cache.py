@@ -0,0 +1,216 @@
+"""
+Semantic cache of the answers of the Bicocca QA System.
+
+Answers are keyed by the embedding of the condensed standalone question: a new
+question close enough (cosine similarity above a threshold) to a cached one is
+answered without retrieval and without the answer LLM, provided that both
+state the same constraints (degree level, language, access, city, class and
+SUA codes): "L-18" and "LM-18" are close embeddings but different questions.
+The cache is emptied whenever the version of the vector store collection
+changes.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+from langchain.callbacks.manager import CallbackManagerForChainRun
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+
+from aida_filters import analyze_query, build_where
+from aida_lexical import exact_codes
+
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_SIZE = 2000          # numero massimo di risposte in cache
+ANSWER_CACHE_TTL = 24 * 3600      # secondi dopo i quali una risposta non viene più riutilizzata
+ANSWER_CACHE_THRESHOLD = 0.95     # similarità del coseno minima per considerare uguali due domande
+VERSION_CHECK_INTERVAL = 60       # secondi tra due controlli della versione della collection
+
+
+def collection_version(vectordb, persist_directory=None):
+    """Return a string that changes whenever the Chroma collection is updated.
+
+    The "version" field of the collection metadata is used when present,
+    otherwise the number of chunks and the last modification time of the
+    persist directory.
+    """
+    collection = vectordb._collection
+    metadata = collection.metadata or {}
+    if "version" in metadata:
+        return str(metadata["version"])
+
+    mtime = 0
+    if persist_directory is not None and os.path.isdir(persist_directory):
+        for dirpath, _, filenames in os.walk(persist_directory):
+            for filename in filenames:
+                mtime = max(mtime, os.path.getmtime(os.path.join(dirpath, filename)))
+    return f"{collection.name}:{collection.count()}:{int(mtime)}"
+
+
+def constraint_key(question, cities=()):
+    """Return the constraints stated in ``question`` (metadata filter and exact codes) as a string."""
+    where = build_where(analyze_query(question, cities))
+    return json.dumps([where, sorted(set(exact_codes(question)))], sort_keys=True, ensure_ascii=False)
+
+
+####### Cache semantica delle risposte
+#
+# Le domande in cache sono le righe normalizzate di una matrice numpy: la ricerca è un solo prodotto
+# matrice-vettore. L'ordine LRU è tenuto da un OrderedDict slot -> voce; quando la cache è piena lo slot
+# usato meno di recente viene riutilizzato. Ogni voce conserva i vincoli della sua domanda (constraint_key):
+# una domanda simile viene considerata uguale solo se ha gli stessi vincoli, così "triennale L-18 a Milano" non
+# riceve la risposta salvata per "magistrale LM-18 a Torino". La cache è usata dai thread dell'AgentRunner,
+# quindi ogni accesso è protetto da un lock. Il controllo della versione ha un lock proprio (come SkillGraph._current):
+# un solo thread per intervallo chiama version_fn ed eventualmente svuota la cache, senza bloccare le ricerche.
+
+class SemanticAnswerCache:
+    """LRU/TTL cache of answers keyed by question embeddings."""
+
+    def __init__(self, embeddings, threshold=ANSWER_CACHE_THRESHOLD, maxsize=ANSWER_CACHE_SIZE,
+                 ttl=ANSWER_CACHE_TTL, version_fn=None, version_check_interval=VERSION_CHECK_INTERVAL, cities=()):
+        self.embeddings = embeddings
+        self.cities = tuple(cities)   # città riconosciute nelle domande, come nel FilteredRetriever
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_fn = version_fn
+        self.version_check_interval = version_check_interval
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._version = version_fn() if version_fn is not None else None
+        self._version_checked = time.monotonic()
+        self._vectors = None                 # matrice maxsize x dim, allocata al primo inserimento
+        self._entries = OrderedDict()        # slot -> (domanda, risposta, istante di inserimento, vincoli)
+        self._lock = threading.Lock()
+        self._version_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question, vector=None):
+        """Return the cached answer for a question similar to ``question``, or None."""
+        self._check_version()
+        if vector is None:
+            vector = self.embed(question)
+        key = constraint_key(question, self.cities)
+        with self._lock:
+            slot = self._best_slot(vector, key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return self._entries[slot][1]
+
+    def store(self, question, answer, vector=None):
+        """Cache ``answer`` for ``question``."""
+        if vector is None:
+            vector = self.embed(question)
+        key = constraint_key(question, self.cities)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            if len(self._entries) < self.maxsize:
+                slot = len(self._entries)
+            else:
+                slot, _ = self._entries.popitem(last=False)
+            self._vectors[slot] = vector
+            self._entries[slot] = (question, answer, time.monotonic(), key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors = None
+
+    def stats(self):
+        """Return the hit/miss counters and the current size."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "invalidations": self.invalidations,
+            "version": self._version,
+        }
+
+    def _best_slot(self, vector, key):
+        if not self._entries:
+            return None
+        scores = self._vectors[:len(self._entries)] @ vector
+        deadline = time.monotonic() - self.ttl
+        for slot in np.argsort(scores)[::-1]:
+            slot = int(slot)
+            if scores[slot] < self.threshold:
+                return None
+            _, _, inserted, slot_key = self._entries[slot]
+            if inserted >= deadline and slot_key == key:
+                return slot
+        return None
+
+    def _check_version(self):
+        if self.version_fn is None or time.monotonic() - self._version_checked < self.version_check_interval:
+            return
+        with self._version_lock:
+            now = time.monotonic()
+            if now - self._version_checked < self.version_check_interval:
+                return
+            self._version_checked = now
+            version = self.version_fn()
+            if version != self._version:
+                logger.info("Collection aggiornata (%s -> %s): cache delle risposte svuotata", self._version, version)
+                self._version = version
+                self.invalidations += 1
+                self.clear()
+
+
+####### ConversationalRetrievalChain con cache semantica
+#
+# La domanda viene prima condensata con la chat history (come nella chain originale; senza history la
+# domanda è già standalone e non serve nessuna chiamata all'LLM). Se la domanda condensata è in cache la
+# risposta viene restituita subito, senza retrieval né LLM di risposta; altrimenti la chain originale
+# viene eseguita sulla domanda condensata e la risposta viene salvata.
+
+class CachedConversationalRetrievalChain(ConversationalRetrievalChain):
+    """ConversationalRetrievalChain that consults a SemanticAnswerCache before retrieval."""
+
+    answer_cache: Any = None
+
+    def _call(self, inputs, run_manager=None):
+        if self.answer_cache is None:
+            return super()._call(inputs, run_manager=run_manager)
+
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+        if chat_history_str:
+            new_question = self.question_generator.run(
+                question=question, chat_history=chat_history_str, callbacks=_run_manager.get_child()
+            )
+        else:
+            new_question = question
+
+        vector = self.answer_cache.embed(new_question)
+        answer = self.answer_cache.lookup(new_question, vector=vector)
+        if answer is not None:
+            return {self.output_key: answer}
+
+        # La domanda è già condensata: la chain originale non deve ricondensarla
+        outputs = super()._call({**inputs, "question": new_question, "chat_history": []}, run_manager=run_manager)
+        self.answer_cache.store(new_question, outputs[self.output_key], vector=vector)
+        return outputs
@@ -16,21 +16,21 @@ bot.
 """
 
 # IMPORT VARI E DEFINIZIONE DELLE VERSIONI PER BOT TELEGRAM
+import time
+
+# Istante di avvio del processo: base per misurare il tempo fino alla prima risposta (cold start)
+_PROCESS_START = time.perf_counter()
+
+import asyncio
+import functools
 import logging
 import random
 import os
-import pickle
-import AIDAkeys
-import langchain
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
-from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
-from langchain import PromptTemplate
-from langchain.memory import  ConversationBufferWindowMemory
-from langchain.chains import ConversationalRetrievalChain
-from langchain.chat_models import ChatOpenAI
-from langchain.agents import initialize_agent, Tool
-from langchain.agents import AgentType
+from aida_admission import BUSY_MESSAGE, AdmissionController, MessageCoalescer
+from aida_memory import MemoryCache, new_memory
+from aida_runner import AgentRunner
+from aida_router import COURSE, IntentRouter
+from aida_tracing import METRICS_PORT, VERBOSE, current_trace, metrics, record_span, span, start_metrics_server, traced
 
 from telegram import __version__ as TG_VER
 
@@ -48,65 +48,141 @@ if __version_info__ < (20, 0, 0, "alpha", 1):
     )
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import db
 
-# Percorso del file JSON delle credenziali
-cred = credentials.Certificate(AIDAkeys.firebaseCertificate)
 
-# Inizializza l'app Firebase
-firebase_admin.initialize_app(cred,{
-    'databaseURL': AIDAkeys.databaseURL
-})
+persist_directory = 'ChromaDB_Bicocca_AIDA_FINAL'
+# Backend della ricerca per similarità: "chroma" (collection ChromaDB) oppure "mmap" (esportazione di aida_vecindex,
+# condivisa tra i processi attraverso la page cache: python aida_vecindex.py export)
+VECTOR_BACKEND = os.environ.get("AIDA_VECTOR_BACKEND", "chroma")
+WARMUP_QUERY = "corsi di laurea triennale"
+
+####### Configurazione del sistema di logging del bot: il formato e il livello vengono impostati in main()
+logger = logging.getLogger(__name__)
 
 
-######### Definizione di chiavi, persist directory e vectorDB (ChromaDB)
+######### Inizializzazione differita di chiavi, Firebase, embedding e vectorDB (ChromaDB)
+#
+# Importare il modulo non ha effetti collaterali: credenziali, client e stack di LangChain vengono caricati
+# solo quando servono (in main(), oppure al primo uso), una sola volta. Così il modulo si importa nei test e
+# nei benchmark, e all'avvio il lavoro costoso avviene in un punto solo, misurato.
 
-os.environ['OPENAI_API_KEY'] = AIDAkeys.openAIkeyAndrea
-embeddings = OpenAIEmbeddings()
-persist_directory = 'ChromaDB_Bicocca_AIDA_FINAL'
-vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
-
-######### Creazione di prompt per la conversazione
-prompt=ChatPromptTemplate(
-    input_variables=['context', 'question'], 
-    output_parser=None,
-    partial_variables={}, 
-    messages=[
-        SystemMessagePromptTemplate(
-            prompt = PromptTemplate(
-                input_variables=['context'], 
-                output_parser=None, 
-                partial_variables={}, 
-                template=AIDAkeys.template, 
-                template_format='f-string', 
-                validate_template=True), 
-                additional_kwargs={}), 
-                HumanMessagePromptTemplate(
-                    prompt = PromptTemplate(
-                        input_variables=['question'], 
-                        output_parser=None, 
-                        partial_variables={}, 
-                        template='{question}', 
-                        template_format='f-string', 
-                        validate_template=True), 
-                        additional_kwargs={})])
-
-######## Funzione processThought: semplice passaggio che restituisce ciò che gli viene passato come argomento
-def processThought(thought):
-  return thought
- 
-#langchain.debug = True
+@functools.lru_cache(maxsize=None)
+def get_keys():
+    import AIDAkeys
+    return AIDAkeys
 
 
+@functools.lru_cache(maxsize=None)
+def init_firebase():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    AIDAkeys = get_keys()
+    # Inizializza l'app Firebase con il file JSON delle credenziali
+    firebase_admin.initialize_app(credentials.Certificate(AIDAkeys.firebaseCertificate), {
+        'databaseURL': AIDAkeys.databaseURL
+    })
+
+
+@functools.lru_cache(maxsize=None)
+def init_openai():
+    os.environ['OPENAI_API_KEY'] = get_keys().openAIkeyAndrea
+
+
+@functools.lru_cache(maxsize=None)
+def get_embeddings():
+    """Return the shared embeddings: the embeddings of questions already seen are read from the local SQLite cache."""
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from aida_embeddings import CachedEmbeddings
+
+    init_openai()
+    return CachedEmbeddings(OpenAIEmbeddings())
+
+
+@functools.lru_cache(maxsize=None)
+def get_vectordb():
+    if VECTOR_BACKEND == "mmap":
+        from aida_vecindex import VECTOR_INDEX_DIR, VectorIndex
+
+        return VectorIndex(VECTOR_INDEX_DIR, embedding_function=get_embeddings())
+
+    from langchain.vectorstores import Chroma
+
+    return Chroma(persist_directory=persist_directory, embedding_function=get_embeddings())
+
+
+def vectordb_version():
+    """Version of the indexed chunks: the semantic answer cache is emptied when it changes."""
+    if VECTOR_BACKEND == "mmap":
+        return get_vectordb().version
+
+    from aida_answer_cache import collection_version
+
+    return collection_version(get_vectordb(), persist_directory)
+
+
+####### Riscaldamento prima dell'ascolto
+#
+# Prima che il bot inizi a ricevere messaggi vengono eseguite, in parallelo nei thread, le operazioni che
+# altrimenti pagherebbe la prima domanda: apertura della collection ChromaDB e lettura dell'indice (count e
+# una ricerca per vettore; con il backend mmap lettura di tutta la matrice), token di accesso e connessione a Firebase (lettura di un nodo inesistente),
+# connessione alle API di OpenAI (un embedding). Un passaggio non riuscito viene solo segnalato nel log.
+
+def _warm_vectordb(vector):
+    vectordb = get_vectordb()
+    if VECTOR_BACKEND == "mmap":
+        vectordb.warm_up()
+    else:
+        vectordb._collection.count()
+    vectordb.similarity_search_by_vector(vector, k=1)
+
+
+def _warm_firebase():
+    from firebase_admin import db
+
+    db.reference('/chats/_warmup').get(shallow=True)
+
+
+def _warm_embeddings():
+    # Il client sottostante, non la cache: serve ad aprire la connessione verso OpenAI
+    return get_embeddings().embeddings.embed_query(WARMUP_QUERY)
+
+
+async def warm_up():
+    """Open the vector index and prime the Firebase and OpenAI connections; return the seconds per step."""
+    timings = {}
+
+    async def step(name, func, *args):
+        start = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(func, *args)
+        except Exception:
+            logger.warning("Riscaldamento %s non riuscito", name, exc_info=True)
+            result = None
+        seconds = time.perf_counter() - start
+        record_span("warmup." + name, seconds, start=start)
+        timings[name] = round(seconds, 3)
+        return result
+
+    vector, _ = await asyncio.gather(step("openai", _warm_embeddings), step("firebase", _warm_firebase))
+    if vector is not None:
+        await step("vectordb", _warm_vectordb, vector)
+    return timings
+
+
+_first_answer_sent = False
+
+
+def _record_first_answer():
+    # Tempo dall'avvio del processo alla prima risposta inviata: il costo reale di un riavvio o di un deploy
+    global _first_answer_sent
+    if not _first_answer_sent:
+        _first_answer_sent = True
+        seconds = time.perf_counter() - _PROCESS_START
+        record_span("startup.first_answer", seconds, start=_PROCESS_START)
+        logger.info("Prima risposta dopo %.2fs dall'avvio del processo", seconds)
+
 
-####### Configurazione del sistema di logging del bot
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-logger = logging.getLogger(__name__)
 
 
 ####### Definizione di un gestore di comando (start)
@@ -119,39 +195,37 @@ logger = logging.getLogger(__name__)
 # * context: Contiene il contesto dell'aggiornamento.
 # 
 # All'interno della funzione, viene estratto l'utente che ha inviato l'aggiornamento.
-# Successivamente, viene controllato se esiste già una memoria associata a quell'utente nell'archivio Firebase.
+# Successivamente, viene controllato se esiste già una memoria associata a quell'utente (nella cache delle memorie o, se assente, nell'archivio Firebase).
 # 
 # Se la memoria esiste, viene inviato un messaggio di benvenuto abbreviato. 
-# Se la memoria non esiste, viene creata una nuova ConversationBufferWindowMemory, serializzata e salvata nell'archivio Firebase. 
+# Se la memoria non esiste, viene creata una nuova ConversationBufferWindowMemory e messa in cache: verrà salvata nell'archivio Firebase in background. 
 # Viene quindi inviato un messaggio di benvenuto più lungo che presenta il bot AIDA e le sue capacità.
 
 # Define a few command handlers. These usually take the two arguments update and
 # context.
+@traced("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     user = update.effective_user
 
-    ref_mem = db.reference('/chats/'+str(user.id)+'/memory/')
-    snapshot_mem = ref_mem.get()
-
-    
+    memory_cache = context.bot_data["memory_cache"]
+    async with context.bot_data["agent_runner"].user_turn(user.id):
+        chat_mem = await memory_cache.get(user.id)
+        if chat_mem is None:
+            memory_cache.put(user.id, new_memory())
 
-    if snapshot_mem is not None :
-        await update.message.reply_html(
+    if chat_mem is not None :
+        with span("telegram.send"):
+            await update.message.reply_html(
             f"""Ciao {user.first_name}!
 Come posso aiutarti?
         """,          
-        )
+            )
 
     else:
 
-        chat_mem = ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, k = 5)
-        
-   
-        ref_mem.set(pickle.dumps(chat_mem).hex())
-        
-
-        await update.message.reply_html(
+        with span("telegram.send"):
+            await update.message.reply_html(
             rf"""Ciao {user.mention_html()}!
 Ciao! Sono AIDA, la tua assistente virtuale specializzata nell'orientamento tra le offerte formative dell'Università degli Studi di Milano-Bicocca. 
 Che tu abbia finito le scuole superiori o che tu abbia finito una laurea triennale, sono ciò che fa per te!
@@ -173,162 +247,254 @@ Potrebbe dare nomi di corsi di laurea che non sono presenti in Bicocca e potrebb
 
 Puoi utilizzare /reset se hai bisogno di cancellare la mia memoria.""",
             
-        )
+            )
+    _record_first_answer()
 
 
 ####### Questa funzione viene chiamata quando l'utente invia il comando /reset. Questa funzione esegue le seguenti azioni:
 # 
 # * Prende l'utente che ha inviato l'aggiornamento.
-# * Ottiene un riferimento al nodo della memoria dell'utente nell'archivio Firebase.
 # * Crea una nuova ConversationBufferWindowMemory.
-# * Serializza la nuova memoria e la salva nell'archivio Firebase.
+# * Sostituisce la memoria dell'utente nella cache (verrà salvata nell'archivio Firebase in background).
 # * Invia un'emoji di espressione sorpresa 😵‍💫 e un messaggio indicando che la memoria è stata cancellata.
 
+@traced("reset")
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
     user = update.effective_user
-    ref_mem = db.reference('/chats/'+str(user.id)+'/memory/')
-    
-
-    chat_mem = ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, k = 5)
-    
-    
-    ref_mem.set(pickle.dumps(chat_mem).hex())
-    
 
+    # Attende la fine dell'eventuale risposta in corso per lo stesso utente prima di cancellare la memoria
+    async with context.bot_data["agent_runner"].user_turn(user.id):
+        context.bot_data["memory_cache"].put(user.id, new_memory())
 
-    await update.message.reply_text("😵‍💫")
-    await update.message.reply_text("Possiamo parlare di un altro argomento, mi sono dimenticata di tutto ciò che mi hai detto.")
+    with span("telegram.send"):
+        await update.message.reply_text("😵‍💫")
+    with span("telegram.send"):
+        await update.message.reply_text("Possiamo parlare di un altro argomento, mi sono dimenticata di tutto ciò che mi hai detto.")
 
 
 
 ####### Questa funzione viene chiamata quando l'utente invia un messaggio di testo. Esegue le seguenti azioni:
 # 
-# * Prende l'utente che ha inviato il messaggio e l'ID della chat.
-# * Invia casualmente un'emoji di attesa tra un elenco di emoji definite in waitingEmoji.
-# * Ottiene un riferimento alla memoria dell'utente nell'archivio Firebase.
-# * Carica la memoria serializzata e la converte in un oggetto di tipo ConversationBufferWindowMemory.
-# * Configura Conversational retrieval chain (qa) utilizzando l'agente ChatOpenAI, il recupero dal database di vettori e la memoria.
-# * Configura un altro agente di tipo ChatOpenAI (llm) per ulteriori operazioni.
-# * Definisce una lista di strumenti (tools) che l'agente può utilizzare, incluso il "Bicocca QA System" e il "Thought Processing".
-# * Inizializza l'agente con i tool definiti.
-# * Imposta il template del prompt dell'agente.
-# * Esegue l'agente con l'input del messaggio dell'utente e ottiene una risposta.
-# * Aggiorna la memoria nell'archivio Firebase con la nuova memoria dell'agente.
-# * Cerca di cancellare il messaggio precedente dell'utente (potrebbe generare un'eccezione se non riesce).
-# * Invia la risposta dell'agente come messaggio.
-
-
+# * Prende l'utente che ha inviato il messaggio.
+# * Raggruppa i messaggi dell'utente (MessageCoalescer): un messaggio che trova l'utente libero prosegue subito; quelli
+#   che arrivano mentre il precedente è in coda o in esecuzione vengono uniti in un'unica domanda, elaborata appena il
+#   precedente termina. Gli handler dei messaggi aggiunti a un gruppo terminano subito.
+# * Classifica il messaggio (IntentRouter): saluti e domande sul bot ricevono subito una risposta da template,
+#   senza LLM, come le richieste di corsi adatti a competenze o professioni (grafo di aida_skills); le domande sui
+#   corsi vanno direttamente alla Conversational retrieval chain; il resto all'agente.
+# * Chiede un posto al controllo di ammissione (AdmissionController): se le esecuzioni in corso e in attesa sono
+#   troppe, risponde che il bot è occupato invece di accodare un'altra chiamata all'LLM.
+# * Attende il proprio turno: i messaggi di uno stesso utente vengono elaborati in ordine, uno alla volta.
+# * Invia casualmente un'emoji di attesa tra un elenco di emoji definite in waitingEmoji: il messaggio fa da segnaposto per la risposta.
+# * Ottiene la memoria dell'utente (ConversationBufferWindowMemory) dalla cache; solo in caso di miss viene letta dall'archivio Firebase.
+# * Associa la memoria alla chain o all'agente della pipeline condivisa (costruita una sola volta in main()).
+# * Esegue la chain o l'agente con l'input del messaggio dell'utente in un thread separato (AgentRunner): la risposta
+#   finale viene mostrata mentre viene generata, modificando il segnaposto a intervalli regolari (TelegramStreamHandler).
+# * Segna la memoria come modificata: viene scritta nell'archivio Firebase in background, a batch.
+# * Sostituisce il segnaposto con la risposta completa dell'agente.
+# Ogni messaggio ha una traccia (aida_tracing): firebase, LLM, retriever e chiamate a Telegram vengono misurati.
+
+
+@traced("echo")
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Echo the user message."""
-    # Ottieni l'utente che ha inviato il messaggio e l'ID della chat
+    # Ottieni l'utente che ha inviato il messaggio
     user = update.effective_user
-    chat_id = update.effective_chat.id
-
-    # Lista di emoji che indicano all'utente che il bot sta elaborando la richiesta
-    waitingEmoji = ["🤔", "💭", "🔎", "💬"]
-
-    # Invia un messaggio all'utente con un'emoji scelta casualmente
-    await update.message.reply_text(random.choice(waitingEmoji))
-
-    # Ottieni un riferimento al nodo della memoria dell'utente nell'archivio Firebase
-    ref_mem = db.reference('/chats/'+str(user.id)+'/memory/')
-    # Ottieni lo snapshot della memoria attuale dell'utente
-    snapshot_mem = ref_mem.get()
-    # Deserializza e assegna la memoria
-    memory = pickle.loads(bytes.fromhex(snapshot_mem))
-
-    # Creazione di un oggetto ConversationalRetrievalChain che serve per rispondere alle domande poste dall'utente cercando i documenti con conenuto più simili alla domanda dell'utente all'interno del vectordb
-    # la ricerca viene effettuata per similarità e vengono presi i 4 documenti più simili
-
-    qa = ConversationalRetrievalChain.from_llm(ChatOpenAI(temperature=0, model_name=AIDAkeys.modelName),
-                                           verbose=True,
-                                           retriever=vectordb.as_retriever(search_type="similarity", search_kwargs={"k":4}),
-                                           memory=memory,
-                                           chain_type="stuff",
-                                           condense_question_llm=ChatOpenAI(temperature=0, model_name=AIDAkeys.modelName), # condensa la domanda corrente e la chat history in una standalone question (necessario per creare un standalone vector per effettuare il retrieval)
-                                           combine_docs_chain_kwargs={'prompt': prompt}
-                                       )
-
-    # Caricato il LLM che viene utilizzato per controllare l'agente
-    llm = ChatOpenAI(temperature=0, model_name=AIDAkeys.modelName)
-
-    # Definizione di una lista di strumenti
-
-    # Il primo tool serve per rispondere a domande specifiche relative ai documenti, quindi viene utilizzato quando per rispondere alla domanda serve accedere al vectordb
-    # Il secondo tool serve per rispondere a domande più generiche che non richiedono il retrieval di documenti, quindi domande a carattere più generico (es. Come ti chiami? oppure Ciao!)
-    tools = [
-        Tool(
-            name="Bicocca QA System",
-            func=qa.run,
-            description="""useful for when you need to answer questions about courses at the University of Milano-Bicocca. It is useful when the user asks for suggestions and advices. It allows you to find information into document of degree programs or teachings belonging to a degree program.
-            This tool is useful when the user asks for informations about University of Milano-Bicocca aspects. Input should be a question."""
-        ),
-        Tool(
-            name="Thought Processing",
-            description="""This is useful for when you have a thought that you want to use in a task,
-            but you want to make sure it's formatted correctly.
-            Input is your thought and self-critique and output is the processed thought.""",
-            func=processThought,
-        )
-    ]
-
-    # Inizializzazione dell'agente
-    agent = initialize_agent(tools, # due tool da usare
-                             llm, # LLM che guida e controlla l'agent
-                             agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION, # scelto perchè è un agent ottimizzato per le conversazioni
-                             verbose=True,
-                             memory=memory,
-                             agent_kwargs={
-                                 "input_variables": ["input", "agent_scratchpad", "chat_history"], # Additional keyword arguments to pass to the underlying agent
-                             },
-                             handle_parsing_errors=True,
-                             )
-
-# we need an agent_scratchpad input variable to put notes on previous actions and observations.
-# This should almost always be the final part of the prompt.
-# This is a very important step, because without the agent_scratchpad the agent will have no context on the previous actions it has taken.
-
-
-    # Stampa il testo del messaggio inviato dall'utente
-    print(update.message.text)
-
-    # Imposta il template del prompt dell'agente
-    agent.agent.llm_chain.prompt.template = AIDAkeys.templateAgent
-
-    # Esegue l'agente con l'input del messaggio e ottiene una risposta
-    response = agent.run(input=str(update.message.text))
-
-    # Serializza e salva la memoria dell'agente nell'archivio Firebase
-    ref_mem.set(pickle.dumps(agent.memory).hex())
-
-    # Ottieni l'ID del messaggio inviato dall'utente
-    message_id = update.effective_message.message_id
-
-    try:
-        # Prova a cancellare il messaggio precedente dell'utente
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id+1)
-    except:
-        # Se non riesce, invia un messaggio di errore all'utente
-        await update.message.reply_text("Si è verificato un errore riprova")
-        return
-
-    # Invia la risposta dell'agente come messaggio all'utente
-    await update.message.reply_text(response)
-
-    # Libera la memoria eliminando gli oggetti qa e agent
-    del qa
-    del agent
 
+    # I messaggi inviati dall'utente mentre il precedente è ancora in elaborazione diventano un'unica domanda;
+    # il turno del gruppo termina all'uscita dal blocco, quando è stata inviata la risposta
+    async with context.bot_data["coalescer"].turn(user.id, str(update.message.text)) as text:
+        if text is None:
+            current_trace().attributes["coalesced"] = True
+            return
+        await _answer(update, context, user, text)
+
+
+async def _answer(update, context, user, text):
+    # Il testo del messaggio inviato dall'utente finisce nel log solo in modalità verbose (AIDA_VERBOSE=1)
+    if VERBOSE:
+        logger.info("Messaggio di %s: %s", user.id, text)
+
+    runner = context.bot_data["agent_runner"]
+    memory_cache = context.bot_data["memory_cache"]
+
+    # Saluti, ringraziamenti e domande sul bot: risposta da template, senza nessuna chiamata all'LLM
+    route = context.bot_data["router"].route(text)
+    current_trace().attributes["route"] = route.intent
+    if route.answer is not None:
+        async with runner.user_turn(user.id):
+            # Ottieni la memoria dell'utente dalla cache (letta dall'archivio Firebase solo se non è già in RAM)
+            memory = await memory_cache.get_or_create(user.id)
+            memory.chat_memory.add_user_message(text)
+            memory.chat_memory.add_ai_message(route.answer)
+            memory_cache.mark_dirty(user.id, memory)
+            with span("telegram.send"):
+                await update.message.reply_text(route.answer)
+        _record_first_answer()
+        return
 
-###### Questa funzione avvia l'applicazione del bot. 
-# Crea un'istanza di Application, aggiunge gestori di comandi (CommandHandler) per i comandi /start e /reset, e un gestore di messaggi (MessageHandler) per gli altri messaggi di testo. 
-# Infine, avvia il bot in modalità di ascolto.
+    # Sotto carico il messaggio viene scartato subito, invece di attendere dietro a troppe chiamate all'LLM
+    with context.bot_data["admission"].admit() as admitted:
+        if not admitted:
+            current_trace().attributes["shed"] = True
+            with span("telegram.send"):
+                await update.message.reply_text(BUSY_MESSAGE)
+            return
+
+        # I messaggi di uno stesso utente vengono elaborati uno alla volta, nell'ordine di arrivo
+        async with runner.user_turn(user.id):
+            # Ottieni la memoria dell'utente dalla cache (letta dall'archivio Firebase solo se non è già in RAM)
+            memory = await memory_cache.get_or_create(user.id)
+
+            # Lista di emoji che indicano all'utente che il bot sta elaborando la richiesta
+            waitingEmoji = ["🤔", "💭", "🔎", "💬"]
+
+            # Invia un messaggio all'utente con un'emoji scelta casualmente: verrà modificato con la risposta
+            with span("telegram.send"):
+                placeholder = await update.message.reply_text(random.choice(waitingEmoji))
+
+            # Esegue la chain o l'agente in un thread del pool, senza bloccare le chat degli altri utenti;
+            # i token della risposta finale vengono mostrati nel segnaposto man mano che arrivano.
+            # I callback di LangChain vengono importati qui (una sola volta): importare il bot non carica LangChain
+            from aida_streaming import TelegramStreamHandler
+            from aida_tracing import tracing_handler
+            pipeline = context.bot_data["pipeline"]
+            if route.intent == COURSE:
+                # Domanda sui corsi: direttamente alla Conversational retrieval chain, senza i passaggi dell'agente.
+                # Viene mostrata in streaming tutta la risposta dell'LLM (non c'è il prefisso "AI:" dell'agente)
+                qa = pipeline.bind_qa(memory)
+                stream = TelegramStreamHandler(placeholder, asyncio.get_running_loop(), answer_prefix="")
+                response = await runner.run(qa.run, question=text, callbacks=[stream, tracing_handler])
+            else:
+                # Associa la memoria dell'utente alla pipeline condivisa (qa chain, LLM, retriever e tool sono costruiti una sola volta in main())
+                agent = pipeline.bind(memory)
+                stream = TelegramStreamHandler(placeholder, asyncio.get_running_loop())
+                response = await runner.run(agent.run, input=text, callbacks=[stream, tracing_handler])
+
+            # Segna la memoria dell'agente come da salvare: la scrittura nell'archivio Firebase avviene in background
+            memory_cache.mark_dirty(user.id, memory)
+
+            # Sostituisce il segnaposto con la risposta completa dell'agente
+            await stream.finish(response)
+    _record_first_answer()
+
+
+####### Avvio e arresto della cache delle memorie: il task di scrittura differita parte con il bot
+# e alla chiusura il pool dell'agente viene chiuso e poi tutte le memorie non ancora salvate vengono scritte su Firebase.
+
+async def post_init(application: Application) -> None:
+    await application.bot_data["memory_cache"].start()
+    # Riscaldamento prima dell'inizio del polling: la prima domanda non paga l'apertura di indice e connessioni
+    timings = await warm_up()
+    logger.info("Riscaldamento: %s; avvio completato in %.2fs", timings, time.perf_counter() - _PROCESS_START)
+
+
+async def post_shutdown(application: Application) -> None:
+    from aida_streaming import stream_stats
+    # Le esecuzioni dell'agente ancora in corso terminano in un thread, senza bloccare l'event loop: le loro
+    # memorie vengono segnate come da salvare prima della chiusura della cache, che le scrive su Firebase
+    await asyncio.to_thread(application.bot_data["agent_runner"].shutdown)
+    await application.bot_data["memory_cache"].close()
+    logger.info("Cache delle risposte: %s", application.bot_data["answer_cache"].stats())
+    logger.info("Cache degli embedding: %s", get_embeddings().stats())
+    logger.info("Latenza delle risposte: %s", stream_stats.summary())
+    logger.info("Messaggi per rotta: %s", dict(application.bot_data["router"].counts))
+    logger.info("Ammissione dei messaggi: %s", application.bot_data["admission"].stats())
+    logger.info("Latenza per passaggio: %s", metrics.snapshot()["stages"])
+
+
+###### Questa funzione crea l'applicazione del bot. 
+# Crea un'istanza di Application e la pipeline condivisa di risposta, aggiunge gestori di comandi (CommandHandler) per i comandi /start e /reset, e un gestore di messaggi (MessageHandler) per gli altri messaggi di testo. 
+# Con polling=False l'Application non ha un Updater: gli update le vengono passati dall'esterno (worker di aida_webhook).
+
+def build_application(polling=True, metrics_port=METRICS_PORT) -> Application:
+    """Create the bot Application with the shared pipeline and the handlers."""
+    # Stack di LangChain e moduli della pipeline: importati solo all'avvio del bot, non all'import del modulo
+    from langchain.chat_models import ChatOpenAI
+    from aida_pipeline import AidaPipeline, build_prompt
+    from aida_answer_cache import SemanticAnswerCache
+    from aida_filters import FilteredRetriever, known_cities
+    from aida_lexical import HybridRetriever, LexicalIndex, LEXICAL_INDEX_NAME
+    from course_catalog import COURSE_CATALOG_PATH, CourseCatalog
+    from aida_skills import SKILL_GRAPH_PATH, SkillGraph
+
+    build_start = time.perf_counter()
+    AIDAkeys = get_keys()
+    init_firebase()
+    embeddings = get_embeddings()
+    vectordb = get_vectordb()
 
-def main() -> None:
-    """Start the bot."""
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(AIDAkeys.telegramBOTtoken).build()
+    builder = (
+        Application.builder()
+        .token(AIDAkeys.telegramBOTtoken)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(True) # i messaggi di utenti diversi vengono gestiti in parallelo
+    )
+    if not polling:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Cache LRU delle memorie degli utenti con scrittura differita su Firebase
+    application.bot_data["memory_cache"] = MemoryCache()
+
+    # Pool di thread per le esecuzioni dell'agente, con limite globale di concorrenza e ordine per utente
+    application.bot_data["agent_runner"] = AgentRunner()
+
+    # Raggruppamento dei messaggi ravvicinati di ogni utente e limite ai messaggi in attesa dell'agente
+    application.bot_data["coalescer"] = MessageCoalescer()
+    application.bot_data["admission"] = AdmissionController(max_active=application.bot_data["agent_runner"].max_concurrency)
+
+    # Istogrammi di latenza e contatori su http://127.0.0.1:<AIDA_METRICS_PORT>/metrics
+    start_metrics_server(metrics_port)
+
+    # Grafo competenze-corsi (aida_skills.py build, aggiornato anche da aida_ingest): corsi adatti a competenze e
+    # professioni, senza LLM
+    skill_graph = SkillGraph(SKILL_GRAPH_PATH) if os.path.exists(SKILL_GRAPH_PATH) else None
+    application.bot_data["skill_graph"] = skill_graph
+
+    # Router delle intenzioni: template per i saluti, grafo delle competenze per interessi e professioni,
+    # retrieval chain per le domande sui corsi, agente per il resto
+    application.bot_data["router"] = IntentRouter(skill_graph=skill_graph)
+
+    # Catalogo dei corsi (course_catalog.py build, aggiornato anche da aida_ingest): le città dei corsi vengono
+    # lette dai suoi indici invece che scorrendo i metadati di tutti i chunk della collection
+    catalog = CourseCatalog(COURSE_CATALOG_PATH) if os.path.exists(COURSE_CATALOG_PATH) else None
+    application.bot_data["course_catalog"] = catalog
+    if catalog is not None:
+        cities = catalog.cities()
+    else:
+        cities = vectordb.cities() if VECTOR_BACKEND == "mmap" else known_cities(vectordb)
+
+    # Cache semantica delle risposte, svuotata quando la collection ChromaDB (o la sua esportazione) viene aggiornata;
+    # una risposta viene riutilizzata solo per domande con gli stessi vincoli (livello, lingua, città, codici...)
+    application.bot_data["answer_cache"] = SemanticAnswerCache(embeddings, version_fn=vectordb_version,
+                                                               cities=tuple(cities))
+
+    # Pipeline condivisa: i tre client ChatOpenAI, il retriever, il prompt e i tool vengono creati una sola volta.
+    # Il retriever cerca per similarità i 4 documenti più simili, limitando la ricerca ai corsi che rispettano i vincoli
+    # espressi nella domanda (livello, lingua, tipo di accesso, classe di laurea, città). I suoi risultati vengono fusi
+    # con quelli dell'indice lessicale BM25; le domande con un codice esatto (L-31, LM-18, codice SUA) usano solo quest'ultimo
+    application.bot_data["pipeline"] = AidaPipeline(
+        llm=ChatOpenAI(temperature=0, model_name=AIDAkeys.modelName, streaming=True), # LLM che guida e controlla l'agent (in streaming per mostrare la risposta mentre viene generata)
+        qa_llm=ChatOpenAI(temperature=0, model_name=AIDAkeys.modelName, streaming=True),
+        condense_llm=ChatOpenAI(temperature=0, model_name=AIDAkeys.modelName),
+        retriever=HybridRetriever(
+            lexical_index=LexicalIndex(os.path.join(persist_directory, LEXICAL_INDEX_NAME)),
+            vector_retriever=FilteredRetriever(vectorstore=vectordb, k=4, cities=tuple(cities)),
+            k=4,
+        ),
+        prompt=build_prompt(AIDAkeys.template),
+        agent_template=AIDAkeys.templateAgent,
+        answer_cache=application.bot_data["answer_cache"],
+        skill_graph=skill_graph, # tool dell'agente per le domande su competenze e professioni
+        verbose=VERBOSE, # output delle chain solo con AIDA_VERBOSE=1: in produzione costa I/O a ogni richiesta
+    )
+    record_span("startup.build", time.perf_counter() - build_start, start=build_start)
+    logger.info("Client e pipeline creati in %.2fs (%.2fs dall'avvio del processo)",
+                time.perf_counter() - build_start, time.perf_counter() - _PROCESS_START)
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
@@ -336,9 +502,21 @@ def main() -> None:
 
     # on non command i.e message - echo the message on Telegram
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
+    return application
+
+
+###### Questa funzione avvia il bot in modalità di ascolto (polling), in un solo processo.
+# Per servire più processi dietro un webhook: python aida_webhook.py
+
+def main() -> None:
+    """Start the bot."""
+    # Enable logging
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling()
+    build_application().run_polling()
 
 
 
@@ -0,0 +1,163 @@
+"""
+Persistent cache of embeddings.
+
+CachedEmbeddings wraps the embeddings object given to Chroma: texts already
+embedded (by this process, by another worker or before a restart) are read
+from a local SQLite file instead of being sent to the embeddings API.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain.embeddings.base import Embeddings
+
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = 'embeddings_cache.sqlite3'
+EMBEDDING_CACHE_SIZE = 200000     # numero massimo di vettori salvati
+EVICTION_CHECK_EVERY = 500        # inserimenti tra due controlli della dimensione
+TOUCH_INTERVAL = 3600             # secondi: l'istante di ultimo uso viene aggiornato al più una volta ogni ora
+
+
+####### Cache degli embedding su SQLite
+#
+# * La chiave è lo sha256 del modello e del testo, il valore è il vettore in float32.
+# * Il file è in modalità WAL, così più processi (worker del bot, ingestion) possono leggerlo e scriverlo insieme.
+# * Ogni thread usa una propria connessione (gli embedding vengono calcolati nei thread dell'AgentRunner).
+# * Quando i vettori superano max_entries vengono eliminati quelli usati meno di recente.
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper backed by a size-bounded SQLite cache keyed by content hash."""
+
+    def __init__(self, embeddings, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_SIZE, namespace=None):
+        self.embeddings = embeddings
+        self.path = path
+        self.max_entries = max_entries
+        # Vettori di modelli diversi non devono mai essere confusi
+        self.namespace = namespace if namespace is not None else str(
+            getattr(embeddings, "model", None) or type(embeddings).__name__
+        )
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._inserts = 0
+        self._lock = threading.Lock()
+        # Crea subito il file e la tabella, così gli errori di percorso emergono all'avvio
+        self._connection()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            self._local.connection = connection
+        return connection
+
+    def _key(self, text):
+        return hashlib.sha256((self.namespace + "\0" + text).encode("utf-8")).digest()
+
+    def _lookup(self, keys):
+        connection = self._connection()
+        found = {}
+        now = int(time.time())
+        stale = []
+        # SQLite limita il numero di parametri per query: le chiavi vengono lette a blocchi
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = connection.execute(
+                "SELECT key, vector, last_used FROM embeddings WHERE key IN (%s)" % ",".join("?" * len(chunk)),
+                chunk,
+            ).fetchall()
+            for key, blob, last_used in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+                if now - last_used > TOUCH_INTERVAL:
+                    stale.append((now, key))
+        if stale:
+            connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", stale)
+        return found
+
+    def _store(self, items):
+        now = int(time.time())
+        connection = self._connection()
+        connection.execute("BEGIN")
+        connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, array("f", vector).tobytes(), now) for key, vector in items],
+        )
+        connection.execute("COMMIT")
+        with self._lock:
+            self._inserts += len(items)
+            check = self._inserts >= EVICTION_CHECK_EVERY
+            if check:
+                self._inserts = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used vectors above max_entries."""
+        connection = self._connection()
+        count = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM embeddings WHERE key IN"
+                " (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            logger.info("Cache degli embedding: eliminati %d vettori", excess)
+        return max(excess, 0)
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            with self._lock:
+                self.hits += 1
+            return found[key]
+
+        with self._lock:
+            self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        return vector
+
+    def stats(self):
+        """Return the hit/miss counters of this process."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
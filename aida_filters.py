@@ -0,0 +1,191 @@
+"""
+Metadata pre-filters for the course retrieval.
+
+The scraper stores structured fields for every course (degree level through
+duration and class codes, language, type of access, cities, class codes).
+At ingestion they are normalized into flat, filterable chunk metadata; at
+query time constraints stated in the question ("magistrale", "in inglese",
+"a numero programmato", "L-31", "a Milano"...) become a Chroma ``where``
+filter, so the similarity search only ranks the matching chunks.
+"""
+
+import re
+from typing import Any, Callable, Optional
+
+from langchain.schema import BaseRetriever
+
+from aida_tracing import span
+
+
+MAX_MULTI_VALUES = 3   # valori salvati per i campi multipli (cds_code_0.., city_0..)
+
+LEVELS = ("triennale", "magistrale", "ciclo_unico")
+ACCESS_TYPES = ("libero", "programmato_locale", "programmato_nazionale")
+
+
+####### Normalizzazione dei campi di metadata.txt (usata dall'ingestion)
+#
+# * level: triennale / magistrale / ciclo_unico, dalla durata e, in mancanza, dalla classe di laurea.
+# * language_code: it / en / multi, dal titolo dell'icona della lingua.
+# * access: libero / programmato_locale / programmato_nazionale, dal titolo dell'icona dell'accesso.
+# * cds_code_<i> e city_<i>: i valori delle liste come campi scalari (Chroma non filtra dentro le liste).
+
+def normalize_class_code(code):
+    """Normalize a degree class code: "l 31" -> "L-31", "lm18" -> "LM-18", "LMG/1" -> "LMG/01"."""
+    code = code.strip().upper()
+    match = re.fullmatch(r"(LMG)\s*[-/]?\s*(\d{1,2})", code)
+    if match:
+        return f"LMG/{int(match.group(2)):02d}"
+    match = re.fullmatch(r"(LM|L)\s*[-/]?\s*(\d{1,2})(\s*BIS)?", code)
+    if match:
+        return f"{match.group(1)}-{int(match.group(2))}" + (" bis" if match.group(3) else "")
+    return code
+
+
+def course_level(course_dict):
+    match = re.search(r"(\d+)", course_dict.get("duration") or "")
+    years = int(match.group(1)) if match else 0
+    if years == 3:
+        return "triennale"
+    if years == 2:
+        return "magistrale"
+    if years >= 5:
+        return "ciclo_unico"
+    codes = [normalize_class_code(code) for code in course_dict.get("cds_codes") or []]
+    if any(code.startswith("LMG") for code in codes):
+        return "ciclo_unico"
+    if any(code.startswith("LM") for code in codes):
+        return "magistrale"
+    if any(code.startswith("L") for code in codes):
+        return "triennale"
+    return ""
+
+
+def language_code(language_text):
+    text = (language_text or "").lower()
+    if "ingles" in text or "english" in text:
+        return "en" if "italian" not in text else "multi"
+    if "italian" in text:
+        return "it"
+    return "multi" if text else "it"
+
+
+def access_type(access_text):
+    text = (access_text or "").lower()
+    if "programmato" in text or "numero chiuso" in text:
+        return "programmato_nazionale" if "nazional" in text else "programmato_locale"
+    return "libero"
+
+
+def derive_filter_fields(course_dict):
+    """Return the flat, filterable fields derived from a metadata.txt record."""
+    fields = {
+        "level": course_level(course_dict),
+        "language_code": language_code(course_dict.get("language")),
+        "access": access_type(course_dict.get("type_of_access")),
+    }
+    codes = [normalize_class_code(code) for code in course_dict.get("cds_codes") or []]
+    cities = [city.strip() for city in course_dict.get("cities") or []]
+    for i in range(MAX_MULTI_VALUES):
+        fields[f"cds_code_{i}"] = codes[i] if i < len(codes) else ""
+        fields[f"city_{i}"] = cities[i].lower() if i < len(cities) else ""
+    return fields
+
+
+####### Analisi della domanda: vincoli espliciti -> filtro where di Chroma
+
+_LEVEL_PATTERNS = [
+    ("ciclo_unico", re.compile(r"\bciclo unico\b", re.IGNORECASE)),
+    ("magistrale", re.compile(r"\b(magistral[ei]|specialistic[ahe]+|master'?s degree|second[- ]cycle)\b", re.IGNORECASE)),
+    ("triennale", re.compile(r"\b(triennal[ei]|primo livello|bachelor'?s?|first[- ]cycle)\b", re.IGNORECASE)),
+]
+_LANGUAGE_PATTERNS = [
+    ("en", re.compile(r"\bin (lingua )?inglese\b|\b(in|taught in) english\b|\benglish[- ]taught\b", re.IGNORECASE)),
+    ("it", re.compile(r"\bin (lingua )?italian[oa]\b", re.IGNORECASE)),
+]
+_PROGRAMMED_PATTERN = re.compile(
+    r"\b(numero programmato|accesso programmato|numero chiuso|test d'?(ingresso|ammissione)|a numero limitato)\b",
+    re.IGNORECASE)
+_FREE_PATTERN = re.compile(r"\b(accesso libero|numero aperto|senza test|libero accesso)\b", re.IGNORECASE)
+_CLASS_CODE_PATTERN = re.compile(r"\b(LMG\s*/\s*\d{1,2}|LM\s*-?\s*\d{1,2}(?:\s*bis)?|L\s*-\s*\d{1,2})\b", re.IGNORECASE)
+
+
+def analyze_query(question, cities=()):
+    """Return the constraints stated in ``question`` as a dict of field -> accepted values."""
+    constraints = {}
+    for level, pattern in _LEVEL_PATTERNS:
+        if pattern.search(question):
+            constraints["level"] = [level]
+            break
+    for code, pattern in _LANGUAGE_PATTERNS:
+        if pattern.search(question):
+            constraints["language_code"] = [code, "multi"]
+            break
+    if _PROGRAMMED_PATTERN.search(question):
+        constraints["access"] = ["programmato_locale", "programmato_nazionale"]
+    elif _FREE_PATTERN.search(question):
+        constraints["access"] = ["libero"]
+
+    codes = sorted({normalize_class_code(match) for match in _CLASS_CODE_PATTERN.findall(question)})
+    if codes:
+        constraints["cds_code"] = codes
+
+    lowered = question.lower()
+    found_cities = sorted(city for city in cities if re.search(r"\b" + re.escape(city) + r"\b", lowered))
+    if found_cities:
+        constraints["city"] = found_cities
+    return constraints
+
+
+def _condition(field, values):
+    return {field: values[0]} if len(values) == 1 else {field: {"$in": list(values)}}
+
+
+def build_where(constraints):
+    """Translate analyze_query() constraints into a Chroma ``where`` filter (None if unconstrained)."""
+    clauses = []
+    for field, values in constraints.items():
+        if field in ("cds_code", "city"):
+            # Campo multiplo: il valore può trovarsi in una qualsiasi delle posizioni <field>_<i>
+            clauses.append({"$or": [_condition(f"{field}_{i}", values) for i in range(MAX_MULTI_VALUES)]})
+        else:
+            clauses.append(_condition(field, values))
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def known_cities(vectordb):
+    """Return the distinct (lowercase) course cities stored in the collection metadata."""
+    metadatas = vectordb._collection.get(include=["metadatas"])["metadatas"] or []
+    return sorted({metadata.get(f"city_{i}") for metadata in metadatas for i in range(MAX_MULTI_VALUES)} - {None, ""})
+
+
+####### Retriever con pre-filtro sui metadati
+#
+# La domanda (già condensata dalla ConversationalRetrievalChain) viene analizzata; se contiene vincoli la
+# ricerca per similarità avviene solo tra i chunk che li rispettano. Se il filtro non restituisce nulla
+# (vincolo troppo stretto o collection non ancora re-indicizzata con i nuovi campi) la ricerca viene ripetuta
+# senza filtro.
+
+class FilteredRetriever(BaseRetriever):
+    """Similarity retriever that turns constraints in the question into metadata pre-filters."""
+
+    vectorstore: Any
+    k: int = 4
+    cities: tuple = ()
+    analyzer: Optional[Callable] = None
+
+    def where_for(self, query):
+        constraints = (self.analyzer or analyze_query)(query, self.cities)
+        return build_where(constraints)
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        where = self.where_for(query)
+        if where is not None:
+            with span("chroma.query", filtered=True):
+                documents = self.vectorstore.similarity_search(query, k=self.k, filter=where)
+            if documents:
+                return documents
+        with span("chroma.query", filtered=False):
+            return self.vectorstore.similarity_search(query, k=self.k)
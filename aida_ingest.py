@@ -0,0 +1,321 @@
+"""
+Ingestion of the scraped courses into the ChromaDB_Bicocca_AIDA_FINAL collection.
+
+universitaly_bot writes one SUA PDF and one metadata.txt per course under
+./universities/<uni>/<course>_<sua_code>/. This command extracts and chunks the
+PDF text in a process pool, attaches the metadata.txt fields to every chunk and
+adds the chunks to the vector store in embedding batches. A manifest of content
+hashes makes re-runs incremental: only new or changed courses are re-embedded,
+and the chunks of courses removed from the tree are deleted. The BM25 index of
+aida_lexical is kept in sync with the same chunks, and so are the course
+catalog (course_catalog) and the skill-course graph (aida_skills). With
+--changes only the courses in the change list written by universitaly_bot are
+looked at.
+
+Usage:
+python aida_ingest.py [--root ./universities] [--persist-directory ChromaDB_Bicocca_AIDA_FINAL] [--workers 4]
+                      [--changes crawl_changes.json]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from aida_filters import derive_filter_fields
+
+
+logger = logging.getLogger(__name__)
+
+UNIVERSITIES_ROOT = './universities'
+PERSIST_DIRECTORY = 'ChromaDB_Bicocca_AIDA_FINAL'
+MANIFEST_NAME = 'ingest_manifest.json'
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+EMBED_BATCH_SIZE = 256       # chunk per singola chiamata di embedding
+INGEST_SCHEMA_VERSION = 2    # da incrementare quando cambiano chunking o metadati: forza la re-ingestion
+
+
+####### Individuazione dei corsi nell'albero ./universities/<uni>/<course>_<sua_code>/
+#
+# Un corso è pronto per l'ingestion quando la cartella contiene sia il PDF sia metadata.txt.
+# La chiave del corso è il percorso relativo "<uni>/<course>_<sua_code>".
+
+def iter_course_dirs(root=UNIVERSITIES_ROOT):
+    """Yield (course_key, university, course_dir, pdf_path, metadata_path) for every complete course."""
+    if not os.path.isdir(root):
+        return
+    for university in sorted(os.listdir(root)):
+        university_dir = os.path.join(root, university)
+        if not os.path.isdir(university_dir):
+            continue
+        for course in sorted(os.listdir(university_dir)):
+            course_dir = os.path.join(university_dir, course)
+            pdf_path = os.path.join(course_dir, course + ".pdf")
+            metadata_path = os.path.join(course_dir, "metadata.txt")
+            if os.path.isfile(pdf_path) and os.path.isfile(metadata_path):
+                yield university + "/" + course, university, course_dir, pdf_path, metadata_path
+
+
+def content_hash(*paths):
+    """Return the sha256 of the given files (and of the ingestion schema version)."""
+    digest = hashlib.sha256(str(INGEST_SCHEMA_VERSION).encode("ascii"))
+    for path in paths:
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def course_metadata(course_dict, university, course_key):
+    """Flatten a metadata.txt record into chunk metadata (Chroma accepts only scalar values).
+
+    The normalized fields used by the retrieval pre-filters (level,
+    language_code, access, cds_code_<i>, city_<i>) are added as well.
+    """
+    metadata = {"university": university, "course_key": course_key}
+    for field, value in course_dict.items():
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        elif value is None:
+            value = ""
+        metadata[field] = value
+    metadata.update(derive_filter_fields(course_dict))
+    return metadata
+
+
+def extract_pdf_text(pdf_path):
+    """Return the text of a PDF, pages separated by blank lines."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def chunk_id(course_key, index):
+    return hashlib.sha1(course_key.encode("utf-8")).hexdigest()[:16] + ":" + str(index)
+
+
+####### Lavoro svolto nei processi del pool: estrazione del testo e chunking di un corso
+
+def extract_course(course_key, university, pdf_path, metadata_path, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Return the (ids, texts, metadatas) chunks of one course."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    with open(metadata_path, encoding="utf-8") as file:
+        course_dict = json.load(file)
+    metadata = course_metadata(course_dict, university, course_key)
+    metadata["source"] = pdf_path
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    texts = splitter.split_text(extract_pdf_text(pdf_path))
+    # Il nome del corso in testa a ogni chunk lo rende recuperabile anche quando il testo del PDF non lo ripete
+    texts = [course_dict.get("name", "") + "\n" + text for text in texts if text.strip()]
+    ids = [chunk_id(course_key, i) for i in range(len(texts))]
+    return ids, texts, [dict(metadata, chunk=i) for i in range(len(texts))]
+
+
+####### Manifest dell'ingestion: course_key -> hash del contenuto e numero di chunk
+
+def load_change_list(path):
+    """Return the course keys of a change list written by universitaly_bot / crawl_manifest."""
+    with open(path) as file:
+        return {entry["course_key"] for entry in json.load(file)["changes"]}
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(path, manifest):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+
+
+####### Ingestion incrementale
+#
+# 1. Calcola l'hash di PDF e metadata.txt di ogni corso e lo confronta con il manifest.
+# 2. Estrae testo e chunk dei corsi nuovi o modificati in un pool di processi.
+# 3. Appena i chunk pronti raggiungono batch_size, rimuove i vecchi chunk di quei corsi e aggiunge i nuovi
+#    con una sola chiamata di embedding; il manifest viene salvato dopo ogni batch, così un'interruzione
+#    non fa perdere il lavoro già fatto.
+# 4. Rimuove i chunk dei corsi non più presenti e aggiorna la versione della collection (usata dalla
+#    cache semantica delle risposte).
+
+class Ingestor:
+    """Incremental ingestion of the universities tree into a Chroma vector store."""
+
+    def __init__(self, vectordb, manifest_path, workers=None, batch_size=EMBED_BATCH_SIZE, lexical_index=None):
+        self.vectordb = vectordb
+        self.lexical_index = lexical_index
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.manifest = load_manifest(manifest_path)
+        self.stats = {"courses": 0, "changed": 0, "unchanged": 0, "removed": 0, "failed": 0,
+                      "chunks": 0, "embedding_calls": 0, "chunk_embeddings_saved": 0}
+        self._pending = []   # (course_key, hash, ids, texts, metadatas)
+
+    def run(self, root=UNIVERSITIES_ROOT, full=False, only=None):
+        # only: chiavi dei corsi da considerare (elenco delle modifiche del crawl); gli altri non vengono letti
+        start = time.perf_counter()
+        changed = []
+        seen = set()
+        # Un indice lessicale nuovo (o incompleto) viene riempito con i corsi che gli mancano
+        lexical_keys = self.lexical_index.course_keys() if self.lexical_index is not None else None
+        for course_key, university, _, pdf_path, metadata_path in iter_course_dirs(root):
+            seen.add(course_key)
+            if only is not None and course_key not in only:
+                continue
+            self.stats["courses"] += 1
+            digest = content_hash(pdf_path, metadata_path)
+            previous = self.manifest.get(course_key)
+            missing_lexical = lexical_keys is not None and course_key not in lexical_keys
+            if not full and not missing_lexical and previous is not None and previous["hash"] == digest:
+                self.stats["unchanged"] += 1
+                self.stats["chunk_embeddings_saved"] += previous["chunks"]
+                continue
+            changed.append((course_key, university, pdf_path, metadata_path, digest))
+
+        logger.info("%d corsi trovati, %d da indicizzare", self.stats["courses"], len(changed))
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(extract_course, course_key, university, pdf_path, metadata_path): (course_key, digest)
+                       for course_key, university, pdf_path, metadata_path, digest in changed}
+            for future in as_completed(futures):
+                course_key, digest = futures[future]
+                try:
+                    ids, texts, metadatas = future.result()
+                except Exception:
+                    logger.exception("Estrazione non riuscita per %s", course_key)
+                    self.stats["failed"] += 1
+                    continue
+                self._pending.append((course_key, digest, ids, texts, metadatas))
+                if sum(len(item[2]) for item in self._pending) >= self.batch_size:
+                    self._flush()
+        self._flush()
+
+        removed = [course_key for course_key in self.manifest if course_key not in seen]
+        for course_key in removed:
+            self._remove_course(course_key)
+            del self.manifest[course_key]
+            self.stats["removed"] += 1
+        save_manifest(self.manifest_path, self.manifest)
+
+        if self.stats["changed"] or removed:
+            self._bump_collection_version()
+
+        elapsed = time.perf_counter() - start
+        self.stats["seconds"] = round(elapsed, 2)
+        self.stats["documents_per_second"] = round(self.stats["changed"] / elapsed, 2) if elapsed else 0.0
+        return self.stats
+
+    def _flush(self):
+        if not self._pending:
+            return
+        ids, texts, metadatas = [], [], []
+        for course_key, _, course_ids, course_texts, course_metadatas in self._pending:
+            self._delete_course(course_key)
+            if self.lexical_index is not None:
+                self.lexical_index.replace_course(course_key, course_ids, course_texts, course_metadatas)
+            ids.extend(course_ids)
+            texts.extend(course_texts)
+            metadatas.extend(course_metadatas)
+
+        for i in range(0, len(texts), self.batch_size):
+            self.vectordb.add_texts(texts[i:i + self.batch_size], metadatas=metadatas[i:i + self.batch_size],
+                                    ids=ids[i:i + self.batch_size])
+            self.stats["embedding_calls"] += 1
+
+        for course_key, digest, course_ids, _, _ in self._pending:
+            self.manifest[course_key] = {"hash": digest, "chunks": len(course_ids), "ingested_at": int(time.time())}
+            self.stats["changed"] += 1
+        self.stats["chunks"] += len(texts)
+        self._pending = []
+        save_manifest(self.manifest_path, self.manifest)
+        logger.info("Indicizzati %d corsi (%d chunk)", self.stats["changed"], self.stats["chunks"])
+
+    def _delete_course(self, course_key):
+        self.vectordb._collection.delete(where={"course_key": course_key})
+
+    def _remove_course(self, course_key):
+        self._delete_course(course_key)
+        if self.lexical_index is not None:
+            self.lexical_index.delete_course(course_key)
+
+    def _bump_collection_version(self):
+        collection = self.vectordb._collection
+        # Le impostazioni hnsw:* non possono essere modificate dopo la creazione della collection
+        metadata = {key: value for key, value in (collection.metadata or {}).items() if not key.startswith("hnsw:")}
+        metadata["version"] = str(int(time.time()))
+        collection.modify(metadata=metadata)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest the scraped universities tree into the AIDA vector store")
+    parser.add_argument("--root", default=UNIVERSITIES_ROOT)
+    parser.add_argument("--persist-directory", default=PERSIST_DIRECTORY)
+    parser.add_argument("--workers", type=int, default=None, help="processes for PDF extraction (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="chunks per embedding call")
+    parser.add_argument("--full", action="store_true", help="re-ingest every course, ignoring the manifest")
+    parser.add_argument("--changes", default=None, help="change list of the crawl: only these courses are checked")
+    parser.add_argument("--catalog", default=None, help="course catalog to update (default: course_catalog.sqlite3)")
+    parser.add_argument("--skill-graph", default=None, help="skill-course graph to update (default: skill_graph.json)")
+    parser.add_argument("--export-index", default=None, metavar="DIR",
+                        help="also export the collection for the memory-mapped backend (aida_vecindex)")
+    parser.add_argument("--export-dtype", choices=("float16", "int8"), default="float16")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+
+    import AIDAkeys
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from langchain.vectorstores import Chroma
+    from aida_embeddings import CachedEmbeddings
+    from aida_lexical import LexicalIndex, LEXICAL_INDEX_NAME
+    from course_catalog import COURSE_CATALOG_PATH, CourseCatalog
+    from aida_skills import SKILL_GRAPH_PATH, build_graph
+
+    os.environ['OPENAI_API_KEY'] = AIDAkeys.openAIkeyAndrea
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    vectordb = Chroma(persist_directory=args.persist_directory, embedding_function=embeddings)
+
+    ingestor = Ingestor(vectordb, os.path.join(args.persist_directory, MANIFEST_NAME),
+                        workers=args.workers, batch_size=args.batch_size,
+                        lexical_index=LexicalIndex(os.path.join(args.persist_directory, LEXICAL_INDEX_NAME)))
+    only = load_change_list(args.changes) if args.changes else None
+    stats = ingestor.run(root=args.root, full=args.full, only=only)
+    vectordb.persist()
+
+    # Il catalogo dei corsi rilegge solo i metadata.txt modificati
+    stats["catalog"] = CourseCatalog(args.catalog or COURSE_CATALOG_PATH).build(args.root)
+
+    # Il grafo delle competenze rielabora solo i corsi con PDF o metadata.txt modificati
+    stats["skill_graph"] = build_graph(args.root, args.skill_graph or SKILL_GRAPH_PATH, workers=args.workers)
+
+    # Esportazione per il backend mmap del bot: i worker la ricaricano da soli quando cambia
+    if args.export_index:
+        from aida_answer_cache import collection_version
+        from aida_vecindex import export_index
+
+        manifest = export_index(vectordb, args.export_index, dtype=args.export_dtype,
+                                version=collection_version(vectordb, args.persist_directory))
+        stats["vector_index"] = {"count": manifest["count"], "dtype": manifest["dtype"]}
+
+    # Chunk già presenti nella cache degli embedding: nessuna chiamata all'API per quei testi
+    stats["embedding_cache"] = embeddings.stats()
+    print(json.dumps(stats, indent=1))
+
+
+if __name__ == "__main__":
+    main()
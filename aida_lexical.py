@@ -0,0 +1,261 @@
+"""
+Local BM25 inverted index over the course chunks and hybrid lexical + vector retrieval.
+
+Course names, SUA codes and class codes (L-31, LM-18...) are exact tokens that
+dense similarity handles poorly. The index is built over the same chunks as
+the Chroma collection (aida_ingest keeps both up to date), stored on disk in
+SQLite and updated per course. HybridRetriever fuses its results with the
+vector results; questions that contain an exact code are answered by the
+index alone, without any embedding call, from the chunks of the courses with
+that code ranked on the whole question. Both paths keep only the chunks that
+satisfy the constraints of the question (level, language, access, city...),
+as the vector search does.
+"""
+
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any
+
+from langchain.schema import BaseRetriever, Document
+
+from aida_filters import normalize_class_code
+
+
+LEXICAL_INDEX_NAME = 'lexical_index.sqlite3'
+LEXICAL_INDEX_PATH = 'ChromaDB_Bicocca_AIDA_FINAL/' + LEXICAL_INDEX_NAME
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60               # costante della reciprocal rank fusion
+
+_TOKEN_PATTERN = re.compile(r"LMG/\d{1,2}|L[M]?-\d{1,2}|\w+", re.IGNORECASE)
+_CODE_PATTERN = re.compile(r"\b(LMG\s*/\s*\d{1,2}|LM\s*-?\s*\d{1,2}|L\s*-\s*\d{1,2}|\d{6,7})\b", re.IGNORECASE)
+_STOPWORDS = frozenset("""
+a ad al alla alle allo agli ai anche che chi ci come con cosa da dal dalla dei del della delle dello degli di e ed
+è gli ha ho i il in la le lo ma mi ne nel nella nei non o per più qual quale quali se si sono su sul sulla tra tu
+un una uno vorrei voglio the of and to in for is on
+""".split())
+
+
+def tokenize(text):
+    """Lowercase tokens; class codes (L-31, LM-18, LMG/01) are kept as single tokens."""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text):
+        if "-" in token or "/" in token:
+            tokens.append(normalize_class_code(token).lower())
+        else:
+            token = token.lower()
+            if token not in _STOPWORDS:
+                tokens.append(token)
+    return tokens
+
+
+def _indexed_text(text, metadata):
+    # Classi di laurea e codice SUA sono nei metadati, non sempre nel testo del PDF: vengono indicizzati anch'essi
+    return " ".join([text, str(metadata.get("cds_codes", "")), str(metadata.get("sua_code", ""))])
+
+
+def exact_codes(question):
+    """Return the class codes and SUA codes (6-7 digits) written in the question."""
+    codes = []
+    for match in _CODE_PATTERN.findall(question):
+        codes.append(match if match.isdigit() else normalize_class_code(match).lower())
+    return codes
+
+
+####### Indice invertito BM25 su SQLite
+#
+# * chunks: testo e metadati di ogni chunk, con la lunghezza in token e la chiave del corso.
+# * postings: (termine, chunk, frequenza); l'indice su term rende la lettura delle posting list immediata.
+# Numero di chunk e lunghezza media, usati da BM25, vengono calcolati a ogni ricerca con una sola query aggregata.
+# L'aggiornamento è per corso (replace_course), come nell'ingestion, quindi è incrementale.
+
+class LexicalIndex:
+    """BM25 inverted index over the course chunks, persisted in SQLite."""
+
+    def __init__(self, path=LEXICAL_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id TEXT PRIMARY KEY, course_key TEXT NOT NULL, length INTEGER NOT NULL,
+                    text TEXT NOT NULL, metadata TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS chunks_course ON chunks(course_key);
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS postings_term ON postings(term);
+                CREATE INDEX IF NOT EXISTS postings_chunk ON postings(chunk_id);
+            """)
+            self._local.connection = connection
+        return connection
+
+    def replace_course(self, course_key, ids, texts, metadatas):
+        """Replace all the chunks of a course (no chunks: remove the course)."""
+        connection = self._connection()
+        connection.execute("BEGIN")
+        try:
+            self._delete(connection, course_key)
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                tokens = tokenize(_indexed_text(text, metadata))
+                connection.execute(
+                    "INSERT OR REPLACE INTO chunks (id, course_key, length, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (chunk_id, course_key, len(tokens), text, json.dumps(metadata, ensure_ascii=False)),
+                )
+                connection.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in Counter(tokens).items()],
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def delete_course(self, course_key):
+        self.replace_course(course_key, [], [], [])
+
+    def course_keys(self):
+        """Return the keys of the indexed courses."""
+        return {row[0] for row in self._connection().execute("SELECT DISTINCT course_key FROM chunks")}
+
+    def _delete(self, connection, course_key):
+        connection.execute(
+            "DELETE FROM postings WHERE chunk_id IN (SELECT id FROM chunks WHERE course_key = ?)", (course_key,)
+        )
+        connection.execute("DELETE FROM chunks WHERE course_key = ?", (course_key,))
+
+    def search(self, query, k=4, where=None, codes=None):
+        """Return the top-k (Document, score) pairs by BM25 for the query.
+
+        With ``where`` (a build_where() filter) only the chunks whose metadata
+        satisfy it are ranked; with ``codes`` (see exact_codes) only the chunks
+        of the courses with one of those class or SUA codes.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        connection = self._connection()
+        count, total_length = connection.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+        if not count:
+            return []
+        average_length = total_length / count
+
+        # Vincoli e codici restringono le posting list nella query stessa: idf resta quello di tutto l'indice
+        conditions, parameters = [], []
+        if where is not None:
+            condition, where_parameters = _where_sql(where)
+            conditions.append(condition)
+            parameters.extend(where_parameters)
+        if codes:
+            conditions.append("p.chunk_id IN (SELECT chunk_id FROM postings WHERE term IN (%s))"
+                              % ", ".join("?" * len(codes)))
+            parameters.extend(codes)
+        constraint = "".join(" AND " + condition for condition in conditions)
+
+        scores = Counter()
+        for term in terms:
+            frequency = connection.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+            if not frequency:
+                continue
+            rows = connection.execute(
+                "SELECT p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id "
+                "WHERE p.term = ?" + constraint,
+                (term, *parameters),
+            ).fetchall()
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for chunk_id, tf, length in rows:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / norm
+
+        results = []
+        for chunk_id, score in scores.most_common(k):
+            text, metadata = connection.execute("SELECT text, metadata FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+            results.append((Document(page_content=text, metadata=json.loads(metadata)), score))
+        return results
+
+
+def _where_sql(where):
+    # Filtro build_where() -> condizione SQL sui metadati JSON del chunk (c.metadata), con i suoi parametri
+    conditions, parameters = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            clauses = [_where_sql(clause) for clause in value]
+            conditions.append("(" + (" AND " if key == "$and" else " OR ").join(sql for sql, _ in clauses) + ")")
+            for _, clause_parameters in clauses:
+                parameters.extend(clause_parameters)
+            continue
+        operator, expected = next(iter(value.items())) if isinstance(value, dict) else ("$eq", value)
+        if operator == "$eq":
+            conditions.append("json_extract(c.metadata, ?) = ?")
+            parameters.extend(["$." + key, expected])
+        elif operator == "$in":
+            conditions.append("json_extract(c.metadata, ?) IN (%s)" % ", ".join("?" * len(expected)))
+            parameters.extend(["$." + key, *expected])
+        else:
+            raise ValueError(f"Unsupported filter operator: {operator}")
+    return "(" + " AND ".join(conditions) + ")", parameters
+
+
+####### Retriever ibrido (BM25 + vettoriale)
+#
+# * I vincoli della domanda sono quelli del retriever vettoriale (FilteredRetriever.where_for): la ricerca BM25
+#   considera solo i chunk che li rispettano, come la ricerca vettoriale filtrata.
+# * Se la domanda contiene un codice esatto (classe di laurea o codice SUA) i candidati BM25 sono solo i chunk
+#   dei corsi con quel codice, ordinati con tutti i termini della domanda: se ce ne sono vengono restituiti
+#   senza embedding né ricerca vettoriale. Ad esempio "Quali esami ci sono nel corso L-31 a Milano?"
+#   restituisce i chunk dei corsi L-31 di Milano che parlano di esami.
+# * Altrimenti i risultati BM25 e quelli del retriever vettoriale (ad esempio il FilteredRetriever) vengono
+#   fusi con la reciprocal rank fusion e vengono restituiti i primi k.
+
+class HybridRetriever(BaseRetriever):
+    """Retriever fusing BM25 results with the results of a vector retriever."""
+
+    lexical_index: Any
+    vector_retriever: Any
+    k: int = 4
+    candidates: int = 10
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        where_for = getattr(self.vector_retriever, "where_for", None)
+        where = where_for(query) if where_for is not None else None
+        codes = exact_codes(query)
+        if codes:
+            matches = self.lexical_index.search(query, k=self.k, where=where, codes=codes)
+            if matches:
+                return [document for document, _ in matches]
+
+        lexical = [document for document, _ in self.lexical_index.search(query, k=self.candidates, where=where)]
+        vector = self.vector_retriever.get_relevant_documents(query)
+        return reciprocal_rank_fusion([lexical, vector], self.k)
+
+
+def _document_key(document):
+    metadata = document.metadata or {}
+    if "course_key" in metadata and "chunk" in metadata:
+        return (metadata["course_key"], metadata["chunk"])
+    return document.page_content
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """Fuse ranked lists of documents: score = sum of 1 / (RRF_K + rank)."""
+    scores = Counter()
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            key = _document_key(document)
+            documents.setdefault(key, document)
+            scores[key] += 1.0 / (RRF_K + rank + 1)
+    return [documents[key] for key, _ in scores.most_common(k)]
@@ -0,0 +1,327 @@
+"""
+Conversation memories: compact storage format and in-process cache with write-behind to Firebase.
+
+Active conversations are served from a bounded LRU cache with TTL eviction;
+modified memories are written to the Realtime Database in batches by a
+background task, and everything still dirty is flushed on shutdown.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import pickle
+import time
+import zlib
+from collections import OrderedDict
+
+# LangChain (memorie e messaggi) e firebase_admin vengono importati al primo uso: importare aida_memory (e il
+# bot) non li carica
+from aida_tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+MEMORY_CACHE_SIZE = 2000       # numero massimo di memorie tenute in RAM
+MEMORY_CACHE_TTL = 30 * 60     # secondi di inattività dopo i quali una memoria viene rimossa
+FLUSH_INTERVAL = 2.0           # secondi tra due scritture su Firebase
+FLUSH_BATCH_SIZE = 200         # numero massimo di memorie per singola update multi-path
+
+MEMORY_WINDOW = 5              # coppie di messaggi (domanda/risposta) conservate
+MEMORY_FORMAT_VERSION = 1
+COMPRESS_MIN_BYTES = 2048      # sopra questa dimensione i messaggi vengono compressi con zlib
+
+
+def _message(role, content):
+    from langchain.schema import AIMessage, HumanMessage, SystemMessage
+    return {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}.get(role, HumanMessage)(content=content)
+
+
+def new_memory():
+    """Return an empty conversation memory as used by the agent."""
+    from langchain.memory import ConversationBufferWindowMemory
+    return ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, k = MEMORY_WINDOW)
+
+
+####### Formato della memoria salvata in /chats/<id>/memory/
+#
+# Al posto dell'oggetto LangChain serializzato con pickle e codificato in esadecimale viene salvato un
+# dizionario JSON con la versione del formato, la finestra k e solo gli ultimi k scambi come record
+# {"role", "content"}:
+#
+#     {"v": 1, "k": 5, "messages": [{"role": "human", "content": "..."}, {"role": "ai", "content": "..."}]}
+#
+# Se i messaggi superano COMPRESS_MIN_BYTES vengono compressi con zlib e codificati in base64:
+#
+#     {"v": 1, "k": 5, "enc": "zlib", "data": "..."}
+#
+# I vecchi valori (stringhe esadecimali di pickle) vengono ancora letti e riscritti nel nuovo formato
+# al salvataggio successivo, oppure tutti insieme con: python aida_memory.py migrate
+
+def dump_memory(memory, compress=None):
+    """Serialize a memory for the /chats/<id>/memory/ node.
+
+    ``compress`` forces (True) or disables (False) zlib compression; by default
+    it is used only for payloads larger than COMPRESS_MIN_BYTES.
+    """
+    k = getattr(memory, "k", MEMORY_WINDOW)
+    messages = memory.chat_memory.messages[-2 * k:] if k > 0 else []
+    records = [{"role": message.type, "content": message.content} for message in messages]
+    snapshot = {"v": MEMORY_FORMAT_VERSION, "k": k}
+
+    raw = json.dumps(records, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if compress is None:
+        compress = len(raw) >= COMPRESS_MIN_BYTES
+    if compress:
+        snapshot["enc"] = "zlib"
+        snapshot["data"] = base64.b64encode(zlib.compress(raw, 6)).decode("ascii")
+    else:
+        snapshot["messages"] = records
+    return snapshot
+
+
+def load_memory(snapshot):
+    """Deserialize a memory read from the /chats/<id>/memory/ node (current or legacy format)."""
+    if isinstance(snapshot, str):
+        return _load_legacy_memory(snapshot)
+
+    version = snapshot.get("v")
+    if version != MEMORY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported memory format version: {version!r}")
+
+    if snapshot.get("enc") == "zlib":
+        records = json.loads(zlib.decompress(base64.b64decode(snapshot["data"])).decode("utf-8"))
+    else:
+        # Firebase non salva le liste vuote: una memoria senza messaggi torna senza la chiave "messages"
+        records = snapshot.get("messages") or []
+
+    memory = new_memory()
+    memory.k = snapshot.get("k", MEMORY_WINDOW)
+    memory.chat_memory.messages = [_message(record["role"], record["content"]) for record in records]
+    return memory
+
+
+def _load_legacy_memory(snapshot):
+    # Memoria salvata come pickle esadecimale: vengono conservati solo i messaggi, non l'oggetto LangChain
+    legacy = pickle.loads(bytes.fromhex(snapshot))
+    memory = new_memory()
+    k = getattr(legacy, "k", MEMORY_WINDOW)
+    memory.k = k
+    memory.chat_memory.messages = [_message(message.type, message.content)
+                                   for message in legacy.chat_memory.messages[-2 * k:]]
+    return memory
+
+
+def is_legacy_snapshot(snapshot):
+    """Return True if the stored value is a hex-encoded pickle of the old format."""
+    return isinstance(snapshot, str)
+
+
+####### Cache LRU delle memorie con scrittura differita (write-behind)
+#
+# * get() restituisce la memoria dalla cache; solo in caso di miss viene letta da Firebase (in un thread, senza bloccare l'event loop).
+# * put() e mark_dirty() serializzano subito la memoria e la segnano come da salvare: nessuna scrittura avviene nel percorso della risposta.
+# * Un task in background scrive le memorie modificate con una sola update multi-path per batch ed elimina le voci scadute o in eccesso.
+# * Le memorie rimosse dalla cache ma non ancora salvate restano in _dirty, quindi non vengono mai perse; close() le scrive tutte.
+# * Una memoria può essere rimossa dalla cache mentre l'agente la sta usando: mark_dirty() riceve la memoria modificata
+#   e la salva comunque, rimettendola in cache (è la versione più recente, i turni di un utente sono in sequenza).
+
+class MemoryCache:
+    """Bounded LRU/TTL cache of ConversationBufferWindowMemory objects keyed by user id."""
+
+    def __init__(self, root='/chats', maxsize=MEMORY_CACHE_SIZE, ttl=MEMORY_CACHE_TTL,
+                 flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE):
+        self.root = root
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._entries = OrderedDict()   # user_id -> (memory, ultimo accesso)
+        self._dirty = OrderedDict()     # user_id -> memoria serializzata da scrivere
+        self._loading = {}              # user_id -> Future della lettura in corso
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, user_id):
+        """Return the user's memory, or None if the user has none yet."""
+        user_id = str(user_id)
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._touch(user_id, entry[0])
+            return entry[0]
+
+        if user_id in self._dirty:
+            # Rimossa dalla cache ma non ancora scritta: la copia serializzata è la più recente
+            memory = load_memory(self._dirty[user_id])
+            self._touch(user_id, memory)
+            return memory
+
+        # Più messaggi dello stesso utente in arrivo insieme condividono un'unica lettura
+        if user_id not in self._loading:
+            self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+        try:
+            memory = await asyncio.shield(self._loading[user_id])
+        finally:
+            self._loading.pop(user_id, None)
+
+        if user_id in self._entries:
+            # Una put() concorrente (o un'altra get della stessa lettura) ha già popolato la cache
+            return self._entries[user_id][0]
+        if memory is not None:
+            self._touch(user_id, memory)
+        return memory
+
+    async def get_or_create(self, user_id):
+        """Return the user's memory, creating (and scheduling the save of) an empty one if missing."""
+        memory = await self.get(user_id)
+        if memory is None:
+            memory = new_memory()
+            self.put(user_id, memory)
+        return memory
+
+    def put(self, user_id, memory):
+        """Replace the user's memory and schedule it for writing."""
+        self.mark_dirty(user_id, memory)
+
+    def mark_dirty(self, user_id, memory=None):
+        """Schedule the memory of the user for writing to Firebase.
+
+        ``memory`` is the memory the caller modified: it is written (and cached
+        again) even if its entry was evicted while the caller was using it.
+        Without it the cached memory is written, if there is one.
+        """
+        user_id = str(user_id)
+        if memory is None:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            memory = entry[0]
+        else:
+            self._touch(user_id, memory)
+        self._dirty[user_id] = dump_memory(memory)
+        self._dirty.move_to_end(user_id)
+
+    async def _load(self, user_id):
+        from firebase_admin import db
+        with span("firebase.get"):
+            snapshot = await asyncio.to_thread(db.reference(self._path(user_id)).get)
+        if snapshot is None:
+            return None
+        return load_memory(snapshot)
+
+    def _path(self, user_id):
+        return self.root + '/' + user_id + '/memory/'
+
+    def _touch(self, user_id, memory):
+        self._entries[user_id] = (memory, time.monotonic())
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def evict_expired(self):
+        """Drop the entries not accessed for longer than the TTL."""
+        deadline = time.monotonic() - self.ttl
+        expired = [user_id for user_id, (_, last) in self._entries.items() if last < deadline]
+        for user_id in expired:
+            del self._entries[user_id]
+        return len(expired)
+
+    async def flush(self, limit=None):
+        """Write up to ``limit`` dirty memories (all of them if None) in batched multi-path updates."""
+        from firebase_admin import db
+        written = 0
+        async with self._flush_lock:
+            while self._dirty and (limit is None or written < limit):
+                size = self.batch_size if limit is None else min(self.batch_size, limit - written)
+                batch = [self._dirty.popitem(last=False) for _ in range(min(size, len(self._dirty)))]
+                payload = {user_id + '/memory': blob for user_id, blob in batch}
+                try:
+                    with span("firebase.update", memories=len(batch)):
+                        await asyncio.to_thread(db.reference(self.root).update, payload)
+                except Exception:
+                    logger.exception("Scrittura di %d memorie su Firebase non riuscita", len(batch))
+                    # Rimette in coda le memorie non scritte, senza sovrascrivere versioni più recenti
+                    for user_id, blob in reversed(batch):
+                        if user_id not in self._dirty:
+                            self._dirty[user_id] = blob
+                            self._dirty.move_to_end(user_id, last=False)
+                    break
+                written += len(batch)
+        return written
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.evict_expired()
+            await self.flush(limit=self.batch_size)
+
+    async def start(self):
+        """Start the background write-behind task."""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop the background task and write every dirty memory."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+
+####### Migrazione delle memorie nel vecchio formato
+#
+# Legge le chiavi di /chats (lettura shallow), poi le memorie a gruppi e riscrive nel nuovo formato
+# solo quelle ancora salvate come pickle esadecimale, con una update multi-path per gruppo.
+
+def migrate_legacy_memories(root='/chats', batch_size=FLUSH_BATCH_SIZE, dry_run=False):
+    """Rewrite every legacy hex-pickle memory under ``root`` in the current format."""
+    from firebase_admin import db
+    user_ids = list((db.reference(root).get(shallow=True) or {}).keys())
+    migrated = 0
+    legacy_bytes = 0
+    new_bytes = 0
+    for i in range(0, len(user_ids), batch_size):
+        payload = {}
+        for user_id in user_ids[i:i + batch_size]:
+            snapshot = db.reference(root + '/' + user_id + '/memory/').get()
+            if snapshot is None or not is_legacy_snapshot(snapshot):
+                continue
+            converted = dump_memory(load_memory(snapshot))
+            payload[user_id + '/memory'] = converted
+            legacy_bytes += len(snapshot)
+            new_bytes += len(json.dumps(converted, ensure_ascii=False).encode("utf-8"))
+        if payload and not dry_run:
+            db.reference(root).update(payload)
+        migrated += len(payload)
+    logger.info("Memorie migrate: %d su %d (%d -> %d byte)", migrated, len(user_ids), legacy_bytes, new_bytes)
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AIDA conversation memory maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="rewrite legacy hex-pickle memories in the current format")
+    migrate_parser.add_argument("--dry-run", action="store_true", help="only report what would be migrated")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+
+    import firebase_admin
+    from firebase_admin import credentials
+    import AIDAkeys
+
+    firebase_admin.initialize_app(credentials.Certificate(AIDAkeys.firebaseCertificate), {
+        'databaseURL': AIDAkeys.databaseURL
+    })
+    if args.command == "migrate":
+        migrate_legacy_memories(dry_run=args.dry_run)
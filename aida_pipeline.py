@@ -0,0 +1,137 @@
+"""
+Long-lived AIDA answering pipeline.
+
+The LLM clients, the retriever, the prompts and the tool definitions are built
+once at startup; each incoming message only binds the memory of its user.
+"""
+
+from langchain import PromptTemplate
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from langchain.agents import initialize_agent, Tool
+from langchain.agents import AgentType
+
+from aida_answer_cache import CachedConversationalRetrievalChain
+
+
+QA_TOOL_NAME = "Bicocca QA System"
+QA_TOOL_DESCRIPTION = """useful for when you need to answer questions about courses at the University of Milano-Bicocca. It is useful when the user asks for suggestions and advices. It allows you to find information into document of degree programs or teachings belonging to a degree program.
+            This tool is useful when the user asks for informations about University of Milano-Bicocca aspects. Input should be a question."""
+
+SKILL_TOOL_NAME = "Skill Course Matcher"
+SKILL_TOOL_DESCRIPTION = """useful for when the user describes their skills or interests, or the job they would like to do, and wants to know which degree programs fit them best, across all the Italian universities in the graph.
+            It answers instantly from a precomputed skill-course graph; every course is listed with its university. Input should be the skills, interests or job of the user, in Italian or English."""
+
+THOUGHT_TOOL_NAME = "Thought Processing"
+THOUGHT_TOOL_DESCRIPTION = """This is useful for when you have a thought that you want to use in a task,
+            but you want to make sure it's formatted correctly.
+            Input is your thought and self-critique and output is the processed thought."""
+
+
+######## Funzione processThought: semplice passaggio che restituisce ciò che gli viene passato come argomento
+def processThought(thought):
+  return thought
+
+
+######### Creazione di prompt per la conversazione
+def build_prompt(template):
+    """Build the chat prompt used to answer over the retrieved documents."""
+    return ChatPromptTemplate(
+        input_variables=['context', 'question'],
+        output_parser=None,
+        partial_variables={},
+        messages=[
+            SystemMessagePromptTemplate(
+                prompt = PromptTemplate(
+                    input_variables=['context'],
+                    output_parser=None,
+                    partial_variables={},
+                    template=template,
+                    template_format='f-string',
+                    validate_template=True),
+                    additional_kwargs={}),
+                    HumanMessagePromptTemplate(
+                        prompt = PromptTemplate(
+                            input_variables=['question'],
+                            output_parser=None,
+                            partial_variables={},
+                            template='{question}',
+                            template_format='f-string',
+                            validate_template=True),
+                            additional_kwargs={})])
+
+
+####### Pipeline condivisa tra tutti i messaggi
+#
+# La ConversationalRetrievalChain (qa) e l'agente vengono costruiti una sola volta, senza memoria.
+# Per ogni messaggio bind() ne crea una copia superficiale (pydantic copy) a cui viene associata la
+# memoria dell'utente: LLM, retriever, prompt e template dell'agente restano condivisi.
+
+class AidaPipeline:
+    """Shared retrieval chain and agent, bound per message to a user memory."""
+
+    def __init__(self, llm, qa_llm, condense_llm, retriever, prompt, agent_template, verbose=True, answer_cache=None,
+                 skill_graph=None):
+        # Creazione di un oggetto ConversationalRetrievalChain che serve per rispondere alle domande poste dall'utente cercando i documenti con conenuto più simili alla domanda dell'utente all'interno del vectordb
+        # Se answer_cache è una SemanticAnswerCache, le domande (condensate) già viste ricevono la risposta salvata senza retrieval né LLM
+        self.qa = CachedConversationalRetrievalChain.from_llm(qa_llm,
+                                               verbose=verbose,
+                                               retriever=retriever,
+                                               chain_type="stuff",
+                                               condense_question_llm=condense_llm, # condensa la domanda corrente e la chat history in una standalone question (necessario per creare un standalone vector per effettuare il retrieval)
+                                               combine_docs_chain_kwargs={'prompt': prompt},
+                                               answer_cache=answer_cache,
+                                           )
+
+        self.thought_tool = Tool(
+            name=THOUGHT_TOOL_NAME,
+            description=THOUGHT_TOOL_DESCRIPTION,
+            func=processThought,
+        )
+
+        # Tool opzionale del grafo competenze-corsi (aida_skills): non dipende dalla memoria, viene creato una sola volta
+        self.skill_tool = None
+        if skill_graph is not None:
+            self.skill_tool = Tool(
+                name=SKILL_TOOL_NAME,
+                description=SKILL_TOOL_DESCRIPTION,
+                func=skill_graph.tool_run,
+            )
+
+        # Inizializzazione dell'agente (i tool vengono sostituiti in bind() con quelli legati alla memoria dell'utente)
+        self.agent = initialize_agent(self._tools(self.qa), # tool da usare
+                                      llm, # LLM che guida e controlla l'agent
+                                      agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION, # scelto perchè è un agent ottimizzato per le conversazioni
+                                      verbose=verbose,
+                                      agent_kwargs={
+                                          "input_variables": ["input", "agent_scratchpad", "chat_history"], # Additional keyword arguments to pass to the underlying agent
+                                      },
+                                      handle_parsing_errors=True,
+                                      )
+
+        # Imposta il template del prompt dell'agente
+        self.agent.agent.llm_chain.prompt.template = agent_template
+
+    def _tools(self, qa):
+        # Il primo tool serve per rispondere a domande specifiche relative ai documenti, quindi viene utilizzato quando per rispondere alla domanda serve accedere al vectordb
+        # Il secondo tool serve per rispondere a domande più generiche che non richiedono il retrieval di documenti, quindi domande a carattere più generico (es. Come ti chiami? oppure Ciao!)
+        # Il terzo, se c'è il grafo delle competenze, restituisce i corsi più adatti a competenze o professioni senza chiamate all'LLM
+        tools = [
+            Tool(
+                name=QA_TOOL_NAME,
+                func=qa.run,
+                description=QA_TOOL_DESCRIPTION,
+            ),
+            self.thought_tool,
+        ]
+        if self.skill_tool is not None:
+            tools.append(self.skill_tool)
+        return tools
+
+    def bind_qa(self, memory):
+        """Return the retrieval chain alone, reading and writing the given memory."""
+        return self.qa.copy(update={"memory": memory})
+
+    def bind(self, memory):
+        """Return an agent executor that reads and writes the given memory."""
+        qa = self.bind_qa(memory)
+        return self.agent.copy(update={"memory": memory, "tools": self._tools(qa)})
@@ -0,0 +1,116 @@
+"""
+Lightweight intent router in front of the ReAct agent.
+
+Greetings and chit-chat get a templated answer with no LLM call, requests for
+courses matching skills or a job are answered from the skill-course graph
+(aida_skills) when one is given, questions about courses go straight to the
+retrieval chain (no agent reasoning hops), and only the remaining messages go
+through the agent.
+"""
+
+import random
+import re
+from collections import Counter, namedtuple
+
+
+Route = namedtuple("Route", ["intent", "answer"])
+
+AGENT = "agent"
+COURSE = "course"
+SKILL = "skill"
+
+TEMPLATES = {
+    "greeting": [
+        "Ciao! Sono AIDA 😊 Come posso aiutarti nella scelta del tuo corso di laurea?",
+        "Ciao! Dimmi pure: cosa ti piacerebbe studiare?",
+    ],
+    "identity": [
+        "Sono AIDA, la tua assistente virtuale per l'orientamento tra i corsi di laurea triennale e magistrale "
+        "dell'Università degli Studi di Milano-Bicocca. Raccontami i tuoi interessi e ti suggerirò i corsi più adatti!",
+    ],
+    "thanks": [
+        "Figurati! Se hai altre domande sui corsi della Bicocca sono qui.",
+        "Di nulla! Posso aiutarti con qualcos'altro?",
+    ],
+    "goodbye": [
+        "A presto! In bocca al lupo per la tua scelta 🍀",
+    ],
+}
+
+_SMALL_TALK_PATTERNS = [
+    ("greeting", re.compile(r"^\s*(ciao|salve|buongiorno|buonasera|buon pomeriggio|hey|ehi|hello|hi)\b"
+                            r"( aida)?[\s!.,😊👋]*$", re.IGNORECASE)),
+    ("identity", re.compile(r"^\s*(come ti chiami|chi sei|cosa sai fare|cosa puoi fare|che cosa sei|"
+                            r"what'?s your name|who are you)\s*(tu)?\s*[?!.]*\s*$", re.IGNORECASE)),
+    ("thanks", re.compile(r"^\s*(grazie|ti ringrazio|thanks|thank you)\b[\w\s!.,]{0,20}$", re.IGNORECASE)),
+    ("goodbye", re.compile(r"^\s*(ciao ciao|arrivederci|a presto|alla prossima|bye)\b[\s!.,]*$", re.IGNORECASE)),
+]
+
+# Richieste di corsi adatti a un insieme di competenze: una professione da raggiungere, oppure interessi
+# accompagnati dalla richiesta esplicita di un consiglio
+_CAREER_PATTERN = re.compile(
+    r"\b(diventare|lavorare come|fare (il|la|lo|l')|i'?d like to become|i want to become|work as)\b", re.IGNORECASE)
+_INTEREST_PATTERN = re.compile(
+    r"\b(mi piace|mi piacciono|mi piacerebbe|mi interessa|mi interessano|mi appassiona|sono appassionat[oa]|"
+    r"i like|i love|i'?m interested in)\b", re.IGNORECASE)
+_SUGGESTION_PATTERN = re.compile(
+    r"\b(consigl\w*|suggeri\w*|suggest\w*|recommend\w*|cosa (potrei|posso|dovrei) (studiare|fare|scegliere)|"
+    r"(quale|quali|che) cors[oi] (potrei|posso|dovrei|mi)|adatt[oi] a me|what should i study)\b", re.IGNORECASE)
+# Domande su un corso preciso o su un suo dettaglio: vanno alla retrieval chain o all'agente, mai al grafo
+_COURSE_DETAIL_PATTERN = re.compile(
+    r"\b(esam[ei]|insegnament[oi]|ammission[ei]|test d'?ingresso|cfu|crediti|piano di studi|iscrizion[ei]|"
+    r"tasse|lezion[ei]|frequenza|orari[oi]?|requisiti|bando|scadenz[ae]|(primo|secondo|terzo) anno|"
+    r"(il|al|del|nel|sul|dal|per il) corso (di laurea (triennale |magistrale )?)?(in|di) (?!laurea\b|studi\b)\w+|"
+    r"L-\d{1,2}|LM-?\s?\d{1,2}|LMG/\d{1,2})\b",
+    re.IGNORECASE)
+
+_COURSE_PATTERN = re.compile(
+    r"\b(cors[oi]|laure[ae]|triennal[ei]|magistral[ei]|ciclo unico|universit[aà]|bicocca|ateneo|facolt[aà]|"
+    r"dipartiment[oi]|esam[ei]|insegnament[oi]|cfu|crediti|piano di studi|ammission[ei]|test d'?ingresso|"
+    r"iscri(zion[ei]|vermi|versi)|sbocchi|tirocini[oi]|erasmus|lezion[ei]|frequenza|"
+    r"L-\d{1,2}|LM-?\s?\d{1,2}|LMG/\d{1,2})\b",
+    re.IGNORECASE)
+
+
+def is_skill_request(text):
+    """Return True if the message asks which courses fit a job or some interests, not about a specific course."""
+    if _COURSE_DETAIL_PATTERN.search(text):
+        return False
+    return bool(_CAREER_PATTERN.search(text)
+                or (_INTEREST_PATTERN.search(text) and _SUGGESTION_PATTERN.search(text)))
+
+
+####### Router a regole
+#
+# * Messaggi brevi di saluto, ringraziamento o sulla identità del bot -> risposta da template, nessun LLM.
+# * Richieste di consiglio sui corsi adatti a una professione o a degli interessi, se c'è un grafo delle competenze
+#   e la domanda nomina competenze o mestieri che conosce -> risposta con i corsi più adatti letti dal grafo, nessun
+#   LLM. Le domande su un corso preciso o su un suo dettaglio (esami, ammissione...) non passano mai dal grafo:
+#   seguono le regole successive, e l'agente può comunque usare il grafo come tool.
+# * Messaggi che parlano di corsi, lauree, esami, ammissioni, classi di laurea... -> direttamente alla
+#   ConversationalRetrievalChain (condensazione con la history, retrieval e una sola risposta).
+# * Tutto il resto -> agente ReAct, come prima.
+# I contatori permettono di controllare la distribuzione delle rotte in produzione.
+
+class IntentRouter:
+    """Rule-based router choosing between a template, the retrieval chain and the agent."""
+
+    def __init__(self, templates=TEMPLATES, skill_graph=None):
+        self.templates = templates
+        self.skill_graph = skill_graph
+        self.counts = Counter()
+
+    def route(self, text):
+        """Return the Route for a user message."""
+        for intent, pattern in _SMALL_TALK_PATTERNS:
+            if pattern.match(text):
+                self.counts[intent] += 1
+                return Route(intent, random.choice(self.templates[intent]))
+        if self.skill_graph is not None and is_skill_request(text):
+            answer = self.skill_graph.answer(text)
+            if answer is not None:
+                self.counts[SKILL] += 1
+                return Route(SKILL, answer)
+        intent = COURSE if _COURSE_PATTERN.search(text) else AGENT
+        self.counts[intent] += 1
+        return Route(intent, None)
@@ -0,0 +1,80 @@
+"""
+Execution of the blocking agent runs outside the Telegram event loop.
+
+Agent runs (LLM and retrieval calls are synchronous) are executed in a bounded
+thread pool with a global concurrency limit, while the messages of a single
+user are handled one at a time, in arrival order.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aida_tracing import record_span
+
+
+AGENT_CONCURRENCY = 8   # esecuzioni dell'agente in parallelo (thread del pool)
+
+
+####### Esecuzione delle risposte fuori dall'event loop
+#
+# * user_turn(user_id) è un lock per utente: i lock di asyncio servono le attese in ordine FIFO, quindi i
+#   messaggi di uno stesso utente vengono elaborati uno alla volta nell'ordine di arrivo. I lock vengono
+#   eliminati quando nessun messaggio dell'utente è in attesa.
+# * run() esegue la funzione bloccante nel pool di thread, con al massimo max_concurrency esecuzioni insieme:
+#   una risposta lenta non blocca più le chat degli altri utenti. La funzione gira in una copia del contesto
+#   (contextvars) del chiamante, come con asyncio.to_thread: la traccia del messaggio segue l'esecuzione nel thread.
+
+class AgentRunner:
+    """Bounded executor for agent runs with per-user ordering."""
+
+    def __init__(self, max_concurrency=AGENT_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="aida-agent")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._user_locks = {}   # user_id -> [asyncio.Lock, messaggi in corso o in attesa]
+
+    @property
+    def pending_users(self):
+        """Number of users with a message being handled or waiting."""
+        return len(self._user_locks)
+
+    @contextlib.asynccontextmanager
+    async def user_turn(self, user_id):
+        """Hold the user's turn: messages of the same user are handled in arrival order.
+
+        Enter it before any other await in the handler, so that the order in
+        which handlers start is the order in which they get the turn. The only
+        await allowed before it is another per-user ordering that hands the
+        turns over in arrival order, such as MessageCoalescer.turn (the next
+        burst of the user starts only when the previous one left its block).
+        """
+        entry = self._user_locks.get(user_id)
+        if entry is None:
+            entry = self._user_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        waiting = time.perf_counter()
+        try:
+            async with entry[0]:
+                record_span("user_turn.wait", time.perf_counter() - waiting, start=waiting)
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[user_id]
+
+    async def run(self, func, *args, **kwargs):
+        """Run the blocking ``func`` in the thread pool and return its result."""
+        waiting = time.perf_counter()
+        async with self._semaphore:
+            record_span("agent_runner.wait", time.perf_counter() - waiting, start=waiting)
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, functools.partial(context.run, func, *args, **kwargs))
+
+    def shutdown(self):
+        """Wait for the running agent calls and release the threads."""
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,403 @@
+"""
+Skill-course graph: which degree programmes teach which skills, precomputed.
+
+Questions such as "voglio diventare financial manager" or "mi piace il machine
+learning, cosa posso studiare?" are matches between a set of skills and the
+courses that teach them. The graph is extracted once from the scraped tree: a
+lexicon of skills (Italian and English surface forms) is matched against the
+text of each SUA PDF, the course name and the class codes of metadata.txt,
+and every course gets weighted edges to its skills. The adjacency (course ->
+skills, skill -> courses) is saved as one JSON file and rebuilt incrementally
+from the same content hashes as aida_ingest. At query time the skills named in
+the question, or those required by a known job, are looked up in memory and
+the top courses are ranked with no LLM call: the bot uses it from the intent
+router and as a tool of the agent.
+
+python aida_skills.py build [--root ./universities] [--path skill_graph.json]
+python aida_skills.py query "vorrei diventare data scientist" [--n 5]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from aida_filters import analyze_query, derive_filter_fields, normalize_class_code
+from aida_ingest import UNIVERSITIES_ROOT, content_hash, extract_pdf_text, iter_course_dirs
+
+
+logger = logging.getLogger(__name__)
+
+SKILL_GRAPH_PATH = 'skill_graph.json'
+SKILL_GRAPH_VERSION = 1
+TOP_N = 5
+MIN_MENTIONS = 2             # occorrenze minime nel testo del PDF perché una competenza diventi un arco
+NAME_WEIGHT = 3.0            # peso aggiunto quando la competenza compare nel nome del corso
+CLASS_WEIGHT = 2.0           # peso aggiunto dalla classe di laurea del corso (CLASS_SKILLS)
+RELOAD_CHECK_INTERVAL = 60   # secondi tra due controlli di una nuova versione del file
+
+
+####### Lessico delle competenze e dei mestieri
+#
+# SKILLS: competenza -> forme con cui compare nei testi (espressioni regolari, senza distinzione tra maiuscole
+# e minuscole, delimitate a parola). JOBS: mestiere -> (forme, competenze richieste). CLASS_SKILLS: classe di
+# laurea -> competenze che ogni corso della classe insegna, anche quando il PDF non le nomina abbastanza volte.
+# Cambiare il lessico invalida tutto il grafo: viene ricostruito alla build successiva.
+
+SKILLS = {
+    "informatica": [r"informatic[ao]", r"computer science"],
+    "programmazione": [r"programmazione", r"programming", r"sviluppo (del )?software", r"software development",
+                       r"python", r"java"],
+    "basi di dati": [r"basi di dati", r"database", r"data ?base"],
+    "reti e sicurezza": [r"reti di calcolatori", r"sicurezza informatica", r"cyber ?security", r"computer networks"],
+    "intelligenza artificiale": [r"intelligenza artificiale", r"artificial intelligence"],
+    "machine learning": [r"machine learning", r"apprendimento automatico", r"deep learning", r"reti neurali"],
+    "data science": [r"data science", r"scienza dei dati", r"analisi dei dati", r"data analysis", r"big data"],
+    "statistica": [r"statistic[ao]", r"statistics", r"probabilit[aà]", r"inferenza"],
+    "matematica": [r"matematic[ao]", r"mathematics", r"analisi matematica", r"algebra", r"geometria"],
+    "fisica": [r"fisica", r"physics"],
+    "chimica": [r"chimica", r"chemistry"],
+    "biologia": [r"biologi[ac]", r"biology", r"genetica", r"microbiologia"],
+    "biotecnologie": [r"biotecnologi[ae]", r"biotechnology"],
+    "medicina": [r"medicina", r"clinic[ao]", r"medicine", r"anatomia", r"fisiologia"],
+    "infermieristica": [r"infermieristic[ao]", r"nursing"],
+    "psicologia": [r"psicologi[ac]", r"psychology", r"neuroscienze"],
+    "economia": [r"economi(a|co|ca|ci|che)", r"economics", r"microeconomia", r"macroeconomia"],
+    "finanza": [r"finanz[ae]", r"finanziari[oae]?", r"finance", r"mercati finanziari", r"banc(a|he|ari[oae])"],
+    "contabilità": [r"contabilit[aà]", r"accounting", r"bilancio", r"ragioneria"],
+    "management": [r"management", r"gestione aziendale", r"organizzazione aziendale", r"manageriali",
+                   r"economia aziendale", r"business administration"],
+    "marketing": [r"marketing"],
+    "relazione con il cliente": [r"relazion[ei] con (il |i )?client[ei]", r"customer relationship", r"customer care",
+                                 r"negoziazione"],
+    "comunicazione": [r"comunicazione", r"communication", r"giornalismo", r"media digitali"],
+    "diritto": [r"diritto", r"giuridic[aho]", r"law", r"giurisprudenza"],
+    "sociologia": [r"sociologi[ac]", r"sociology", r"scienze sociali"],
+    "pedagogia": [r"pedagogi[ac]", r"educazione", r"scienze della formazione", r"didattica"],
+    "lingue straniere": [r"lingu[ae] stranier[ae]", r"foreign languages", r"traduzione", r"linguistica"],
+    "turismo": [r"turismo", r"turistic[oah]", r"tourism"],
+    "ambiente": [r"ambiental[ei]", r"ambiente", r"sostenibilit[aà]", r"ecologia", r"environmental"],
+    "scienze della terra": [r"geologi[ac]", r"scienze della terra", r"geology"],
+    "materiali": [r"scienza dei materiali", r"materials science", r"nanotecnologi[ae]"],
+}
+
+JOBS = {
+    "financial manager": ([r"financial manager", r"manager finanziari[oa]", r"direttore finanziario", r"cfo"],
+                          ["finanza", "economia", "management", "contabilità", "relazione con il cliente"]),
+    "data scientist": ([r"data scientist", r"data analyst", r"analista (dei|di) dati"],
+                       ["data science", "machine learning", "statistica", "programmazione", "basi di dati"]),
+    "sviluppatore software": ([r"sviluppat(ore|rice)( software)?", r"programmat(ore|rice)", r"software engineer",
+                               r"developer"],
+                              ["programmazione", "informatica", "basi di dati", "reti e sicurezza"]),
+    "esperto di intelligenza artificiale": ([r"ai engineer", r"machine learning engineer", r"espert[oa] di ia"],
+                                            ["intelligenza artificiale", "machine learning", "programmazione",
+                                             "matematica"]),
+    "commercialista": ([r"commercialista", r"revisore contabile", r"consulente fiscale"],
+                       ["contabilità", "economia", "diritto"]),
+    "marketing manager": ([r"marketing manager", r"responsabile marketing", r"esperto di marketing"],
+                          ["marketing", "comunicazione", "management", "relazione con il cliente"]),
+    "consulente aziendale": ([r"consulente aziendale", r"business consultant", r"manager d'azienda",
+                              r"imprenditore"],
+                             ["management", "economia", "relazione con il cliente"]),
+    "psicologo": ([r"psicolog[oa]", r"psicoterapeuta"], ["psicologia"]),
+    "insegnante": ([r"insegnante", r"maestr[oa]", r"educat(ore|rice)", r"professor(e|essa)"],
+                   ["pedagogia", "comunicazione"]),
+    "avvocato": ([r"avvocat[oa]", r"giurista", r"magistrato", r"notaio"], ["diritto"]),
+    "medico": ([r"medic[oa]", r"chirurg[oa]"], ["medicina", "biologia"]),
+    "infermiere": ([r"infermier[ea]"], ["infermieristica", "medicina"]),
+    "biologo": ([r"biolog[oa]", r"ricercat(ore|rice) in biologia"], ["biologia", "biotecnologie", "chimica"]),
+    "chimico": ([r"chimic[oa] industriale", r"chimic[oa] di laboratorio"], ["chimica", "materiali"]),
+    "giornalista": ([r"giornalista", r"social media manager", r"addett[oa] stampa"],
+                    ["comunicazione", "lingue straniere"]),
+    "statistico": ([r"statistic[oa] (aziendale|ufficiale)", r"attuario"], ["statistica", "matematica", "data science"]),
+    "esperto di turismo": ([r"tour operator", r"guida turistica", r"travel manager"], ["turismo", "lingue straniere"]),
+    "geologo": ([r"geolog[oa]"], ["scienze della terra", "ambiente"]),
+}
+
+CLASS_SKILLS = {
+    "L-31": ["informatica", "programmazione"], "LM-18": ["informatica", "programmazione"],
+    "LM-91": ["data science", "informatica"], "L-41": ["statistica"], "LM-82": ["statistica"],
+    "L-35": ["matematica"], "LM-40": ["matematica"], "L-30": ["fisica"], "LM-17": ["fisica"],
+    "L-27": ["chimica"], "LM-54": ["chimica"], "L-13": ["biologia"], "LM-6": ["biologia"],
+    "L-2": ["biotecnologie"], "LM-9": ["biotecnologie"], "LM-41": ["medicina"],
+    "L-24": ["psicologia"], "LM-51": ["psicologia"], "L-18": ["economia", "management"],
+    "LM-77": ["economia", "management"], "L-33": ["economia"], "LM-56": ["economia"], "LM-16": ["finanza"],
+    "L-14": ["diritto"], "LMG/01": ["diritto"], "L-20": ["comunicazione"], "LM-59": ["comunicazione", "marketing"],
+    "L-40": ["sociologia"], "LM-88": ["sociologia"], "L-19": ["pedagogia"], "LM-85": ["pedagogia"],
+    "L-11": ["lingue straniere"], "L-12": ["lingue straniere"], "LM-37": ["lingue straniere"],
+    "L-15": ["turismo"], "LM-49": ["turismo"], "L-32": ["ambiente"], "LM-75": ["ambiente"],
+    "L-34": ["scienze della terra"], "LM-74": ["scienze della terra"], "LM-53": ["materiali"],
+}
+
+
+def _compile(forms):
+    return re.compile(r"\b(?:" + "|".join(forms) + r")\b", re.IGNORECASE)
+
+
+_SKILL_PATTERNS = {skill: _compile(forms) for skill, forms in SKILLS.items()}
+_JOB_PATTERNS = {job: _compile(forms) for job, (forms, _) in JOBS.items()}
+
+
+def lexicon_hash():
+    """Return a digest of the lexicon: a different lexicon makes every course stale."""
+    lexicon = {"version": SKILL_GRAPH_VERSION, "skills": SKILLS, "jobs": JOBS, "classes": CLASS_SKILLS,
+               "weights": [MIN_MENTIONS, NAME_WEIGHT, CLASS_WEIGHT]}
+    return hashlib.sha256(json.dumps(lexicon, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def find_skills(text):
+    """Return {skill: mentions} for the skills of the lexicon named in ``text``."""
+    found = {}
+    for skill, pattern in _SKILL_PATTERNS.items():
+        mentions = len(pattern.findall(text))
+        if mentions:
+            found[skill] = mentions
+    return found
+
+
+def find_jobs(text):
+    """Return the jobs of the lexicon named in ``text``."""
+    return [job for job, pattern in _JOB_PATTERNS.items() if pattern.search(text)]
+
+
+def question_skills(question):
+    """Return (skills, jobs) of a question: the skills named in it plus those required by the jobs it names."""
+    jobs = find_jobs(question)
+    skills = list(find_skills(question))
+    for job in jobs:
+        skills.extend(skill for skill in JOBS[job][1] if skill not in skills)
+    return skills, jobs
+
+
+####### Lavoro svolto nei processi del pool: competenze di un corso
+
+def course_skills(course_key, university, pdf_path, metadata_path):
+    """Return the graph record of one course: its fields and {skill: weight}."""
+    with open(metadata_path, encoding="utf-8") as file:
+        course_dict = json.load(file)
+    name = course_dict.get("name") or ""
+    weights = defaultdict(float)
+    for skill, mentions in find_skills(extract_pdf_text(pdf_path)).items():
+        if mentions >= MIN_MENTIONS:
+            weights[skill] += 1.0 + math.log(mentions)
+    for skill in find_skills(name):
+        weights[skill] += NAME_WEIGHT
+    for code in course_dict.get("cds_codes") or []:
+        for skill in CLASS_SKILLS.get(normalize_class_code(code), ()):
+            weights[skill] += CLASS_WEIGHT
+    fields = derive_filter_fields(course_dict)
+    return {"name": name, "university": university, "sua_code": course_dict.get("sua_code"),
+            "level": fields["level"], "language_code": fields["language_code"], "access": fields["access"],
+            "cities": sorted({city.strip().lower() for city in course_dict.get("cities") or [] if city.strip()}),
+            "skills": {skill: round(weight, 3) for skill, weight in sorted(weights.items())}}
+
+
+####### Costruzione incrementale del file del grafo
+#
+# Il file contiene, per ogni corso, l'hash di PDF e metadata.txt (lo stesso di aida_ingest), i campi usati per
+# filtrare e mostrare i risultati e gli archi pesati verso le competenze. Alla build vengono rielaborati solo i
+# corsi nuovi o modificati (tutti se è cambiato il lessico), in un pool di processi; i corsi non più presenti
+# vengono rimossi. Il file viene sostituito atomicamente: il bot lo ricarica da solo.
+
+def load_graph_file(path):
+    if not os.path.exists(path):
+        return {"version": SKILL_GRAPH_VERSION, "lexicon": None, "courses": {}}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def build_graph(root=UNIVERSITIES_ROOT, path=SKILL_GRAPH_PATH, workers=None, full=False):
+    """Bring the graph file in line with the tree; return {"courses", "updated", "removed", "failed", "seconds"}."""
+    start = time.perf_counter()
+    graph = load_graph_file(path)
+    lexicon = lexicon_hash()
+    if graph.get("lexicon") != lexicon or graph.get("version") != SKILL_GRAPH_VERSION:
+        full = True
+    courses = {} if full else graph["courses"]
+    seen = set()
+    changed = []
+    for course_key, university, _, pdf_path, metadata_path in iter_course_dirs(root):
+        seen.add(course_key)
+        digest = content_hash(pdf_path, metadata_path)
+        previous = courses.get(course_key)
+        if previous is None or previous["hash"] != digest:
+            changed.append((course_key, university, pdf_path, metadata_path, digest))
+
+    failed = 0
+    if changed:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(course_skills, course_key, university, pdf_path, metadata_path): (course_key, digest)
+                       for course_key, university, pdf_path, metadata_path, digest in changed}
+            for future in as_completed(futures):
+                course_key, digest = futures[future]
+                try:
+                    courses[course_key] = dict(future.result(), hash=digest)
+                except Exception:
+                    logger.exception("Estrazione delle competenze non riuscita per %s", course_key)
+                    failed += 1
+
+    removed = [course_key for course_key in courses if course_key not in seen]
+    for course_key in removed:
+        del courses[course_key]
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump({"version": SKILL_GRAPH_VERSION, "lexicon": lexicon, "built_at": int(time.time()),
+                   "courses": courses}, file, ensure_ascii=False)
+    os.replace(temp_path, path)
+    return {"courses": len(courses), "updated": len(changed) - failed, "removed": len(removed), "failed": failed,
+            "seconds": round(time.perf_counter() - start, 3)}
+
+
+####### Interrogazione del grafo
+#
+# All'apertura il file viene letto una volta e trasformato in liste di adiacenza: competenza -> [(corso, peso)]
+# e corso -> {competenza: peso}. Il punteggio di un corso per un insieme di competenze è la somma dei pesi dei
+# suoi archi verso di esse, ognuno moltiplicato per l'idf della competenza (log(1 + corsi / corsi con la
+# competenza)): le competenze insegnate ovunque contano meno di quelle specifiche. I vincoli espressi nella domanda
+# (livello, lingua, accesso, città: aida_filters.analyze_query) filtrano i corsi. Il grafo caricato non viene mai
+# modificato, quindi può essere letto insieme dall'event loop e dai thread dell'AgentRunner; ogni
+# RELOAD_CHECK_INTERVAL secondi si controlla se il file è stato ricostruito.
+
+class _Graph:
+    def __init__(self, path):
+        self.mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        self.courses = load_graph_file(path)["courses"]
+        self.skill_courses = defaultdict(list)
+        for course_key, course in self.courses.items():
+            for skill, weight in course["skills"].items():
+                self.skill_courses[skill].append((course_key, weight))
+        total = len(self.courses)
+        self.idf = {skill: math.log(1 + total / len(edges)) for skill, edges in self.skill_courses.items()}
+        self.cities = tuple(sorted({city for course in self.courses.values() for city in course["cities"]}))
+
+
+class SkillGraph:
+    """In-memory skill-course adjacency index, loaded from the graph file."""
+
+    def __init__(self, path=SKILL_GRAPH_PATH, top_n=TOP_N):
+        self.path = path
+        self.top_n = top_n
+        self._graph = _Graph(path)
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked >= RELOAD_CHECK_INTERVAL:
+            with self._lock:
+                if now - self._checked >= RELOAD_CHECK_INTERVAL:
+                    self._checked = now
+                    try:
+                        changed = os.stat(self.path).st_mtime_ns != self._graph.mtime
+                    except FileNotFoundError:
+                        changed = False
+                    if changed:
+                        self._graph = _Graph(self.path)
+        return self._graph
+
+    def __len__(self):
+        return len(self._current().courses)
+
+    def skills_of(self, course_key):
+        """Return {skill: weight} of a course (empty if the course is unknown)."""
+        course = self._current().courses.get(course_key)
+        return dict(course["skills"]) if course is not None else {}
+
+    def courses_for(self, skill):
+        """Return [(course_key, weight)] of a skill, heaviest first."""
+        return sorted(self._current().skill_courses.get(skill, ()), key=lambda edge: -edge[1])
+
+    def match(self, skills, n=None, constraints=None):
+        """Return the top courses for ``skills`` as dicts with course_key, score and the matched skills."""
+        graph = self._current()
+        scores = defaultdict(float)
+        matched = defaultdict(list)
+        for skill in skills:
+            idf = graph.idf.get(skill, 0.0)
+            for course_key, weight in graph.skill_courses.get(skill, ()):
+                scores[course_key] += weight * idf
+                matched[course_key].append(skill)
+        results = []
+        for course_key, score in scores.items():
+            course = graph.courses[course_key]
+            if constraints and not self._accepts(course, constraints):
+                continue
+            results.append(dict(course_key=course_key, name=course["name"], university=course["university"],
+                                level=course["level"], score=round(score, 3), skills=matched[course_key]))
+        results.sort(key=lambda result: (-result["score"], result["name"]))
+        return results[:n or self.top_n]
+
+    @staticmethod
+    def _accepts(course, constraints):
+        for field, values in constraints.items():
+            if field == "city":
+                if not set(values) & set(course["cities"]):
+                    return False
+            elif field in ("level", "language_code", "access") and course[field] not in values:
+                return False
+        return True
+
+    def answer(self, question, n=None):
+        """Return the matching courses for a question as a reply text, or None if it names no known skill or job."""
+        skills, jobs = question_skills(question)
+        if not skills:
+            return None
+        results = self.match(skills, n=n, constraints=analyze_query(question, self._current().cities))
+        if not results:
+            return None
+        if jobs:
+            header = (f"Per diventare {jobs[0]} servono competenze di {_join(skills)}. "
+                      f"Questi sono i corsi che le insegnano di più:")
+        else:
+            header = f"Questi sono i corsi che insegnano di più {_join(skills)}:"
+        lines = [header]
+        for i, result in enumerate(results, 1):
+            level = result["level"].replace("_", " ")
+            # Lo stesso nome di corso ricorre in più atenei: l'università distingue le righe
+            lines.append(f"{i}. {result['name']}" + (f" (laurea {level})" if level else "")
+                         + f", {result['university']} - {_join(result['skills'])}")
+        lines.append("Vuoi saperne di più su uno di questi corsi? Chiedimi pure!")
+        return "\n".join(lines)
+
+    def tool_run(self, question):
+        """Agent tool: like answer(), with a hint to use the QA tool when the graph cannot help."""
+        return self.answer(question) or ("Nessuna competenza o professione nota in questa richiesta: "
+                                         "usa lo strumento Bicocca QA System.")
+
+
+def _join(items):
+    items = list(items)
+    return items[0] if len(items) == 1 else ", ".join(items[:-1]) + " e " + items[-1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Skill-course graph of the scraped universities tree")
+    parser.add_argument("--path", default=SKILL_GRAPH_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="update the graph from the universities tree")
+    build_parser.add_argument("--root", default=UNIVERSITIES_ROOT)
+    build_parser.add_argument("--workers", type=int, default=None, help="processes for PDF extraction")
+    build_parser.add_argument("--full", action="store_true", help="re-extract every course")
+    query_parser = subparsers.add_parser("query", help="print the courses matching a question")
+    query_parser.add_argument("question")
+    query_parser.add_argument("--n", type=int, default=TOP_N)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+        print(json.dumps(build_graph(args.root, args.path, workers=args.workers, full=args.full), indent=1))
+    else:
+        graph = SkillGraph(args.path)
+        start = time.perf_counter()
+        reply = graph.answer(args.question, n=args.n)
+        elapsed = time.perf_counter() - start
+        print(reply or "Nessuna competenza riconosciuta")
+        print(f"{len(graph)} corsi nel grafo ({elapsed * 1000:.2f} ms)")
@@ -0,0 +1,200 @@
+"""
+Streaming of the agent's final answer into a Telegram message.
+
+The waiting emoji sent by echo becomes a placeholder that is edited, in
+throttled increments, as the agent LLM generates the final answer: what the
+user waits for is the first token, not the whole agent run.
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+
+from langchain.callbacks.base import BaseCallbackHandler
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter
+
+from aida_tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+EDIT_INTERVAL = 1.0            # secondi minimi tra due modifiche dello stesso messaggio (limite per chat di Telegram)
+EDIT_MIN_CHARS = 40            # caratteri nuovi minimi per giustificare una modifica
+GLOBAL_EDITS_PER_SECOND = 20   # modifiche al secondo su tutte le chat (Telegram ne consente circa 30)
+ANSWER_PREFIX = "AI:"          # prefisso della risposta finale dell'agente CONVERSATIONAL_REACT_DESCRIPTION
+TYPING_SUFFIX = " …"
+EMPTY_ANSWER = "Non sono riuscita a formulare una risposta: puoi riformulare la domanda?"
+
+
+####### Limite globale delle modifiche: token bucket condiviso da tutti gli stream
+
+class EditRateLimiter:
+    """Async token bucket limiting the Telegram edits across all chats."""
+
+    def __init__(self, rate=GLOBAL_EDITS_PER_SECOND):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+edit_limiter = EditRateLimiter()
+
+
+####### Statistiche di latenza: tempo alla prima porzione di risposta e tempo alla risposta completa
+
+class StreamingStats:
+    """Rolling time-to-first-byte / time-to-full-answer samples."""
+
+    def __init__(self, size=1000):
+        self.first_byte = deque(maxlen=size)
+        self.full_answer = deque(maxlen=size)
+
+    def record(self, first_byte, full_answer):
+        if first_byte is not None:
+            self.first_byte.append(first_byte)
+        self.full_answer.append(full_answer)
+
+    @staticmethod
+    def _percentiles(samples):
+        if not samples:
+            return {}
+        ordered = sorted(samples)
+        return {
+            "p50": round(statistics.median(ordered), 3),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            "count": len(ordered),
+        }
+
+    def summary(self):
+        return {"time_to_first_byte": self._percentiles(self.first_byte),
+                "time_to_full_answer": self._percentiles(self.full_answer)}
+
+
+stream_stats = StreamingStats()
+
+
+####### Callback di streaming
+#
+# L'agente viene eseguito in un thread dell'AgentRunner: i token arrivano in quel thread e le modifiche del
+# messaggio vengono programmate sull'event loop del bot con run_coroutine_threadsafe.
+# * Vengono mostrati solo i token che seguono il prefisso "AI:" della risposta finale dell'agente; i passaggi
+#   intermedi (Thought, Action, ...) non arrivano all'utente.
+# * Una modifica parte solo se è passato EDIT_INTERVAL dall'ultima, ci sono almeno EDIT_MIN_CHARS caratteri
+#   nuovi (la prima appena arriva il primo token) e la modifica precedente è terminata; in più tutte le chat condividono edit_limiter.
+# * Ogni chiamata all'LLM (l'agente ne fa una per passaggio) riparte da zero: buffer, inizio della risposta e
+#   testo già mostrato.
+# * finish() sostituisce il segnaposto con la risposta completa (divisa in più messaggi se supera il limite);
+#   una risposta vuota diventerebbe una modifica rifiutata da Telegram e viene sostituita da EMPTY_ANSWER.
+
+class TelegramStreamHandler(BaseCallbackHandler):
+    """LangChain callback that streams the final answer into a Telegram placeholder message."""
+
+    def __init__(self, message, loop, min_interval=EDIT_INTERVAL, min_chars=EDIT_MIN_CHARS, answer_prefix=ANSWER_PREFIX):
+        self.message = message
+        self.loop = loop
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.answer_prefix = answer_prefix
+        self.started = time.perf_counter()
+        self.first_byte = None
+        self.full_answer = None
+        self._buffer = ""
+        self._answer_start = None
+        self._last_edit = 0.0
+        self._sent_length = 0
+        self._pending = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._reset()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._reset()
+
+    def _reset(self):
+        self._buffer = ""
+        self._answer_start = None
+        self._sent_length = 0
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._buffer += token
+        if self._answer_start is None:
+            position = self._buffer.find(self.answer_prefix)
+            if position < 0:
+                return
+            self._answer_start = position + len(self.answer_prefix)
+
+        text = self._buffer[self._answer_start:].strip()
+        now = time.monotonic()
+        # La prima modifica parte subito, le successive solo con abbastanza testo nuovo
+        if (not text or now - self._last_edit < self.min_interval
+                or (self._sent_length and len(text) - self._sent_length < self.min_chars)
+                or (self._pending is not None and not self._pending.done())):
+            return
+        self._last_edit = now
+        self._sent_length = len(text)
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter() - self.started
+        self._pending = asyncio.run_coroutine_threadsafe(
+            self._edit(text[:MessageLimit.MAX_TEXT_LENGTH - len(TYPING_SUFFIX)] + TYPING_SUFFIX), self.loop
+        )
+
+    async def _edit(self, text):
+        await edit_limiter.acquire()
+        try:
+            with span("telegram.edit"):
+                await self.message.edit_text(text)
+        except RetryAfter as error:
+            # Telegram chiede di rallentare: le modifiche intermedie si possono saltare
+            self._last_edit = time.monotonic() + error.retry_after
+        except BadRequest as error:
+            logger.debug("Modifica del messaggio non riuscita: %s", error)
+
+    async def finish(self, response):
+        """Replace the placeholder with the complete answer and record the latency."""
+        if self._pending is not None:
+            try:
+                await asyncio.wrap_future(self._pending)
+            except Exception:
+                pass
+
+        if not (response or "").strip():
+            response = EMPTY_ANSWER
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        parts = [response[i:i + limit] for i in range(0, len(response), limit)] or [response]
+        await edit_limiter.acquire()
+        try:
+            with span("telegram.edit"):
+                await self.message.edit_text(parts[0])
+        except BadRequest as error:
+            # "Message is not modified": l'ultima modifica in streaming conteneva già la risposta completa
+            if "not modified" not in str(error).lower():
+                # Il segnaposto non è modificabile (ad esempio è stato cancellato): la risposta arriva come nuovo messaggio
+                with span("telegram.send"):
+                    await self.message.reply_text(parts[0])
+        for part in parts[1:]:
+            with span("telegram.send"):
+                await self.message.reply_text(part)
+
+        self.full_answer = time.perf_counter() - self.started
+        if self.first_byte is None:
+            # Nessun token in streaming (risposta in cache o LLM senza streaming): la prima porzione è la risposta intera
+            self.first_byte = self.full_answer
+        stream_stats.record(self.first_byte, self.full_answer)
+        logger.info("Risposta: prima porzione dopo %.2fs, completa dopo %.2fs", self.first_byte, self.full_answer)
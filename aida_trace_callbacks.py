@@ -0,0 +1,106 @@
+"""
+LangChain callback handler of the per-message traces of aida_tracing.
+
+Kept apart from aida_tracing so that importing the tracing (and the bot)
+does not load LangChain: aida_tracing resolves ``tracing_handler`` from here
+on first access.
+"""
+
+import threading
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from aida_tracing import metrics, record_span
+
+
+####### Callback di LangChain
+#
+# Un solo handler per tutta l'applicazione: legge la traccia attiva dalla ContextVar del thread che esegue la
+# chain. Registra uno span per ogni chiamata all'LLM (con i token: quelli riportati da OpenAI oppure, in
+# streaming, il numero di token ricevuti), per ogni retriever e per ogni tool dell'agente.
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """LangChain callback recording LLM, retriever and tool spans in the current trace."""
+
+    def __init__(self):
+        self._runs = {}   # run_id -> (nome dello span, inizio, attributi)
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, name, **attributes):
+        with self._lock:
+            self._runs[run_id] = (name, time.perf_counter(), attributes)
+
+    def _end(self, run_id, error=False, **attributes):
+        with self._lock:
+            entry = self._runs.pop(run_id, None)
+        if entry is None:
+            return None
+        name, start, started_attributes = entry
+        started_attributes.update(attributes)
+        record_span(name, time.perf_counter() - start, start=start, error=error, **started_attributes)
+        return started_attributes
+
+    @staticmethod
+    def _model_name(serialized):
+        kwargs = (serialized or {}).get("kwargs") or {}
+        return kwargs.get("model_name") or kwargs.get("model") or ((serialized or {}).get("id") or ["llm"])[-1]
+
+    # LLM
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm", model=self._model_name(serialized), streamed_tokens=0)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm", model=self._model_name(serialized), streamed_tokens=0)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            entry = self._runs.get(run_id)
+            if entry is not None:
+                entry[2]["streamed_tokens"] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        with self._lock:
+            entry = self._runs.get(run_id)
+            streamed = entry[2].pop("streamed_tokens", 0) if entry is not None else 0
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens", streamed or None)
+        attributes = {key: value for key, value in (("prompt_tokens", prompt_tokens),
+                                                    ("completion_tokens", completion_tokens)) if value}
+        self._end(run_id, **attributes)
+        for kind, value in attributes.items():
+            metrics.inc("aida_llm_tokens_total", value, kind=kind.split("_")[0])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            entry = self._runs.get(run_id)
+            if entry is not None:
+                entry[2].pop("streamed_tokens", None)
+        self._end(run_id, error=True)
+
+    # Retriever (il retriever ibrido, comprese le ricerche BM25 e ChromaDB)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    # Tool dell'agente
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", tool=(serialized or {}).get("name"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+
+tracing_handler = TracingCallbackHandler()
@@ -0,0 +1,315 @@
+"""
+Per-message tracing and metrics.
+
+Every handled update gets a trace id, carried in a context variable: the
+handler, the memory cache, the agent thread (AgentRunner copies the context)
+and the Telegram edits scheduled from that thread all record their timing
+spans in the same trace. Each span also feeds an aggregated latency histogram;
+the histograms, the counters (LLM tokens, errors) and the gauges (queue
+depths) are served in the Prometheus text format by a local HTTP endpoint. A sample of the traces, plus
+every slow or failed one, is logged as one JSON line.
+
+Configuration (environment variables):
+    AIDA_VERBOSE=1           verbose LangChain chains and the text of every message in the log (off by default)
+    AIDA_TRACE_SAMPLE=0.05   fraction of the traces written to the log
+    AIDA_TRACE_SLOW=10       traces slower than this many seconds are always logged
+    AIDA_METRICS_PORT=9108   port of the metrics endpoint on 127.0.0.1 (0 disables it)
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("aida.trace")
+
+
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+VERBOSE = _env_flag("AIDA_VERBOSE")
+TRACE_SAMPLE_RATE = float(os.environ.get("AIDA_TRACE_SAMPLE", "0.05"))
+SLOW_TRACE_SECONDS = float(os.environ.get("AIDA_TRACE_SLOW", "10"))
+METRICS_PORT = int(os.environ.get("AIDA_METRICS_PORT", "9108"))
+
+# Limiti superiori (secondi) dei bucket degli istogrammi di latenza
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+####### Metriche aggregate
+#
+# * Un istogramma di latenza per ogni tipo di span (firebase.get, llm, chroma.query, telegram.edit, ...),
+#   con bucket cumulativi come quelli di Prometheus, più somma e numero delle osservazioni.
+# * Contatori con etichette (token dell'LLM, errori per span).
+# I thread dell'AgentRunner, i thread di asyncio.to_thread e l'event loop scrivono insieme: un solo lock.
+
+class Histogram:
+    """Cumulative-bucket latency histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # l'ultimo bucket è +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (None without observations)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Thread-safe latency histograms, labelled counters and gauges."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}   # stage -> Histogram
+        self._counters = {}     # (name, ((etichetta, valore), ...)) -> valore
+        self._gauges = {}       # come i contatori, ma il valore viene sostituito invece che sommato
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def snapshot(self):
+        """Return {"stages": {stage: {count, sum, p50, p95, p99}}, "counters": {...}, "gauges": {...}}.
+
+        Times are in seconds.
+        """
+        with self._lock:
+            stages = {stage: {"count": histogram.count, "sum": round(histogram.sum, 6),
+                              "p50": histogram.quantile(0.50), "p95": histogram.quantile(0.95),
+                              "p99": histogram.quantile(0.99)}
+                      for stage, histogram in sorted(self._histograms.items())}
+            counters = {_metric_name(name, labels): value for (name, labels), value in sorted(self._counters.items())}
+            gauges = {_metric_name(name, labels): value for (name, labels), value in sorted(self._gauges.items())}
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = ["# TYPE aida_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'aida_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'aida_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'aida_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                names = set()
+                for (name, labels), value in sorted(values.items()):
+                    if name not in names:
+                        names.add(name)
+                        lines.append(f"# TYPE {name} {kind}")
+                    lines.append(f"{_metric_name(name, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+metrics = MetricsRegistry()
+
+
+####### Tracce dei messaggi
+#
+# message_trace() apre la traccia di un update nel contesto corrente (una ContextVar); span() misura un
+# passaggio, lo aggiunge alla traccia attiva (se c'è) e all'istogramma del suo tipo. Le ContextVar seguono
+# i task di asyncio, asyncio.to_thread, le esecuzioni dell'AgentRunner e le coroutine programmate con
+# run_coroutine_threadsafe da quei thread: nessun parametro da passare tra le funzioni.
+
+class Trace:
+    """Spans of one handled update."""
+
+    def __init__(self, handler, user_id=None, sampled=False):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.handler = handler
+        self.user_id = user_id
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, seconds, **attributes):
+        with self._lock:
+            self.spans.append(dict(name=name, start_ms=round((start - self.started) * 1000, 1),
+                                   ms=round(seconds * 1000, 1), **attributes))
+
+    def to_dict(self, seconds, error=None):
+        record = {"trace_id": self.trace_id, "handler": self.handler, "user_id": self.user_id,
+                  "ms": round(seconds * 1000, 1), **self.attributes}
+        if error is not None:
+            record["error"] = error
+        with self._lock:
+            record["spans"] = sorted(self.spans, key=lambda span: span["start_ms"])
+        return record
+
+
+_current_trace = contextvars.ContextVar("aida_trace", default=None)
+
+
+def current_trace():
+    """Return the trace of the update being handled in this context, or None."""
+    return _current_trace.get()
+
+
+def record_span(name, seconds, start=None, error=False, **attributes):
+    """Record an already measured span in the histograms and in the current trace."""
+    metrics.observe(name, seconds)
+    if error:
+        metrics.inc("aida_stage_errors_total", stage=name)
+        attributes["error"] = True
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start if start is not None else time.perf_counter() - seconds, seconds, **attributes)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as a ``name`` span; works around awaits in the same task."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield attributes
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, start=start, error=error, **attributes)
+
+
+@contextlib.contextmanager
+def message_trace(handler, user_id=None, sample_rate=None, slow_seconds=None):
+    """Open the trace of an update; on exit record its total and log it if sampled, slow or failed."""
+    sample_rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    slow_seconds = SLOW_TRACE_SECONDS if slow_seconds is None else slow_seconds
+    trace = Trace(handler, user_id=user_id, sampled=random.random() < sample_rate)
+    token = _current_trace.set(trace)
+    error = None
+    try:
+        yield trace
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        seconds = time.perf_counter() - trace.started
+        metrics.observe("handler." + handler, seconds)
+        if error is not None:
+            metrics.inc("aida_stage_errors_total", stage="handler." + handler)
+        if trace.sampled or error is not None or seconds >= slow_seconds:
+            trace_logger.info(json.dumps(trace.to_dict(seconds, error), ensure_ascii=False, default=str))
+
+
+def traced(handler_name):
+    """Decorator running a Telegram handler inside the trace of its update."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            user = update.effective_user
+            with message_trace(handler_name, user.id if user is not None else None):
+                return await handler(update, context)
+        return wrapper
+    return decorator
+
+
+####### Callback di LangChain
+#
+# TracingCallbackHandler e l'istanza condivisa tracing_handler sono in aida_trace_callbacks: vengono importati
+# al primo accesso (from aida_tracing import tracing_handler), così importare aida_tracing non carica LangChain.
+
+def __getattr__(name):
+    if name in ("TracingCallbackHandler", "tracing_handler"):
+        import aida_trace_callbacks
+        return getattr(aida_trace_callbacks, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+####### Endpoint locale delle metriche
+#
+# GET /metrics restituisce gli istogrammi e i contatori nel formato di Prometheus, GET /metrics.json lo
+# stesso contenuto (con i quantili stimati dai bucket) in JSON. Il server gira in un thread daemon e ascolta
+# solo su 127.0.0.1.
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = metrics
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = self.registry.render(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(self.registry.snapshot(), indent=1), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1", registry=metrics):
+    """Serve the metrics in a daemon thread; return the server (None if ``port`` is 0)."""
+    if not port:
+        return None
+    handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="aida-metrics", daemon=True).start()
+    logger.info("Metriche disponibili su http://%s:%d/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,311 @@
+"""
+Read-only, memory-mapped export of the Chroma collection, as an alternative retrieval backend.
+
+Every bot process holding a Chroma instance keeps its own copy of the index in
+RAM. The export keeps the normalized embedding matrix (float16, or int8 with a
+scale per row) and the chunk records in flat files opened with
+``np.load(mmap_mode="r")``: all the worker processes share the same page
+cache. The filterable metadata fields (level, language_code, access,
+cds_code_<i>, city_<i>, university, course_key) are stored as integer codes,
+so the ``where`` filters built by aida_filters become vectorized masks.
+Top-k is an exact dot product computed with NumPy in blocks.
+
+VectorIndex offers the similarity_search(query, k, filter) interface used by
+FilteredRetriever, so the retrieval chain does not change: the bot uses it
+with AIDA_VECTOR_BACKEND=mmap.
+
+python aida_vecindex.py export [--persist-directory ChromaDB_Bicocca_AIDA_FINAL] [--out AIDA_vecindex] [--dtype int8]
+python aida_vecindex.py info [--out AIDA_vecindex]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from langchain.schema import Document
+
+from aida_filters import MAX_MULTI_VALUES
+
+
+VECTOR_INDEX_DIR = 'AIDA_vecindex'
+VECTOR_INDEX_FORMAT_VERSION = 1
+DTYPES = ("float16", "int8")
+EXPORT_PAGE_SIZE = 2000      # chunk letti da Chroma per ogni get()
+SEARCH_BLOCK_ROWS = 8192     # righe della matrice convertite in float32 alla volta
+RELOAD_CHECK_INTERVAL = 60   # secondi tra due controlli di una nuova esportazione
+
+FILTER_FIELDS = (("level", "language_code", "access", "university", "course_key")
+                 + tuple(f"cds_code_{i}" for i in range(MAX_MULTI_VALUES))
+                 + tuple(f"city_{i}" for i in range(MAX_MULTI_VALUES)))
+
+
+####### Formato dell'esportazione (una directory)
+#
+# * manifest.json: versione del formato, dtype, numero di chunk, dimensione, versione della collection
+#   esportata e, per ogni campo filtrabile, il vocabolario dei valori.
+# * vectors.npy: matrice (n, d) dei vettori normalizzati, float16 oppure int8; con int8 anche scales.npy
+#   (float32, n): vettore ≈ riga int8 * scala della riga.
+# * field_<campo>.npy: codice (int32, -1 se assente) del valore di ogni chunk nel vocabolario del campo.
+# * records.bin e record_offsets.npy: per ogni chunk una riga JSON {"id", "page_content", "metadata"}; solo
+#   le righe dei k risultati vengono lette e decodificate.
+# L'esportazione viene scritta in una directory temporanea e poi sostituisce la precedente: i processi che
+# hanno ancora aperti i vecchi file continuano a leggerli finché non ricaricano l'indice.
+
+def export_index(vectordb, out_dir=VECTOR_INDEX_DIR, dtype="float16", version=None, page_size=EXPORT_PAGE_SIZE):
+    """Export the Chroma collection of ``vectordb`` to ``out_dir``; return the manifest."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype: {dtype!r} (use one of {DTYPES})")
+    collection = vectordb._collection
+    count = collection.count()
+    tmp_dir = f"{out_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    vectors = scales = None
+    vocabularies = {field: {} for field in FILTER_FIELDS}
+    codes = {field: np.full(count, -1, dtype=np.int32) for field in FILTER_FIELDS}
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    row = 0
+    with open(os.path.join(tmp_dir, "records.bin"), "wb") as records:
+        for offset in range(0, count, page_size):
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            matrix = np.asarray(page["embeddings"], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(tmp_dir, "vectors.npy"), mode="w+",
+                                                    dtype=np.dtype(dtype), shape=(count, matrix.shape[1]))
+                if dtype == "int8":
+                    scales = np.lib.format.open_memmap(os.path.join(tmp_dir, "scales.npy"), mode="w+",
+                                                       dtype=np.float32, shape=(count,))
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            end = row + len(matrix)
+            if dtype == "int8":
+                row_scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127.0
+                vectors[row:end] = np.rint(matrix / row_scales[:, None]).astype(np.int8)
+                scales[row:end] = row_scales
+            else:
+                vectors[row:end] = matrix.astype(np.float16)
+
+            for i, (chunk_id, text, metadata) in enumerate(zip(page["ids"], page["documents"], page["metadatas"])):
+                metadata = metadata or {}
+                for field in FILTER_FIELDS:
+                    value = metadata.get(field)
+                    if value is not None:
+                        vocabulary = vocabularies[field]
+                        codes[field][row + i] = vocabulary.setdefault(value, len(vocabulary))
+                line = json.dumps({"id": chunk_id, "page_content": text, "metadata": metadata},
+                                  ensure_ascii=False).encode("utf-8") + b"\n"
+                records.write(line)
+                offsets[row + i + 1] = offsets[row + i] + len(line)
+            row = end
+
+    if row != count:
+        raise RuntimeError(f"The collection changed during the export ({row} chunks read, {count} expected)")
+    if vectors is None:
+        raise ValueError("The collection is empty: nothing to export")
+    vectors.flush()
+    if scales is not None:
+        scales.flush()
+    del vectors, scales
+    np.save(os.path.join(tmp_dir, "record_offsets.npy"), offsets)
+    for field in FILTER_FIELDS:
+        np.save(os.path.join(tmp_dir, f"field_{field}.npy"), codes[field])
+
+    manifest = {
+        "format": VECTOR_INDEX_FORMAT_VERSION,
+        "dtype": dtype,
+        "count": count,
+        "dim": int(np.load(os.path.join(tmp_dir, "vectors.npy"), mmap_mode="r").shape[1]),
+        "version": version,
+        "exported_at": int(time.time()),
+        "fields": {field: sorted(vocabulary, key=vocabulary.get) for field, vocabulary in vocabularies.items()},
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False)
+
+    # Sostituzione della vecchia esportazione (due rename: la finestra senza indice è minima)
+    old_dir = f"{out_dir.rstrip(os.sep)}.old-{os.getpid()}"
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+####### Indice in sola lettura
+#
+# * I file vengono aperti con np.load(mmap_mode="r") (records.bin con np.memmap): la RAM usata è la page cache
+#   condivisa tra i processi. Le mappature appartengono allo snapshot: quelle di un'esportazione sostituita
+#   vengono chiuse quando l'ultima ricerca che usa il vecchio snapshot termina, senza file descriptor aperti.
+# * where: il sottoinsieme dei filtri Chroma prodotto da build_where ({campo: valore}, $eq, $ne, $in, $nin,
+#   $and, $or) diventa una maschera booleana sui codici dei campi; un campo non esportato è un errore.
+# * Il punteggio è il prodotto scalare con la query normalizzata (coseno): la matrice viene letta a blocchi di
+#   SEARCH_BLOCK_ROWS righe convertite in float32; con un filtro vengono lette solo le righe ammesse.
+# * Ogni RELOAD_CHECK_INTERVAL secondi viene controllato manifest.json: una nuova esportazione viene aperta
+#   al posto della precedente senza riavviare il bot.
+
+class _Snapshot:
+    """Files of one export, opened together: a reload swaps the whole snapshot at once."""
+
+    def __init__(self, path):
+        manifest_path = os.path.join(path, "manifest.json")
+        with open(manifest_path, encoding="utf-8") as file:
+            self.manifest = json.load(file)
+        if self.manifest.get("format") != VECTOR_INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector index format: {self.manifest.get('format')!r}")
+        self.mtime = os.stat(manifest_path).st_mtime_ns
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = (np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+                       if self.manifest["dtype"] == "int8" else None)
+        self.offsets = np.load(os.path.join(path, "record_offsets.npy"), mmap_mode="r")
+        self.fields = {field: np.load(os.path.join(path, f"field_{field}.npy"), mmap_mode="r")
+                       for field in self.manifest["fields"]}
+        self.vocabularies = {field: {value: code for code, value in enumerate(values)}
+                             for field, values in self.manifest["fields"].items()}
+        self.records = np.memmap(os.path.join(path, "records.bin"), dtype=np.uint8, mode="r")
+
+
+class VectorIndex:
+    """Memory-mapped, read-only vector store with Chroma-style metadata filters."""
+
+    def __init__(self, path=VECTOR_INDEX_DIR, embedding_function=None):
+        self.path = path
+        self.embedding_function = embedding_function
+        self._snapshot = _Snapshot(path)
+        self._checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked >= RELOAD_CHECK_INTERVAL:
+            with self._lock:
+                if now - self._checked >= RELOAD_CHECK_INTERVAL:
+                    self._checked = now
+                    try:
+                        changed = os.stat(os.path.join(self.path, "manifest.json")).st_mtime_ns != self._snapshot.mtime
+                    except FileNotFoundError:
+                        changed = False   # esportazione in corso: si continua con i file già aperti
+                    if changed:
+                        self._snapshot = _Snapshot(self.path)
+        return self._snapshot
+
+    @property
+    def manifest(self):
+        return self._snapshot.manifest
+
+    def __len__(self):
+        return self._snapshot.manifest["count"]
+
+    @property
+    def version(self):
+        """Version of the exported collection (changes with every export)."""
+        manifest = self._current().manifest
+        return f"{manifest.get('version')}:{manifest['exported_at']}"
+
+    def cities(self):
+        """Return the distinct (lowercase) course cities, as aida_filters.known_cities."""
+        fields = self._snapshot.manifest["fields"]
+        return sorted({city for i in range(MAX_MULTI_VALUES) for city in fields.get(f"city_{i}", [])} - {""})
+
+    def warm_up(self):
+        """Read the whole matrix once, so that the first queries do not wait for the disk."""
+        vectors = self._snapshot.vectors
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            np.add.reduce(vectors[start:start + SEARCH_BLOCK_ROWS], axis=None, dtype=np.float32)
+
+    # Ricerca
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        """Return the ``k`` chunks most similar to ``query`` among those matching ``filter``."""
+        if self.embedding_function is None:
+            raise ValueError("VectorIndex needs an embedding_function to search by text")
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        """Return (Document, cosine similarity) pairs, best first."""
+        snapshot = self._current()
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        rows = np.flatnonzero(self._mask(snapshot, filter)) if filter else None
+        if rows is not None and not len(rows):
+            return []
+        scores = self._scores(snapshot, query, rows)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._document(snapshot, int(rows[i] if rows is not None else i)), float(scores[i])) for i in top]
+
+    @staticmethod
+    def _scores(snapshot, query, rows=None):
+        total = len(snapshot.vectors) if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, total)
+            selected = slice(start, end) if rows is None else rows[start:end]
+            scores[start:end] = snapshot.vectors[selected].astype(np.float32) @ query
+            if snapshot.scales is not None:
+                scores[start:end] *= snapshot.scales[selected]
+        return scores
+
+    @staticmethod
+    def _document(snapshot, row):
+        start, end = int(snapshot.offsets[row]), int(snapshot.offsets[row + 1])
+        record = json.loads(snapshot.records[start:end].tobytes())
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    # Filtri
+
+    def _mask(self, snapshot, where):
+        masks = []
+        for key, value in where.items():
+            if key == "$and":
+                masks.append(np.logical_and.reduce([self._mask(snapshot, clause) for clause in value]))
+            elif key == "$or":
+                masks.append(np.logical_or.reduce([self._mask(snapshot, clause) for clause in value]))
+            else:
+                masks.append(self._field_mask(snapshot, key, value))
+        return np.logical_and.reduce(masks)
+
+    @staticmethod
+    def _field_mask(snapshot, field, condition):
+        if field not in snapshot.fields:
+            raise ValueError(f"Field not filterable in the vector index: {field}")
+        operator, value = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        vocabulary = snapshot.vocabularies[field]
+        if operator in ("$eq", "$ne"):
+            matches = snapshot.fields[field] == vocabulary.get(value, -2)
+        elif operator in ("$in", "$nin"):
+            matches = np.isin(snapshot.fields[field], [vocabulary[item] for item in value if item in vocabulary])
+        else:
+            raise ValueError(f"Unsupported filter operator: {operator}")
+        return ~matches if operator in ("$ne", "$nin") else matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-mapped export of the AIDA Chroma collection")
+    parser.add_argument("--out", default=VECTOR_INDEX_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="export the Chroma collection")
+    export_parser.add_argument("--persist-directory", default='ChromaDB_Bicocca_AIDA_FINAL')
+    export_parser.add_argument("--dtype", choices=DTYPES, default="float16")
+    subparsers.add_parser("info", help="print the manifest of the export")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        from langchain.vectorstores import Chroma
+        from aida_answer_cache import collection_version
+
+        start = time.perf_counter()
+        vectordb = Chroma(persist_directory=args.persist_directory)
+        manifest = export_index(vectordb, args.out, dtype=args.dtype,
+                                version=collection_version(vectordb, args.persist_directory))
+        print(f"{manifest['count']} chunk esportati in {time.perf_counter() - start:.1f}s")
+    else:
+        manifest = VectorIndex(args.out).manifest
+    print(json.dumps({key: value for key, value in manifest.items() if key != "fields"}, indent=1))
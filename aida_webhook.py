@@ -0,0 +1,320 @@
+"""
+Webhook serving mode: a local HTTP receiver in front of several bot worker processes.
+
+Telegram posts every update to the receiver, which checks the secret token
+and forwards the update, through a multiprocessing queue, to one of N worker
+processes chosen by consistent hashing on the user id: the in-memory state of
+a user (memory cache, per-user turn) and the order of their messages stay on
+one worker, and changing the number of workers moves only a fraction of the
+users. Each worker runs its own event loop and bot Application (without an
+Updater). On SIGTERM/SIGINT the receiver stops accepting updates and every
+worker handles what is already queued before shutting down.
+
+python aida_webhook.py --url https://example.org/telegram --secret <token> [--workers 4] [--port 8080]
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_HOST = "127.0.0.1"     # il receiver sta dietro il reverse proxy che termina TLS
+WEBHOOK_PORT = 8080
+WEBHOOK_WORKERS = os.cpu_count() or 1
+WORKER_QUEUE_SIZE = 1000       # update in attesa per worker; oltre il receiver risponde 503 e Telegram riprova
+FORWARD_TIMEOUT = 1.0          # secondi di attesa per un posto nella coda del worker
+RING_REPLICAS = 128            # punti di ogni worker sull'anello
+WORKER_BATCH = 100             # update letti dalla coda in un solo passaggio
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+####### Hashing consistente
+#
+# Ogni worker occupa RING_REPLICAS punti (sha1 di "<worker>:<replica>") su un anello di interi a 64 bit;
+# un utente va al primo punto che segue lo sha1 del suo id. Con più repliche il carico si distribuisce in modo
+# uniforme, e aggiungendo o togliendo un worker cambiano worker solo gli utenti dei suoi archi.
+
+def _ring_hash(value):
+    return int.from_bytes(hashlib.sha1(str(value).encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping keys (user ids) to nodes (worker indexes)."""
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        self.nodes = list(nodes)
+        points = sorted((_ring_hash(f"{node}:{replica}"), node) for node in self.nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def update_user_id(update):
+    """Return the id of the user of a raw Telegram update (the chat id or update_id if there is no user)."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        for field in ("from", "user"):
+            if isinstance(value.get(field), dict) and "id" in value[field]:
+                return value[field]["id"]
+        if isinstance(value.get("chat"), dict) and "id" in value["chat"]:
+            return value["chat"]["id"]
+    return update.get("update_id")
+
+
+####### Worker
+#
+# Un dispatcher riceve gli update di un worker; deve offrire tre coroutine:
+# * start(): prepara l'applicazione (nel processo del worker, dentro il suo event loop);
+# * put(update): accoda un update (dizionario JSON di Telegram), senza attenderne la gestione;
+# * stop(): attende la gestione di tutti gli update accodati e chiude l'applicazione.
+# BotDispatcher usa l'Application di aida_bot; il benchmark ne usa uno finto.
+# Il worker legge la coda in un thread (la get di multiprocessing è bloccante), a gruppi di WORKER_BATCH update,
+# fino al valore None che il receiver invia alla chiusura.
+
+class BotDispatcher:
+    """Dispatcher feeding the updates to an aida_bot Application without Updater."""
+
+    def __init__(self, index, workers):
+        self.index = index
+        self.workers = workers
+        self.application = None
+
+    async def start(self):
+        import aida_bot
+        import aida_streaming
+        from aida_tracing import METRICS_PORT
+
+        # Il limite globale delle modifiche dei messaggi vale per tutti i worker insieme
+        aida_streaming.edit_limiter = aida_streaming.EditRateLimiter(
+            aida_streaming.GLOBAL_EDITS_PER_SECOND / self.workers
+        )
+        # Ogni worker espone le proprie metriche sulla porta successiva a quella configurata
+        metrics_port = METRICS_PORT + 1 + self.index if METRICS_PORT else 0
+        self.application = aida_bot.build_application(polling=False, metrics_port=metrics_port)
+        await self.application.initialize()
+        if self.application.post_init is not None:
+            await self.application.post_init(self.application)
+        await self.application.start()
+
+    async def put(self, update):
+        from telegram import Update
+
+        await self.application.update_queue.put(Update.de_json(update, self.application.bot))
+
+    async def stop(self):
+        # stop() gestisce gli update ancora in coda e attende gli handler in corso
+        await self.application.stop()
+        if self.application.post_stop is not None:
+            await self.application.post_stop(self.application)
+        await self.application.shutdown()
+        if self.application.post_shutdown is not None:
+            await self.application.post_shutdown(self.application)
+
+
+def _next_batch(updates):
+    batch = [updates.get()]
+    while batch[-1] is not None and len(batch) < WORKER_BATCH:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+async def _serve_worker(updates, dispatcher):
+    await dispatcher.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            for update in await loop.run_in_executor(None, _next_batch, updates):
+                if update is None:
+                    return
+                await dispatcher.put(update)
+    finally:
+        await dispatcher.stop()
+
+
+def worker_main(index, updates, dispatcher_factory, workers):
+    """Entry point of a worker process: handle the updates of ``updates`` until the None sentinel."""
+    # La chiusura è coordinata dal receiver con il valore None in coda: Ctrl-C non deve interrompere i worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format=f"%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s", level=logging.INFO,
+        force=True,
+    )
+    asyncio.run(_serve_worker(updates, dispatcher_factory(index, workers)))
+
+
+class WorkerPool:
+    """Worker processes, each with its own bounded update queue."""
+
+    def __init__(self, workers=WEBHOOK_WORKERS, dispatcher_factory=BotDispatcher, queue_size=WORKER_QUEUE_SIZE):
+        self.queues = [multiprocessing.Queue(queue_size) for _ in range(workers)]
+        self.processes = [
+            multiprocessing.Process(target=worker_main, args=(index, self.queues[index], dispatcher_factory, workers),
+                                    name=f"aida-worker-{index}", daemon=True)
+            for index in range(workers)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def stop(self, timeout=None):
+        """Send the sentinel to every worker and wait for them to drain their queues."""
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Il worker %s non si è chiuso entro %ss: terminato", process.name, timeout)
+                process.terminate()
+
+
+####### Receiver HTTP
+#
+# Un ThreadingHTTPServer riceve i POST di Telegram su WEBHOOK_PATH: controlla il secret token (inviato da
+# Telegram nell'header X-Telegram-Bot-Api-Secret-Token), legge l'update e lo accoda al worker dell'utente.
+# La risposta parte appena l'update è in coda; se la coda del worker resta piena per FORWARD_TIMEOUT il
+# receiver risponde 503 e Telegram ritenta la consegna più tardi.
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # connessioni keep-alive con Telegram
+    receiver = None
+
+    def do_POST(self):
+        receiver = self.receiver
+        if self.path != receiver.path:
+            self._reply(404)
+            return
+        if receiver.secret is not None and not hmac.compare_digest(
+                self.headers.get(SECRET_HEADER, "").encode("utf-8"), receiver.secret.encode("utf-8")):
+            receiver.count("rejected")
+            self._reply(403)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            update = json.loads(body)
+        except ValueError:
+            receiver.count("invalid")
+            self._reply(400)
+            return
+        self._reply(200 if receiver.forward(update) else 503)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("webhook: " + format, *args)
+
+
+class WebhookReceiver:
+    """HTTP endpoint forwarding Telegram updates to the worker queues by consistent hashing on the user id."""
+
+    def __init__(self, queues, secret=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 forward_timeout=FORWARD_TIMEOUT):
+        self.queues = queues
+        self.secret = secret
+        self.path = path
+        self.forward_timeout = forward_timeout
+        self.ring = HashRing(range(len(queues)))
+        self.counts = {"forwarded": 0, "busy": 0, "rejected": 0, "invalid": 0}
+        self._lock = threading.Lock()
+        handler = type("WebhookRequestHandler", (_WebhookRequestHandler,), {"receiver": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def forward(self, update):
+        """Queue the update on the worker of its user; return False if that queue stays full."""
+        try:
+            self.queues[self.ring.node_for(update_user_id(update))].put(update, timeout=self.forward_timeout)
+        except queue.Full:
+            self.count("busy")
+            return False
+        self.count("forwarded")
+        return True
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """Stop accepting updates (from another thread than serve_forever)."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def serve(pool, receiver):
+    """Run the receiver until SIGTERM/SIGINT, then drain the (already started) workers."""
+    def stop(signum, frame):
+        logger.info("Segnale %s: chiusura del receiver e svuotamento delle code dei worker", signum)
+        threading.Thread(target=receiver.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Webhook in ascolto su %s:%d%s con %d worker", *receiver.address, receiver.path, len(pool.queues))
+    receiver.serve_forever()
+    pool.stop()
+    logger.info("Update ricevuti: %s", receiver.counts)
+
+
+async def set_webhook(token, url, secret, max_connections=40):
+    from telegram import Bot, Update
+
+    async with Bot(token) as bot:
+        await bot.set_webhook(url, secret_token=secret, max_connections=max_connections,
+                              allowed_updates=Update.ALL_TYPES)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AIDA webhook receiver with sharded bot workers")
+    parser.add_argument("--url", help="public HTTPS URL of the webhook, registered with Telegram at startup")
+    parser.add_argument("--secret", default=os.environ.get("AIDA_WEBHOOK_SECRET"),
+                        help="secret token sent by Telegram with every update (default: $AIDA_WEBHOOK_SECRET)")
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    parser.add_argument("--host", default=WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--path", default=WEBHOOK_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s - receiver - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    if args.secret is None:
+        parser.error("a secret token is required (--secret or AIDA_WEBHOOK_SECRET)")
+    if args.url:
+        import AIDAkeys
+        asyncio.run(set_webhook(AIDAkeys.telegramBOTtoken, args.url, args.secret))
+
+    # I worker partono prima del receiver: il fork avviene quando il processo non ha ancora thread né socket
+    worker_pool = WorkerPool(args.workers)
+    worker_pool.start()
+    serve(worker_pool, WebhookReceiver(worker_pool.queues, secret=args.secret, host=args.host, port=args.port,
+                                       path=args.path))
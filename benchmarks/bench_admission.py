@@ -0,0 +1,175 @@
+"""
+Message coalescing and admission control under bursty users and overload.
+
+The real echo handler runs over the fakes of bench_e2e (Firebase, chat models,
+vector store and Telegram with injected latencies) in two scenarios:
+
+* bursts: every user sends a question split over --fragments messages,
+  --gap seconds apart, without waiting for the answers. Without coalescing
+  each fragment costs a memory read, a placeholder and an LLM run; by default
+  the first fragment is answered at once and the fragments that arrive while
+  it is running are merged into one follow-up; with a debounce window of
+  --debounce seconds (if given) every burst also waits for that much silence.
+  Reported: LLM calls, Firebase reads, Telegram sends and the time from the
+  last fragment to the last answer.
+* overload: --overload-users users send one course question at the same
+  moment, far more than the agent runs in parallel. With an unbounded queue
+  every message waits; with an admission queue of --queue messages the rest
+  get the busy reply at once. Reported: answered and shed messages, the
+  p50/p95 latency of the answered ones and the largest queue depth.
+
+Usage: python benchmarks/bench_admission.py [--users 50] [--fragments 3] [--gap 0.3] [--debounce 0]
+       [--overload-users 200] [--queue 16] [--llm-latency 0.3]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from firebase_admin import db
+
+from fakes import (FakeBot, FakeContext, FakeFirebase, FakeMessage, FakeUpdate, FakeVectorStore, HashingEmbeddings,
+                   SlowChatModel, agent_reply, answer_reply, condense_reply, fake_pipeline)
+
+from aida_admission import BUSY_MESSAGE, AdmissionController, MessageCoalescer
+from aida_filters import FilteredRetriever
+from aida_memory import MemoryCache
+from aida_router import IntentRouter
+from aida_runner import AgentRunner
+
+
+FRAGMENTS = ["Ciao", "vorrei iscrivermi all'università", "quali corsi di laurea triennale in informatica ci sono?",
+             "e sono a numero programmato?"]
+COURSE_QUESTION = "Quali corsi di laurea triennale in informatica ci sono?"
+
+
+class RecordingMessage(FakeMessage):
+    """FakeMessage that keeps the texts of the replies it received."""
+
+    def __init__(self, bot, text=None):
+        super().__init__(bot, text)
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return await super().reply_text(text, **kwargs)
+
+
+def make_bot_data(args, debounce, max_queue, merge=True):
+    models = [SlowChatModel(latency=args.llm_latency, reply=reply)
+              for reply in (agent_reply, answer_reply, condense_reply)]
+    vectorstore = FakeVectorStore(embedding_function=HashingEmbeddings(), latency=args.retrieval_latency)
+    runner = AgentRunner()
+    bot_data = {"memory_cache": MemoryCache(), "agent_runner": runner, "router": IntentRouter(),
+                "pipeline": fake_pipeline(models=models, retriever=FilteredRetriever(vectorstore=vectorstore, k=4)),
+                "coalescer": MessageCoalescer(window=debounce, merge=merge),
+                "admission": AdmissionController(max_active=runner.max_concurrency, max_queue=max_queue)}
+    return bot_data, models
+
+
+async def run_scenario(aida_bot, firebase, bot_data, users):
+    """Run ``users`` (coroutine functions taking the context) and close the bot_data services."""
+    firebase.data.clear()
+    firebase.timings.clear()
+    context = FakeContext(bot_data)
+    await bot_data["memory_cache"].start()
+    results = await asyncio.gather(*(user(context) for user in users))
+    await bot_data["memory_cache"].close()
+    bot_data["agent_runner"].shutdown()
+    return results
+
+
+async def bursts(aida_bot, firebase, args, debounce, merge=True):
+    bot = FakeBot(args.telegram_latency)
+    bot_data, models = make_bot_data(args, debounce, max_queue=10 ** 6, merge=merge)
+
+    def user(user_id):
+        async def send(context):
+            handlers = []
+            for i in range(args.fragments):
+                if i:
+                    await asyncio.sleep(args.gap)
+                text = FRAGMENTS[i % len(FRAGMENTS)]
+                handlers.append(asyncio.create_task(aida_bot.echo(FakeUpdate(bot, user_id, text), context)))
+            last_sent = time.perf_counter()
+            await asyncio.gather(*handlers)
+            return time.perf_counter() - last_sent
+        return send
+
+    latencies = await run_scenario(aida_bot, firebase, bot_data, [user(1000 + i) for i in range(args.users)])
+    return {"llm calls": sum(model.calls for model in models), "firebase reads": len(firebase.timings["get"]),
+            "telegram sends": len(bot.timings["send"]), "p50 s": statistics.median(latencies),
+            "p95 s": quantile(latencies, 0.95)}
+
+
+async def overload(aida_bot, firebase, args, max_queue):
+    bot = FakeBot(args.telegram_latency)
+    bot_data, models = make_bot_data(args, debounce=0.0, max_queue=max_queue)
+    admission = bot_data["admission"]
+
+    def user(user_id):
+        async def send(context):
+            update = FakeUpdate(bot, user_id, COURSE_QUESTION)
+            update.message = RecordingMessage(bot, COURSE_QUESTION)
+            start = time.perf_counter()
+            await aida_bot.echo(update, context)
+            return None if BUSY_MESSAGE in update.message.replies else time.perf_counter() - start
+        return send
+
+    results = await run_scenario(aida_bot, firebase, bot_data, [user(5000 + i) for i in range(args.overload_users)])
+    answered = [latency for latency in results if latency is not None]
+    return {"answered": len(answered), "shed": admission.shed, "llm calls": sum(model.calls for model in models),
+            "p50 s": statistics.median(answered), "p95 s": quantile(answered, 0.95),
+            "max queue": admission.max_queue_depth}
+
+
+def quantile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def print_rows(title, rows):
+    print(f"\n{title}")
+    columns = list(next(iter(rows.values())))
+    print(f"  {'':<22}" + "".join(f"{column:>16}" for column in columns))
+    for name, row in rows.items():
+        print(f"  {name:<22}" + "".join(f"{row[column]:>16.3f}" if isinstance(row[column], float)
+                                        else f"{row[column]:>16}" for column in columns))
+
+
+async def run(aida_bot, firebase, args):
+    rows = {"no coalescing": await bursts(aida_bot, firebase, args, debounce=0.0, merge=False),
+            "merge while busy": await bursts(aida_bot, firebase, args, debounce=0.0)}
+    if args.debounce > 0:
+        rows[f"debounce {args.debounce}s"] = await bursts(aida_bot, firebase, args, debounce=args.debounce)
+    print_rows(f"bursts: {args.users} users x {args.fragments} fragments, {args.gap}s apart", rows)
+    print_rows(f"overload: {args.overload_users} course questions at once", {
+        "unbounded queue": await overload(aida_bot, firebase, args, max_queue=10 ** 6),
+        f"admission queue {args.queue}": await overload(aida_bot, firebase, args, max_queue=args.queue),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="users sending bursts")
+    parser.add_argument("--fragments", type=int, default=3, help="messages per burst")
+    parser.add_argument("--gap", type=float, default=0.3, help="seconds between the messages of a burst")
+    parser.add_argument("--debounce", type=float, default=0.0,
+                        help="debounce window in seconds, compared with the default coalescing if given")
+    parser.add_argument("--overload-users", type=int, default=200)
+    parser.add_argument("--queue", type=int, default=16, help="admission queue in the bounded run")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--retrieval-latency", type=float, default=0.02)
+    parser.add_argument("--firebase-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    args = parser.parse_args()
+
+    firebase = FakeFirebase(args.firebase_latency)
+    db.reference = firebase.reference
+    import aida_bot
+    asyncio.run(run(aida_bot, firebase, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Load test of the agent execution: throughput as the number of concurrent chats grows.
+
+Every chat sends a few messages in a row; each message runs the real agent
+(AidaPipeline) over fake chat models that block for --latency seconds per call.
+"inline" calls agent.run on the event loop, as echo used to; "runner" goes
+through AgentRunner (thread pool, global limit, per-user ordering).
+
+Usage: python benchmarks/bench_concurrency.py [--latency 0.2] [--messages 3] [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import time
+
+from fakes import fake_pipeline
+
+from aida_memory import new_memory
+from aida_runner import AgentRunner
+
+
+async def chat(user_id, pipeline, runner, messages, answered):
+    memory = new_memory()
+    for i in range(messages):
+        text = f"messaggio {i} della chat {user_id}"
+        agent = pipeline.bind(memory)
+        if runner is None:
+            agent.run(input=text)
+        else:
+            async with runner.user_turn(user_id):
+                await runner.run(agent.run, input=text)
+        answered.append((user_id, i))
+
+
+async def measure(chats, pipeline, messages, concurrency, use_runner):
+    runner = AgentRunner(max_concurrency=concurrency) if use_runner else None
+    answered = []
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(user_id, pipeline, runner, messages, answered) for user_id in range(chats)))
+    elapsed = time.perf_counter() - start
+    if runner is not None:
+        runner.shutdown()
+
+    for user_id in range(chats):
+        order = [i for uid, i in answered if uid == user_id]
+        assert order == sorted(order), f"messages of chat {user_id} answered out of order"
+    return len(answered) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--messages", type=int, default=3, help="messages per chat")
+    parser.add_argument("--concurrency", type=int, default=8, help="AgentRunner concurrency limit")
+    parser.add_argument("--chats", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    pipeline = fake_pipeline(latency=args.latency)
+    print(f"{'chats':>6} {'inline msg/s':>13} {'runner msg/s':>13}")
+    for chats in args.chats:
+        inline = asyncio.run(measure(chats, pipeline, args.messages, args.concurrency, use_runner=False))
+        runner = asyncio.run(measure(chats, pipeline, args.messages, args.concurrency, use_runner=True))
+        print(f"{chats:>6} {inline:>13.2f} {runner:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
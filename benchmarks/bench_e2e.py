@@ -0,0 +1,224 @@
+"""
+Offline end-to-end latency of the bot handlers (/start, text messages, /reset), stage by stage.
+
+The real handlers of aida_bot run with local stand-ins for everything they
+reach over the network: Firebase (db.reference), embeddings, Chroma, the chat
+models and the Telegram Bot API, each with a configurable latency. They are
+driven with synthetic updates: every chat sends /start, a few messages from a
+realistic mix and /reset, with a growing number of chats in flight at the same
+time. Importing aida_bot has no side effects, so only db.reference is patched.
+Every chat waits for an answer before its next message, so messages are
+never coalesced or shed (a --debounce window only adds its wait): the bursts
+and the overload are measured by bench_admission.py.
+
+For every concurrency level the p50/p95/p99 of each stage and the throughput
+are printed and saved as JSON, so runs on different commits can be compared:
+memory_load (Firebase get), chain_construction (pipeline.bind / bind_qa),
+agent_llm / condense / answer (LLM calls), retrieval (query embedding and
+vector search), memory_save (batched Firebase update), telegram_send /
+telegram_edit, and the total of each handler.
+
+Usage: python benchmarks/bench_e2e.py [--concurrency 1,4,16,64] [--chats 32] [--messages 4]
+       [--llm-latency 0.3] [--embed-latency 0.05] [--retrieval-latency 0.02] [--firebase-latency 0.05]
+       [--telegram-latency 0.03] [--debounce 0] [--output bench_e2e.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+
+from firebase_admin import db
+
+from fakes import (FakeBot, FakeContext, FakeFirebase, FakeUpdate, FakeVectorStore, HashingEmbeddings, SlowChatModel,
+                   agent_reply, answer_reply, condense_reply, fake_pipeline)
+from bench_router import MESSAGES
+
+from aida_admission import AdmissionController, MessageCoalescer
+from aida_embeddings import CachedEmbeddings
+from aida_filters import FilteredRetriever
+from aida_memory import MemoryCache
+from aida_router import IntentRouter
+from aida_runner import AgentRunner
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TimedChatModel(SlowChatModel):
+    """SlowChatModel that records the duration of every call."""
+
+    timings: list = None
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super()._call(messages, stop=stop, run_manager=run_manager, **kwargs)
+        finally:
+            self.timings.append(time.perf_counter() - start)
+
+
+class TimedPipeline:
+    """AidaPipeline wrapper recording how long binding a memory (chain construction) takes."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.timings = []
+
+    def _timed(self, bind, memory):
+        start = time.perf_counter()
+        try:
+            return bind(memory)
+        finally:
+            self.timings.append(time.perf_counter() - start)
+
+    def bind(self, memory):
+        return self._timed(self.pipeline.bind, memory)
+
+    def bind_qa(self, memory):
+        return self._timed(self.pipeline.bind_qa, memory)
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000, 2)
+
+    return {"count": len(ordered), "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50": at(0.50), "p95": at(0.95), "p99": at(0.99)}
+
+
+async def run_level(aida_bot, firebase, embeddings, concurrency, args, first_user):
+    firebase.data.clear()
+    firebase.timings.clear()
+    bot = FakeBot(args.telegram_latency)
+    models = [TimedChatModel(latency=args.llm_latency, reply=reply, timings=[])
+              for reply in (agent_reply, answer_reply, condense_reply)]
+    vectorstore = FakeVectorStore(embedding_function=embeddings, latency=args.retrieval_latency)
+    pipeline = TimedPipeline(fake_pipeline(models=models, retriever=FilteredRetriever(vectorstore=vectorstore, k=4)))
+    runner = AgentRunner()
+    bot_data = {"memory_cache": MemoryCache(), "agent_runner": runner, "router": IntentRouter(), "pipeline": pipeline,
+                "coalescer": MessageCoalescer(window=args.debounce),
+                "admission": AdmissionController(max_active=runner.max_concurrency, max_queue=10 ** 6)}
+    context = FakeContext(bot_data)
+    handlers = defaultdict(list)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def timed(name, handler, update):
+        start = time.perf_counter()
+        await handler(update, context)
+        handlers[name].append(time.perf_counter() - start)
+
+    async def chat(user_id):
+        async with slots:
+            await timed("handler_start", aida_bot.start, FakeUpdate(bot, user_id, "/start"))
+            for i in range(args.messages):
+                text = MESSAGES[(user_id + i) % len(MESSAGES)]
+                await timed("handler_echo", aida_bot.echo, FakeUpdate(bot, user_id, text))
+            await timed("handler_reset", aida_bot.reset_command, FakeUpdate(bot, user_id, "/reset"))
+
+    await bot_data["memory_cache"].start()
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(first_user + i) for i in range(max(args.chats, concurrency))))
+    elapsed = time.perf_counter() - start
+    await bot_data["memory_cache"].close()
+    bot_data["agent_runner"].shutdown()
+
+    stages = {
+        "memory_load": firebase.timings["get"],
+        "chain_construction": pipeline.timings,
+        "agent_llm": models[0].timings,
+        "answer": models[1].timings,
+        "condense": models[2].timings,
+        "retrieval": vectorstore.timings,
+        "memory_save": firebase.timings["update"],
+        "telegram_send": bot.timings["send"],
+        "telegram_edit": bot.timings["edit"],
+        **handlers,
+    }
+    messages = len(handlers["handler_echo"])
+    return {
+        "concurrency": concurrency,
+        "chats": max(args.chats, concurrency),
+        "messages": messages,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 2),
+        "stages": {stage: percentiles(samples) for stage, samples in stages.items()},
+    }
+
+
+def print_level(result):
+    print(f"\nconcurrency {result['concurrency']}: {result['messages']} messages in {result['seconds']}s "
+          f"({result['messages_per_second']} messages/s)")
+    print(f"  {'stage':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in result["stages"].items():
+        if stats["count"]:
+            print(f"  {stage:<20}{stats['count']:>7}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(aida_bot, firebase, embeddings, args):
+    results = []
+    for i, concurrency in enumerate(args.concurrency):
+        result = await run_level(aida_bot, firebase, embeddings, concurrency, args, first_user=(i + 1) * 100000)
+        print_level(result)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[1, 4, 16, 64], help="comma-separated numbers of chats in flight")
+    parser.add_argument("--chats", type=int, default=32, help="chats per level (at least the concurrency)")
+    parser.add_argument("--messages", type=int, default=4, help="text messages per chat")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--retrieval-latency", type=float, default=0.02)
+    parser.add_argument("--firebase-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--debounce", type=float, default=0.0,
+                        help="coalescing window in seconds (every message waits for it: chats here never send bursts)")
+    parser.add_argument("--output", default="bench_e2e.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    firebase = FakeFirebase(args.firebase_latency)
+    db.reference = firebase.reference
+    start = time.perf_counter()
+    import aida_bot
+    import_seconds = time.perf_counter() - start
+    print(f"import aida_bot: {import_seconds * 1000:.0f} ms")
+    with tempfile.TemporaryDirectory() as directory:
+        embeddings = CachedEmbeddings(HashingEmbeddings(latency=args.embed_latency),
+                                      path=os.path.join(directory, "embeddings_cache.sqlite3"))
+        results = asyncio.run(run(aida_bot, firebase, embeddings, args))
+
+    report = {
+        "commit": git_commit(),
+        "import_seconds": round(import_seconds, 3),
+        "created_at": int(time.time()),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "levels": results,
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"\nresults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
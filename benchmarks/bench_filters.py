@@ -0,0 +1,83 @@
+"""
+Recall and latency of the course retrieval with and without metadata pre-filters.
+
+A synthetic collection is indexed in a temporary Chroma directory with
+deterministic hashing embeddings. Each query asks for a topic plus explicit
+constraints ("magistrale", "in inglese", "a numero programmato"...); a
+retrieved chunk is relevant when its course has the topic and satisfies the
+constraints. Recall@k is measured against min(k, relevant chunks).
+
+Usage: python benchmarks/bench_filters.py [--courses 600] [--k 4]
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from fakes import HashingEmbeddings
+from synthetic import TOPICS, synthetic_chunks, synthetic_courses
+
+from langchain.vectorstores import Chroma
+
+from aida_filters import FilteredRetriever, analyze_query
+
+
+CONSTRAINTS = [
+    ("corsi di laurea magistrale in inglese", {"level": "magistrale", "language_code": "en"}),
+    ("lauree triennali a numero programmato", {"level": "triennale", "access": "programmato_locale"}),
+    ("corsi a ciclo unico ad accesso libero", {"level": "ciclo_unico", "access": "libero"}),
+    ("lauree magistrali a Monza", {"level": "magistrale", "city_0": "monza"}),
+]
+
+
+def relevant(metadata, topic, expected):
+    return metadata["name"].lower().startswith(topic) and all(metadata.get(f) == v for f, v in expected.items())
+
+
+def run(search, queries, k):
+    recalls, latencies = [], []
+    for question, topic, expected, total_relevant in queries:
+        start = time.perf_counter()
+        documents = search(question)
+        latencies.append(time.perf_counter() - start)
+        hits = sum(relevant(document.metadata, topic, expected) for document in documents[:k])
+        recalls.append(hits / min(k, total_relevant))
+    return statistics.mean(recalls), statistics.mean(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=600)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    ids, texts, metadatas = synthetic_chunks(synthetic_courses(args.courses))
+    embeddings = HashingEmbeddings()
+    with tempfile.TemporaryDirectory() as directory:
+        vectordb = Chroma.from_texts(texts, embeddings, metadatas=metadatas, ids=ids,
+                                     collection_name="bench_filters", persist_directory=directory)
+
+        queries = []
+        for topic in TOPICS:
+            for phrase, expected in CONSTRAINTS:
+                total_relevant = sum(relevant(metadata, topic, expected) for metadata in metadatas)
+                if total_relevant:
+                    queries.append((f"{phrase} su {topic}", topic, expected, total_relevant))
+
+        # Verifica che l'analisi della domanda riconosca i vincoli usati per il ground truth
+        for question, _, expected, _ in queries:
+            assert analyze_query(question, ("monza",)), question
+
+        filtered = FilteredRetriever(vectorstore=vectordb, k=args.k, cities=("milano", "monza", "bergamo", "pavia"))
+        plain_recall, plain_ms = run(lambda q: vectordb.similarity_search(q, k=args.k), queries, args.k)
+        filtered_recall, filtered_ms = run(filtered.get_relevant_documents, queries, args.k)
+
+    print(f"{len(texts)} chunks, {len(queries)} queries, k={args.k}")
+    print(f"{'':<10} {'recall@k':>9} {'ms/query':>9}")
+    print(f"{'plain':<10} {plain_recall:>9.3f} {plain_ms:>9.2f}")
+    print(f"{'filtered':<10} {filtered_recall:>9.3f} {filtered_ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
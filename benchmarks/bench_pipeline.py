@@ -0,0 +1,74 @@
+"""
+Per-message setup overhead of the answering pipeline, before and after AidaPipeline.
+
+"before" reproduces what echo used to do for every message: three chat clients,
+a new retriever, ConversationalRetrievalChain.from_llm, the Tool list,
+initialize_agent and the agent template patch. "after" is AidaPipeline.bind().
+No LLM is called: only construction is measured.
+
+Usage: python benchmarks/bench_pipeline.py [--messages 500]
+"""
+
+import argparse
+import time
+
+from fakes import BENCH_AGENT_TEMPLATE, BENCH_TEMPLATE, FakeRetriever, chat_model
+
+from langchain.agents import AgentType, Tool, initialize_agent
+from langchain.chains import ConversationalRetrievalChain
+from langchain.memory import ConversationBufferWindowMemory
+
+from aida_pipeline import (AidaPipeline, QA_TOOL_DESCRIPTION, QA_TOOL_NAME, THOUGHT_TOOL_DESCRIPTION,
+                           THOUGHT_TOOL_NAME, build_prompt, processThought)
+
+
+def setup_before(prompt, memory):
+    qa = ConversationalRetrievalChain.from_llm(chat_model(),
+                                               verbose=False,
+                                               retriever=FakeRetriever(),
+                                               memory=memory,
+                                               chain_type="stuff",
+                                               condense_question_llm=chat_model(),
+                                               combine_docs_chain_kwargs={'prompt': prompt})
+    tools = [
+        Tool(name=QA_TOOL_NAME, func=qa.run, description=QA_TOOL_DESCRIPTION),
+        Tool(name=THOUGHT_TOOL_NAME, description=THOUGHT_TOOL_DESCRIPTION, func=processThought),
+    ]
+    agent = initialize_agent(tools, chat_model(),
+                             agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
+                             verbose=False,
+                             memory=memory,
+                             agent_kwargs={"input_variables": ["input", "agent_scratchpad", "chat_history"]},
+                             handle_parsing_errors=True)
+    agent.agent.llm_chain.prompt.template = BENCH_AGENT_TEMPLATE
+    return agent
+
+
+def measure(label, setup, messages):
+    memories = [ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, k=5)
+                for _ in range(messages)]
+    start = time.perf_counter()
+    for memory in memories:
+        setup(memory)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {messages} messages  {elapsed * 1000 / messages:9.3f} ms/message")
+    return elapsed / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    prompt = build_prompt(BENCH_TEMPLATE)
+    pipeline = AidaPipeline(llm=chat_model(), qa_llm=chat_model(), condense_llm=chat_model(),
+                            retriever=FakeRetriever(), prompt=prompt,
+                            agent_template=BENCH_AGENT_TEMPLATE, verbose=False)
+
+    before = measure("before", lambda memory: setup_before(prompt, memory), args.messages)
+    after = measure("after", pipeline.bind, args.messages)
+    print(f"speedup  {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+LLM calls per message, before and after the intent router.
+
+A realistic mix of chat messages (greetings, course questions, open-ended
+questions about interests and jobs) is answered by the real AidaPipeline over
+fake chat models that count their calls. "before" sends every message to the
+ReAct agent, as echo used to; "after" routes it like echo does now: templated
+answer, retrieval chain alone, or agent.
+
+Usage: python benchmarks/bench_router.py [--rounds 20]
+"""
+
+import argparse
+from collections import Counter
+
+from fakes import fake_models, fake_pipeline
+
+from aida_memory import new_memory
+from aida_router import COURSE, IntentRouter
+
+
+MESSAGES = [
+    "Ciao!",
+    "Chi sei?",
+    "Quali corsi di laurea triennale ci sono in informatica?",
+    "Il corso di Data Science è a numero programmato?",
+    "Mi piacciono la matematica e i computer, cosa potrei studiare?",
+    "Vorrei diventare financial manager",
+    "Quanti CFU ha la laurea magistrale in psicologia?",
+    "Grazie mille",
+    "Che esami ci sono al primo anno di economia?",
+    "Non so ancora cosa fare dopo il liceo, mi aiuti?",
+    "Arrivederci",
+    "Buongiorno",
+]
+
+
+def answer(pipeline, router, memory, text):
+    if router is None:
+        return pipeline.bind(memory).run(input=text)
+    route = router.route(text)
+    if route.answer is not None:
+        memory.chat_memory.add_user_message(text)
+        memory.chat_memory.add_ai_message(route.answer)
+        return route.answer
+    if route.intent == COURSE:
+        return pipeline.bind_qa(memory).run(question=text)
+    return pipeline.bind(memory).run(input=text)
+
+
+def measure(label, rounds, use_router):
+    models = fake_models()
+    pipeline = fake_pipeline(models=models)
+    router = IntentRouter() if use_router else None
+    for _ in range(rounds):
+        memory = new_memory()
+        for text in MESSAGES:
+            answer(pipeline, router, memory, text)
+    messages = rounds * len(MESSAGES)
+    calls = sum(model.calls for model in models)
+    agent, qa, condense = (model.calls / messages for model in models)
+    print(f"{label:<7} {messages} messages  {calls / messages:5.2f} LLM calls/message"
+          f"  (agent {agent:.2f}, qa {qa:.2f}, condense {condense:.2f})")
+    if router is not None:
+        print(f"        routes: {dict(router.counts)}")
+    return calls / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"routes of the message mix: {Counter(IntentRouter().route(text).intent for text in MESSAGES)}")
+    before = measure("before", args.rounds, use_router=False)
+    after = measure("after", args.rounds, use_router=True)
+    print(f"LLM calls saved: {(1 - after / before) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Build time and query latency of the skill-course graph of aida_skills.
+
+A synthetic universities tree (the courses of synthetic.py, one text file in
+place of each SUA PDF, read by a stand-in for extract_pdf_text) is turned
+into the graph file; then --changed courses are touched and the graph is
+rebuilt incrementally. The graph is loaded as the bot does and a mix of skill
+and job questions is answered: the report gives the p50/p95 latency of
+SkillGraph.answer and of the intent router with the graph, none of which
+calls an LLM.
+
+Usage: python benchmarks/bench_skills.py [--courses 2000] [--changed 20] [--queries 2000] [--workers 4]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from synthetic import TOPICS, synthetic_courses
+
+import aida_skills
+from aida_router import IntentRouter
+from aida_skills import SkillGraph, build_graph
+
+
+QUESTIONS = [
+    "Vorrei diventare financial manager",
+    "Mi piace studiare machine learning, ci sono corsi che mi consiglieresti?",
+    "Voglio diventare psicologo, quale laurea magistrale?",
+    "Mi interessano il diritto e la finanza",
+    "Vorrei lavorare come guida turistica a Milano",
+    "Voglio diventare data scientist",
+]
+
+
+def read_text(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def write_tree(root, count):
+    rng = random.Random(5)
+    for i, (course, topic) in enumerate(synthetic_courses(count)):
+        course_dir = os.path.join(root, "UNIVERSITA SINTETICA", course["name"] + "_" + course["sua_code"])
+        os.makedirs(course_dir, exist_ok=True)
+        words = TOPICS[topic].split() + TOPICS[rng.choice(list(TOPICS))].split()
+        with open(os.path.join(course_dir, os.path.basename(course_dir) + ".pdf"), "w", encoding="utf-8") as file:
+            file.write(" ".join(rng.choice(words) for _ in range(2000)))
+        with open(os.path.join(course_dir, "metadata.txt"), "w", encoding="utf-8") as file:
+            json.dump(course, file, ensure_ascii=False)
+
+
+def latencies(func, questions):
+    samples = []
+    for question in questions:
+        start = time.perf_counter()
+        func(question)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--changed", type=int, default=20, help="courses modified before the incremental build")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    # Testo al posto dei PDF: i processi del pool (fork) ereditano la sostituzione
+    aida_skills.extract_pdf_text = read_text
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "universities")
+        path = os.path.join(directory, "skill_graph.json")
+        write_tree(root, args.courses)
+
+        print("full build:       ", build_graph(root, path, workers=args.workers))
+        course_dirs = sorted(os.listdir(os.path.join(root, "UNIVERSITA SINTETICA")))
+        for name in course_dirs[:args.changed]:
+            with open(os.path.join(root, "UNIVERSITA SINTETICA", name, name + ".pdf"), "a", encoding="utf-8") as file:
+                file.write(" statistica statistica")
+        print("incremental build:", build_graph(root, path, workers=args.workers))
+        print(f"graph file: {os.path.getsize(path) / 1024:.0f} KiB")
+
+        start = time.perf_counter()
+        graph = SkillGraph(path)
+        print(f"load: {(time.perf_counter() - start) * 1000:.1f} ms, {len(graph)} courses")
+
+        questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.queries)]
+        router = IntentRouter(skill_graph=graph)
+        for name, func in (("SkillGraph.answer", graph.answer), ("IntentRouter.route", router.route)):
+            p50, p95 = latencies(func, questions)
+            print(f"{name:<20} p50 {p50:.3f} ms  p95 {p95:.3f} ms")
+        print(f"routes: {dict(router.counts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Memory per worker and query latency: Chroma versus the memory-mapped export of aida_vecindex.
+
+A synthetic collection (random unit embeddings of OpenAI size, the metadata of
+synthetic.py) is stored in a temporary Chroma directory and exported in
+float16 and int8. For each backend, --workers fresh processes open the store
+at the same time and run the same queries (vectors close to random chunks, half
+of them with the where filters of aida_filters). Every worker reports its
+resident memory (RSS), proportional set size (PSS: shared pages divided among
+the processes that map them) and private memory, measured after the queries
+minus before opening the store, plus p50/p95 query latency. The report also
+gives the agreement of the top-k with Chroma's results.
+
+Usage: python benchmarks/bench_vecindex.py [--courses 2000] [--chunks 5] [--dim 1536] [--workers 4] [--queries 200] [--k 4]
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from synthetic import CITIES, synthetic_chunks, synthetic_courses
+
+from aida_filters import analyze_query, build_where
+from aida_vecindex import VectorIndex, export_index
+
+
+QUESTIONS = [
+    None,
+    "corsi di laurea magistrale in inglese",
+    None,
+    "lauree triennali a numero programmato",
+    None,
+    "corsi a ciclo unico a Milano",
+]
+
+
+def memory_kb():
+    """Return {"rss", "pss", "private"} of this process in KiB (Linux /proc/self/smaps_rollup)."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) >= 3 and parts[0].endswith(":"):
+                fields[parts[0][:-1]] = int(parts[1])
+    return {"rss": fields["Rss"], "pss": fields["Pss"],
+            "private": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+
+def open_store(backend, path):
+    if backend == "chroma":
+        from langchain.vectorstores import Chroma
+        return Chroma(collection_name="bench_vecindex", persist_directory=path)
+    return VectorIndex(path)
+
+
+def worker(backend, path, queries, k, start_barrier, results):
+    before = memory_kb()
+    store = open_store(backend, path)
+    start_barrier.wait()
+    latencies, top_ids = [], []
+    for vector, where in queries:
+        start = time.perf_counter()
+        documents = store.similarity_search_by_vector(vector, k=k, filter=where)
+        latencies.append(time.perf_counter() - start)
+        top_ids.append([(document.metadata["course_key"], document.metadata["chunk"]) for document in documents])
+    after = memory_kb()
+    results.put((os.getpid(), {key: after[key] - before[key] for key in after}, latencies, top_ids))
+
+
+def measure(backend, path, queries, args):
+    context = multiprocessing.get_context("spawn")   # processi nuovi: nessuna pagina ereditata dal padre
+    results = context.Queue()
+    start_barrier = context.Barrier(args.workers)
+    processes = [context.Process(target=worker, args=(backend, path, queries, args.k, start_barrier, results))
+                 for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    memory = {key: statistics.mean(report[1][key] for report in reports) / 1024 for key in reports[0][1]}
+    latencies = sorted(latency for report in reports for latency in report[2])
+    return memory, latencies, reports[0][3]
+
+
+def agreement(top_ids, reference):
+    """Mean fraction of the reference top-k found in the top-k."""
+    return statistics.mean(len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(top_ids, reference))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=5, help="chunks per course")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    from langchain.vectorstores import Chroma
+
+    ids, texts, metadatas = synthetic_chunks(synthetic_courses(args.courses), chunks_per_course=args.chunks)
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((len(ids), args.dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    cities = tuple(city.lower() for city in CITIES)
+    queries = []
+    for i in range(args.queries):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        vector = vectors[rng.integers(len(ids))] + rng.standard_normal(args.dim, dtype=np.float32) * 0.02
+        queries.append(((vector / np.linalg.norm(vector)).tolist(),
+                        build_where(analyze_query(question, cities)) if question else None))
+
+    with tempfile.TemporaryDirectory() as directory:
+        chroma_dir = os.path.join(directory, "chroma")
+        vectordb = Chroma(collection_name="bench_vecindex", persist_directory=chroma_dir)
+        for start in range(0, len(ids), 2000):
+            end = start + 2000
+            vectordb._collection.add(ids=ids[start:end], embeddings=vectors[start:end].tolist(),
+                                     metadatas=metadatas[start:end], documents=texts[start:end])
+        vectordb.persist()
+        paths = {"chroma": chroma_dir}
+        for dtype in ("float16", "int8"):
+            paths[f"mmap-{dtype}"] = os.path.join(directory, dtype)
+            start = time.perf_counter()
+            export_index(vectordb, paths[f"mmap-{dtype}"], dtype=dtype)
+            print(f"export {dtype}: {time.perf_counter() - start:.2f}s")
+        del vectordb
+
+        print(f"{len(ids)} chunks of dimension {args.dim}, {args.workers} workers, {len(queries)} queries each,"
+              f" k={args.k}")
+        print(f"{'backend':<14}{'RSS MiB':>9}{'PSS MiB':>9}{'private':>9}{'p50 ms':>9}{'p95 ms':>9}{'agree':>7}")
+        reference = None
+        for backend, path in paths.items():
+            memory, latencies, top_ids = measure("chroma" if backend == "chroma" else "mmap", path, queries, args)
+            reference = reference or top_ids
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            print(f"{backend:<14}{memory['rss']:>9.1f}{memory['pss']:>9.1f}{memory['private']:>9.1f}"
+                  f"{p50:>9.2f}{p95:>9.2f}{agreement(top_ids, reference):>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Messages per second of the webhook serving mode as the number of worker processes grows.
+
+A local generator plays Telegram: sender processes POST synthetic text-message
+updates (with the secret token, over keep-alive connections) to the real
+WebhookReceiver, which shards them on the user id to the worker processes of
+a WorkerPool. Workers run a fake dispatcher that spends --cpu-ms of CPU per
+update (update parsing, routing, prompt assembly: the work one event loop
+cannot spread over cores) and then --io-ms waiting, like a reply to Telegram,
+with each user's updates handled one at a time. The time runs from the first
+POST until every worker has drained its queue; the report also checks that no
+user saw its messages out of order.
+
+Usage: python benchmarks/bench_webhook.py [--workers 1,2,4] [--users 200] [--messages 10] [--senders 4]
+       [--cpu-ms 2] [--io-ms 20]
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import threading
+import time
+
+import fakes  # noqa: F401  (aggiunge la radice del repository a sys.path)
+from aida_webhook import SECRET_HEADER, WEBHOOK_PATH, WebhookReceiver, WorkerPool
+
+
+SECRET = "bench-secret"
+
+
+####### Dispatcher finto: CPU e attesa per update, un update alla volta per utente
+
+class FakeDispatcher:
+    def __init__(self, index, workers, results, cpu_seconds, io_seconds):
+        self.index = index
+        self.results = results
+        self.cpu_seconds = cpu_seconds
+        self.io_seconds = io_seconds
+        self.handled = 0
+        self.out_of_order = 0
+        self._last_seen = {}
+        self._locks = {}
+        self._tasks = set()
+
+    async def start(self):
+        pass
+
+    async def put(self, update):
+        # Come concurrent_updates di PTB: ogni update in un task, l'ordine per utente lo garantisce il lock
+        task = asyncio.create_task(self._handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, update):
+        message = update["message"]
+        user_id = message["from"]["id"]
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            if message["message_id"] < self._last_seen.get(user_id, -1):
+                self.out_of_order += 1
+            self._last_seen[user_id] = message["message_id"]
+            deadline = time.process_time() + self.cpu_seconds
+            while time.process_time() < deadline:
+                pass
+            await asyncio.sleep(self.io_seconds)
+            self.handled += 1
+
+    async def stop(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+        self.results.put((self.index, self.handled, self.out_of_order, len(self._last_seen)))
+
+
+class FakeDispatcherFactory:
+    def __init__(self, results, cpu_seconds, io_seconds):
+        self.results = results
+        self.cpu_seconds = cpu_seconds
+        self.io_seconds = io_seconds
+
+    def __call__(self, index, workers):
+        return FakeDispatcher(index, workers, self.results, self.cpu_seconds, self.io_seconds)
+
+
+####### Generatore di update
+
+def fake_update(update_id, user_id, message_id):
+    return {"update_id": update_id, "message": {
+        "message_id": message_id, "date": int(time.time()), "text": f"messaggio {message_id}",
+        "from": {"id": user_id, "is_bot": False, "first_name": f"Utente {user_id}"},
+        "chat": {"id": user_id, "type": "private"},
+    }}
+
+
+def sender(port, users, messages, start_event):
+    """POST the messages of ``users`` in order, on one keep-alive connection."""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json", SECRET_HEADER: SECRET}
+    start_event.wait()
+    for message_id in range(messages):
+        for user_id in users:
+            body = json.dumps(fake_update(user_id * messages + message_id, user_id, message_id))
+            connection.request("POST", WEBHOOK_PATH, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"webhook answered {response.status}")
+    connection.close()
+
+
+def measure(workers, args):
+    results = multiprocessing.Queue()
+    pool = WorkerPool(workers, dispatcher_factory=FakeDispatcherFactory(results, args.cpu_ms / 1000, args.io_ms / 1000))
+    pool.start()
+    receiver = WebhookReceiver(pool.queues, secret=SECRET, port=0)
+    server = threading.Thread(target=receiver.serve_forever, daemon=True)
+    server.start()
+
+    start_event = multiprocessing.Event()
+    # Ogni utente appartiene a un solo sender, così i suoi messaggi partono in ordine
+    senders = [multiprocessing.Process(target=sender, args=(receiver.address[1], range(i, args.users, args.senders),
+                                                            args.messages, start_event))
+               for i in range(args.senders)]
+    for process in senders:
+        process.start()
+    start = time.perf_counter()
+    start_event.set()
+    for process in senders:
+        process.join()
+    receiver.shutdown()
+    pool.stop()
+    elapsed = time.perf_counter() - start
+
+    reports = [results.get() for _ in range(workers)]
+    handled = sum(report[1] for report in reports)
+    out_of_order = sum(report[2] for report in reports)
+    users_per_worker = sorted(report[3] for report in reports)
+    return handled, elapsed, out_of_order, users_per_worker, receiver.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=lambda value: [int(count) for count in value.split(",")],
+                        default=[1, 2, 4], help="comma-separated worker counts")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=10, help="messages per user")
+    parser.add_argument("--senders", type=int, default=4, help="generator processes")
+    parser.add_argument("--cpu-ms", type=float, default=2.0, help="CPU time per update in the worker")
+    parser.add_argument("--io-ms", type=float, default=20.0, help="waiting time per update in the worker")
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        handled, elapsed, out_of_order, users_per_worker, counts = measure(workers, args)
+        rate = handled / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>2} workers: {handled} messages in {elapsed:6.2f}s = {rate:7.1f} messages/s "
+              f"(x{rate / baseline:.2f})  out of order: {out_of_order}  users per worker: {users_per_worker}"
+              f"  receiver: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Local stand-ins used by the benchmarks: no OpenAI, Chroma or Telegram access.
+"""
+
+import asyncio
+import copy
+import hashlib
+import math
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chat_models.base import SimpleChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.schema import BaseRetriever, Document
+
+
+BENCH_TEMPLATE = """Sei AIDA, l'assistente per l'orientamento dell'Università di Milano-Bicocca.
+Usa i seguenti documenti per rispondere alla domanda.
+{context}"""
+
+BENCH_AGENT_TEMPLATE = """Assistant is AIDA.
+
+TOOLS:
+------
+{tools}
+
+To use a tool, please use the following format:
+
+```
+Thought: Do I need to use a tool? Yes
+Action: the action to take, should be one of [{tool_names}]
+Action Input: the input to the action
+Observation: the result of the action
+```
+
+When you have a response to say to the Human, or if you do not need to use a tool, you MUST use the format:
+
+```
+Thought: Do I need to use a tool? No
+AI: [your response here]
+```
+
+Begin!
+
+Previous conversation history:
+{chat_history}
+
+New input: {input}
+{agent_scratchpad}"""
+
+BENCH_DOCUMENTS = [
+    Document(page_content="Corso di laurea in Informatica (L-31): machine learning, basi di dati, algoritmi.",
+             metadata={"university": "Università degli Studi di MILANO-BICOCCA"}),
+    Document(page_content="Corso di laurea magistrale in Data Science (LM-91): statistica, deep learning.",
+             metadata={"university": "Università degli Studi di MILANO-BICOCCA"}),
+    Document(page_content="Corso di laurea in Economia e Commercio (L-33): finanza, management, marketing.",
+             metadata={"university": "Università degli Studi di MILANO-BICOCCA"}),
+    Document(page_content="Corso di laurea in Psicologia (L-24): neuroscienze, statistica, psicometria.",
+             metadata={"university": "Università degli Studi di MILANO-BICOCCA"}),
+]
+
+
+class FakeRetriever(BaseRetriever):
+    """Retriever that always returns the same few documents."""
+
+    documents: list = BENCH_DOCUMENTS
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return list(self.documents)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        return list(self.documents)
+
+
+def chat_model(responses=None):
+    """Return a ChatOpenAI client with a dummy key, or a fake chat model if openai is missing.
+
+    The client is only constructed, never called, unless ``responses`` is given,
+    in which case a FakeListChatModel replaying them is returned.
+    """
+    from langchain.chat_models.fake import FakeListChatModel
+
+    if responses is not None:
+        return FakeListChatModel(responses=responses)
+    try:
+        from langchain.chat_models import ChatOpenAI
+        return ChatOpenAI(temperature=0, model_name="gpt-3.5-turbo", openai_api_key="sk-bench")
+    except ImportError:
+        return FakeListChatModel(responses=["ok"])
+
+
+class SlowChatModel(SimpleChatModel):
+    """Chat model that blocks for ``latency`` seconds, like a network call, then answers with ``reply``."""
+
+    latency: float = 0.0
+    reply: Optional[Callable] = None
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "slow-fake"
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.reply(messages) if self.reply is not None else "ok"
+
+
+def agent_reply(messages):
+    """ReAct agent stand-in: call the QA tool once, then answer with its observation."""
+    text = messages[-1].content
+    if "Observation:" in text:
+        observation = text.rsplit("Observation:", 1)[1].strip().splitlines()[0]
+        return "Thought: Do I need to use a tool? No\nAI: " + observation
+    question = text.rsplit("New input:", 1)[-1].strip().splitlines()[0]
+    if len(question.split()) < 4:
+        # Saluti e messaggi brevi: l'agente risponde senza usare tool
+        return "Thought: Do I need to use a tool? No\nAI: Ciao! Come posso aiutarti?"
+    return "Thought: Do I need to use a tool? Yes\nAction: Bicocca QA System\nAction Input: " + question
+
+
+def condense_reply(messages):
+    """Condense-question stand-in: the standalone question is the last follow-up input."""
+    text = messages[-1].content
+    return text.rsplit("Follow Up Input:", 1)[-1].split("Standalone question:", 1)[0].strip()
+
+
+def answer_reply(messages):
+    return "Informatica (L-31) e Data Science (LM-91) trattano machine learning."
+
+
+def fake_models(latency=0.0):
+    """Return (agent, qa, condense) chat models with the given per-call latency."""
+    return (SlowChatModel(latency=latency, reply=agent_reply),
+            SlowChatModel(latency=latency, reply=answer_reply),
+            SlowChatModel(latency=latency, reply=condense_reply))
+
+
+def fake_pipeline(latency=0.0, retriever=None, models=None):
+    """Build an AidaPipeline over fake chat models (fake_models() by default) and a fake retriever."""
+    from aida_pipeline import AidaPipeline, build_prompt
+
+    llm, qa_llm, condense_llm = models or fake_models(latency)
+    return AidaPipeline(llm=llm, qa_llm=qa_llm, condense_llm=condense_llm,
+                        retriever=retriever or FakeRetriever(), prompt=build_prompt(BENCH_TEMPLATE),
+                        agent_template=BENCH_AGENT_TEMPLATE, verbose=False)
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings (feature hashing): similar texts get similar vectors."""
+
+    def __init__(self, size=256, latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.calls = 0
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.size] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeVectorStore:
+    """Chroma stand-in: embeds the query, waits ``latency`` seconds and returns the benchmark documents."""
+
+    class _Collection:
+        name = "bench"
+        metadata = {"version": "1"}
+
+        def get(self, include=None, **kwargs):
+            return {"ids": [], "metadatas": [document.metadata for document in BENCH_DOCUMENTS]}
+
+        def count(self):
+            return len(BENCH_DOCUMENTS)
+
+    def __init__(self, persist_directory=None, embedding_function=None, latency=0.0):
+        self.embedding_function = embedding_function
+        self.latency = latency
+        self.timings = []
+        self._collection = self._Collection()
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        start = time.perf_counter()
+        if self.embedding_function is not None:
+            self.embedding_function.embed_query(query)
+        time.sleep(self.latency)
+        self.timings.append(time.perf_counter() - start)
+        return list(BENCH_DOCUMENTS[:k])
+
+
+####### Firebase Realtime Database e Telegram finti, con latenze iniettate
+
+class FakeFirebase:
+    """In-memory stand-in for firebase_admin.db: ``reference(path)`` with get/set/update and a per-call latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}
+        self.timings = defaultdict(list)
+
+    def reference(self, path="/"):
+        return FakeReference(self, [part for part in path.split("/") if part])
+
+    def _call(self, kind, func):
+        start = time.perf_counter()
+        time.sleep(self.latency)
+        try:
+            return func()
+        finally:
+            self.timings[kind].append(time.perf_counter() - start)
+
+
+class FakeReference:
+    def __init__(self, firebase, parts):
+        self.firebase = firebase
+        self.parts = parts
+
+    def _node(self):
+        node = self.firebase.data
+        for part in self.parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def get(self, shallow=False):
+        def read():
+            node = self._node()
+            if shallow and isinstance(node, dict):
+                return {key: True for key in node}
+            return copy.deepcopy(node)
+        return self.firebase._call("get", read)
+
+    def _set(self, parts, value):
+        node = self.firebase.data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = copy.deepcopy(value)
+
+    def set(self, value):
+        return self.firebase._call("set", lambda: self._set(self.parts, value))
+
+    def update(self, payload):
+        def write():
+            for key, value in payload.items():
+                self._set(self.parts + [part for part in key.split("/") if part], value)
+        return self.firebase._call("update", write)
+
+
+class FakeBot:
+    """Telegram Bot API stand-in: every call waits ``latency`` seconds on the event loop."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.timings = defaultdict(list)
+
+    async def call(self, kind):
+        start = time.perf_counter()
+        await asyncio.sleep(self.latency)
+        self.timings[kind].append(time.perf_counter() - start)
+
+
+class FakeMessage:
+    def __init__(self, bot, text=None):
+        self.bot = bot
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        await self.bot.call("send")
+        return FakeMessage(self.bot, text)
+
+    async def reply_html(self, text, **kwargs):
+        return await self.reply_text(text, **kwargs)
+
+    async def edit_text(self, text, **kwargs):
+        await self.bot.call("edit")
+        self.text = text
+        return self
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"Utente{user_id}"
+
+    def mention_html(self):
+        return f'<a href="tg://user?id={self.id}">{self.first_name}</a>'
+
+
+class FakeUpdate:
+    """The parts of telegram.Update used by the handlers: effective_user and message."""
+
+    def __init__(self, bot, user_id, text):
+        self.effective_user = FakeUser(user_id)
+        self.message = FakeMessage(bot, text)
+
+
+class FakeContext:
+    def __init__(self, bot_data):
+        self.bot_data = bot_data
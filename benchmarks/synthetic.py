@@ -0,0 +1,64 @@
+"""
+Synthetic course corpus shared by the retrieval benchmarks.
+
+Every course has a topic (which appears in its text) and random structured
+attributes, like the metadata.txt records written by universitaly_bot.
+"""
+
+import random
+
+import fakes  # noqa: F401  (aggiunge la radice del repository a sys.path)
+from aida_ingest import chunk_id, course_metadata
+
+
+TOPICS = {
+    "machine learning": "machine learning reti neurali apprendimento automatico modelli predittivi",
+    "finanza": "finanza mercati finanziari banche investimenti risk management",
+    "psicologia": "psicologia cognitiva neuroscienze comportamento psicometria",
+    "biotecnologie": "biotecnologie genetica biologia molecolare laboratorio",
+    "giurisprudenza": "diritto privato diritto pubblico codice civile tribunale",
+    "turismo": "turismo ospitalità territorio beni culturali eventi",
+}
+LEVELS = [("3 anni", "L-{}"), ("2 anni", "LM-{}"), ("5 anni", "LMG/0{}")]
+LANGUAGES = ["Corso in lingua italiana", "Corso in lingua inglese"]
+ACCESS = ["Accesso libero con prova di verifica", "Accesso programmato a livello locale"]
+CITIES = ["Milano", "Monza", "Bergamo", "Pavia"]
+
+
+def synthetic_courses(count, seed=7):
+    """Return (course_dict, topic) pairs."""
+    rng = random.Random(seed)
+    courses = []
+    for i in range(count):
+        topic = rng.choice(list(TOPICS))
+        duration, code = rng.choice(LEVELS)
+        course = {
+            "name": f"{topic.title()} {i}",
+            "cds_codes": [code.format(rng.randint(1, 9) if "LMG" in code else rng.randint(10, 99))],
+            "cities": [rng.choice(CITIES)],
+            "language": rng.choice(LANGUAGES),
+            "type_of_access": rng.choice(ACCESS),
+            "test_access": "",
+            "mod": "Convenzionale",
+            "duration": duration,
+            "degree_type": "Corso a rilascio titolo singolo",
+            "sua_code": str(1500000 + i),
+        }
+        courses.append((course, topic))
+    return courses
+
+
+def synthetic_chunks(courses, chunks_per_course=3, seed=11):
+    """Return (ids, texts, metadatas) for the synthetic courses."""
+    rng = random.Random(seed)
+    ids, texts, metadatas = [], [], []
+    for course, topic in courses:
+        course_key = "UNIVERSITA SINTETICA/" + course["name"] + "_" + course["sua_code"]
+        metadata = course_metadata(course, "UNIVERSITA SINTETICA", course_key)
+        words = TOPICS[topic].split()
+        for i in range(chunks_per_course):
+            body = " ".join(rng.choice(words) for _ in range(40))
+            ids.append(chunk_id(course_key, i))
+            texts.append(f"{course['name']}\nObiettivi formativi: {body}")
+            metadatas.append(dict(metadata, chunk=i))
+    return ids, texts, metadatas
@@ -0,0 +1,222 @@
+"""
+Course catalog: the metadata.txt records of the universities tree in one indexed SQLite file.
+
+Aggregate questions on the courses ("English-taught LM courses in Milan",
+"the courses of class L-31", "the cities with a course") would otherwise walk
+thousands of metadata.txt files. The catalog keeps one row per course with a
+university column and the normalized fields of aida_filters (level,
+language_code, access), plus one row per class code and per city, all indexed.
+Rebuilds are incremental: only course folders whose metadata.txt changed
+(modification time or size) are read again, removed folders are dropped.
+
+python course_catalog.py build [--root ./universities]
+python course_catalog.py query [--university ...] [--level magistrale] [--language-code en] [--city milano] ...
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from aida_filters import derive_filter_fields, normalize_class_code
+from aida_ingest import UNIVERSITIES_ROOT, iter_course_dirs
+
+
+COURSE_CATALOG_PATH = 'course_catalog.sqlite3'
+
+# Campi scalari di metadata.txt salvati come colonne
+_RECORD_FIELDS = ("name", "sua_code", "language", "type_of_access", "test_access", "mod", "duration", "degree_type",
+                  "url_pdf")
+# Filtri di query(): colonna della tabella courses oppure tabella dei valori multipli
+_COLUMN_FILTERS = ("university", "course_key", "sua_code", "level", "language_code", "access")
+_MULTI_FILTERS = {"cds_code": ("course_codes", "cds_code"), "city": ("course_cities", "city")}
+
+
+####### Catalogo su SQLite
+#
+# * courses: una riga per corso (chiave "<università>/<corso>_<sua_code>", la stessa di aida_ingest), con i campi
+#   di metadata.txt, i campi normalizzati usati dai filtri e mtime/dimensione del file letto.
+# * course_codes e course_cities: classi di laurea (normalizzate) e città (minuscole) di ogni corso.
+# Tutti i campi filtrabili sono indicizzati; ogni thread usa una propria connessione (il bot interroga il
+# catalogo dai thread dell'AgentRunner).
+
+class CourseCatalog:
+    """Indexed SQLite catalog of the scraped course metadata."""
+
+    def __init__(self, path=COURSE_CATALOG_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS courses (
+                    course_key TEXT PRIMARY KEY, university TEXT NOT NULL, name TEXT, sua_code TEXT,
+                    level TEXT, language_code TEXT, access TEXT,
+                    language TEXT, type_of_access TEXT, test_access TEXT, mod TEXT, duration TEXT, degree_type TEXT,
+                    url_pdf TEXT, record TEXT NOT NULL, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS courses_university ON courses(university);
+                CREATE INDEX IF NOT EXISTS courses_sua_code ON courses(sua_code);
+                CREATE INDEX IF NOT EXISTS courses_filters ON courses(level, language_code, access);
+                CREATE INDEX IF NOT EXISTS courses_language_code ON courses(language_code);
+                CREATE INDEX IF NOT EXISTS courses_access ON courses(access);
+                CREATE TABLE IF NOT EXISTS course_codes (course_key TEXT NOT NULL, cds_code TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS course_codes_code ON course_codes(cds_code, course_key);
+                CREATE INDEX IF NOT EXISTS course_codes_course ON course_codes(course_key);
+                CREATE TABLE IF NOT EXISTS course_cities (course_key TEXT NOT NULL, city TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS course_cities_city ON course_cities(city, course_key);
+                CREATE INDEX IF NOT EXISTS course_cities_course ON course_cities(course_key);
+            """)
+            self._local.connection = connection
+        return connection
+
+    # Costruzione incrementale
+
+    def build(self, root=UNIVERSITIES_ROOT):
+        """Bring the catalog in line with the tree; return {"courses", "updated", "removed", "seconds"}."""
+        start = time.perf_counter()
+        connection = self._connection()
+        known = {row["course_key"]: (row["mtime_ns"], row["size"])
+                 for row in connection.execute("SELECT course_key, mtime_ns, size FROM courses")}
+        seen = set()
+        updated = 0
+        connection.execute("BEGIN")
+        try:
+            for course_key, university, _, _, metadata_path in iter_course_dirs(root):
+                seen.add(course_key)
+                stat = os.stat(metadata_path)
+                if known.get(course_key) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                with open(metadata_path, encoding="utf-8") as file:
+                    course_dict = json.load(file)
+                self._replace(connection, course_key, university, course_dict, stat)
+                updated += 1
+            removed = [course_key for course_key in known if course_key not in seen]
+            for course_key in removed:
+                self._delete(connection, course_key)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return {"courses": len(seen), "updated": updated, "removed": len(removed),
+                "seconds": round(time.perf_counter() - start, 3)}
+
+    def _replace(self, connection, course_key, university, course_dict, stat):
+        self._delete(connection, course_key)
+        fields = derive_filter_fields(course_dict)
+        values = {field: course_dict.get(field) for field in _RECORD_FIELDS}
+        connection.execute(
+            "INSERT INTO courses (course_key, university, level, language_code, access, record, mtime_ns, size, "
+            + ", ".join(_RECORD_FIELDS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, " + ", ".join("?" * len(_RECORD_FIELDS)) + ")",
+            (course_key, university, fields["level"], fields["language_code"], fields["access"],
+             json.dumps(course_dict, ensure_ascii=False), stat.st_mtime_ns, stat.st_size,
+             *[values[field] for field in _RECORD_FIELDS]),
+        )
+        codes = {normalize_class_code(code) for code in course_dict.get("cds_codes") or []}
+        cities = {city.strip().lower() for city in course_dict.get("cities") or [] if city.strip()}
+        connection.executemany("INSERT INTO course_codes (course_key, cds_code) VALUES (?, ?)",
+                               [(course_key, code) for code in sorted(codes)])
+        connection.executemany("INSERT INTO course_cities (course_key, city) VALUES (?, ?)",
+                               [(course_key, city) for city in sorted(cities)])
+
+    def _delete(self, connection, course_key):
+        for table in ("courses", "course_codes", "course_cities"):
+            connection.execute(f"DELETE FROM {table} WHERE course_key = ?", (course_key,))
+
+    # Interrogazioni
+
+    def query(self, limit=None, **filters):
+        """Return the courses matching every filter (a value or a list of accepted values).
+
+        Filters: university, course_key, sua_code, level, language_code, access,
+        cds_code, city; the constraints of aida_filters.analyze_query can be
+        passed as they are. Each course is its metadata.txt record plus
+        course_key, university and the normalized fields.
+        """
+        sql, params = self._where(filters)
+        sql = "SELECT * FROM courses" + sql + " ORDER BY university, name"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [self._course(row) for row in self._connection().execute(sql, params)]
+
+    def count(self, **filters):
+        sql, params = self._where(filters)
+        return self._connection().execute("SELECT COUNT(*) FROM courses" + sql, params).fetchone()[0]
+
+    def get(self, course_key):
+        row = self._connection().execute("SELECT * FROM courses WHERE course_key = ?", (course_key,)).fetchone()
+        return self._course(row) if row is not None else None
+
+    def universities(self):
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT university FROM courses ORDER BY 1")]
+
+    def cities(self):
+        """Return the distinct (lowercase) course cities, as aida_filters.known_cities."""
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT city FROM course_cities ORDER BY 1")]
+
+    def _where(self, filters):
+        clauses, params = [], []
+        for field, values in filters.items():
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else list(values)
+            if field == "cds_code":
+                values = [normalize_class_code(value) for value in values]
+            elif field == "city":
+                values = [value.lower() for value in values]
+            marks = ", ".join("?" * len(values))
+            if field in _MULTI_FILTERS:
+                table, column = _MULTI_FILTERS[field]
+                clauses.append(f"course_key IN (SELECT course_key FROM {table} WHERE {column} IN ({marks}))")
+            elif field in _COLUMN_FILTERS:
+                clauses.append(f"{field} IN ({marks})")
+            else:
+                raise ValueError(f"Unknown catalog filter: {field}")
+            params.extend(values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    @staticmethod
+    def _course(row):
+        course = json.loads(row["record"])
+        course.update(course_key=row["course_key"], university=row["university"], level=row["level"],
+                      language_code=row["language_code"], access=row["access"])
+        return course
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Course catalog of the scraped universities tree")
+    parser.add_argument("--path", default=COURSE_CATALOG_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="update the catalog from the universities tree")
+    build_parser.add_argument("--root", default=UNIVERSITIES_ROOT)
+    query_parser = subparsers.add_parser("query", help="print the courses matching the filters")
+    for option in ("university", "sua-code", "level", "language-code", "access", "cds-code", "city"):
+        query_parser.add_argument("--" + option, action="append", default=None)
+    query_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = CourseCatalog(args.path)
+    if args.command == "build":
+        print(json.dumps(catalog.build(args.root), indent=1))
+    else:
+        filters = {field: getattr(args, field) for field in
+                   ("university", "sua_code", "level", "language_code", "access", "cds_code", "city")}
+        start = time.perf_counter()
+        total = catalog.count(**filters)
+        courses = catalog.query(limit=args.limit, **filters)
+        elapsed = time.perf_counter() - start
+        for course in courses:
+            print(f"{course['university']} | {course['name']} ({', '.join(course.get('cds_codes') or [])})"
+                  f" | {', '.join(course.get('cities') or [])}")
+        print(f"{total} corsi ({elapsed * 1000:.2f} ms)")
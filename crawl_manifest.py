@@ -0,0 +1,328 @@
+"""
+Crawl state of the Universitaly scraper.
+
+Every university and every course visited by universitaly_bot is recorded in
+a local SQLite file: status, SUA code, PDF URL and hash, timestamps and, per
+university, the number of courses announced by the site against the number
+found. Resuming a crawl only needs a lookup here (no filesystem probing), the
+found/expected mismatches become a report instead of an interactive pause,
+and a re-crawl can revisit only the failed or stale entries.
+
+The HTTP validators (ETag, Last-Modified) of every PDF are stored too, so a
+refresh pass can send conditional requests, and every PDF or metadata.txt
+written is logged as a change that downstream indexing can consume.
+
+python crawl_manifest.py report
+python crawl_manifest.py import [--root ./universities]
+python crawl_manifest.py changes [--since 2024-01-31] [--output crawl_changes.json]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+CRAWL_MANIFEST_PATH = 'crawl_manifest.sqlite3'
+STALE_AFTER_DAYS = 30     # università da rivisitare dopo questo numero di giorni
+
+# Stati delle università
+RUNNING = "running"
+DONE = "done"
+MISMATCH = "mismatch"
+FAILED = "failed"
+# Stato dei corsi (oltre a DONE e FAILED): visitato, PDF in download
+PENDING = "pending"
+# Tipi di modifica registrati per l'indicizzazione
+PDF_CHANGED = "pdf"
+METADATA_CHANGED = "metadata"
+
+# Colonne aggiunte dopo la prima versione del manifest: aggiunte ai file esistenti all'apertura
+_COURSE_COLUMNS = {"etag": "TEXT", "last_modified": "TEXT", "checked_at": "REAL", "seen_at": "REAL"}
+
+
+def file_hash(path):
+    """Return the sha256 hex digest and the size of a file."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def sanitize_directory_name(name):
+    """Return ``name`` without the characters not allowed in a directory name (as in the universities tree)."""
+    return re.sub(r'[<>:"/\\|?*]', '', name)
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else "-"
+
+
+####### Manifest su SQLite
+#
+# * universities: stato dell'ultima visita, corsi attesi (dal sito) e trovati (corsi visti in quella visita),
+#   inizio e fine.
+# * courses: un record per cartella di corso (chiave "<università>/<corso>_<sua_code>", la stessa di aida_ingest),
+#   con stato, URL e percorso del PDF, sha256 e dimensione del PDF scaricato, ETag e Last-Modified, tentativi ed errore,
+#   più l'ultima volta in cui il corso è comparso nella tabella dei risultati (seen_at).
+# * changes: ogni PDF scaricato o metadata.txt riscritto, con l'istante in cui la modifica è stata rilevata.
+# Il file è in modalità WAL e ogni thread usa una propria connessione: lo scrivono insieme i processi del pool
+# di browser e i thread del downloader.
+
+class CrawlManifest:
+    """SQLite record of the crawl progress, per university and per course."""
+
+    def __init__(self, path=CRAWL_MANIFEST_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connection()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS universities (
+                    name TEXT PRIMARY KEY, status TEXT NOT NULL, expected INTEGER, found INTEGER,
+                    error TEXT, started_at REAL, finished_at REAL);
+                CREATE TABLE IF NOT EXISTS courses (
+                    course_key TEXT PRIMARY KEY, university TEXT NOT NULL, name TEXT, sua_code TEXT,
+                    status TEXT NOT NULL, url_pdf TEXT, pdf_path TEXT, pdf_hash TEXT, pdf_size INTEGER,
+                    attempts INTEGER NOT NULL DEFAULT 0, error TEXT,
+                    created_at REAL NOT NULL, updated_at REAL NOT NULL, downloaded_at REAL);
+                CREATE INDEX IF NOT EXISTS courses_university ON courses(university);
+                CREATE INDEX IF NOT EXISTS courses_pdf_path ON courses(pdf_path);
+                CREATE INDEX IF NOT EXISTS courses_status ON courses(status);
+                CREATE TABLE IF NOT EXISTS changes (
+                    course_key TEXT NOT NULL, change TEXT NOT NULL, detected_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS changes_detected_at ON changes(detected_at);
+            """)
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(courses)")}
+            for column, column_type in _COURSE_COLUMNS.items():
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE courses ADD COLUMN {column} {column_type}")
+            self._local.connection = connection
+        return connection
+
+    # Università
+
+    def start_university(self, name):
+        self._connection().execute(
+            "INSERT INTO universities (name, status, started_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET status = excluded.status, started_at = excluded.started_at, "
+            "error = NULL, finished_at = NULL",
+            (name, RUNNING, time.time()),
+        )
+
+    def finish_university(self, name, expected):
+        """Store the expected count and the courses seen since start_university; return (status, found)."""
+        # Solo i corsi visti in questa visita: quelli rimossi da Universitaly restano nel manifest ma non
+        # vanno contati, altrimenti un'università con corsi in meno risulterebbe comunque completa
+        row = self._connection().execute("SELECT started_at FROM universities WHERE name = ?", (name,)).fetchone()
+        found = self.count_courses(name, since=row["started_at"] if row is not None else None)
+        status = DONE if found == expected else MISMATCH
+        self._connection().execute(
+            "UPDATE universities SET status = ?, expected = ?, found = ?, finished_at = ? WHERE name = ?",
+            (status, expected, found, time.time(), name),
+        )
+        return status, found
+
+    def fail_university(self, name, error):
+        self._connection().execute(
+            "UPDATE universities SET status = ?, error = ?, finished_at = ? WHERE name = ?",
+            (FAILED, str(error)[:1000], time.time(), name),
+        )
+
+    def universities_to_crawl(self, names, stale_after_days=STALE_AFTER_DAYS):
+        """Return the names (in the given order) never crawled, not completed or crawled too long ago."""
+        limit = time.time() - stale_after_days * 86400
+        completed = {row["name"] for row in self._connection().execute(
+            "SELECT name FROM universities WHERE status = ? AND finished_at >= ?", (DONE, limit)
+        )}
+        return [name for name in names if name not in completed]
+
+    def mismatch_report(self):
+        """Return the universities whose last crawl failed or found a different number of courses."""
+        return [dict(row) for row in self._connection().execute(
+            "SELECT name, status, expected, found, error, finished_at FROM universities "
+            "WHERE status IN (?, ?, ?) ORDER BY name",
+            (MISMATCH, FAILED, RUNNING),
+        )]
+
+    # Corsi
+
+    def course(self, course_key):
+        row = self._connection().execute("SELECT * FROM courses WHERE course_key = ?", (course_key,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def count_courses(self, university, since=None):
+        """Return the courses of ``university``; only those seen at or after ``since`` (epoch seconds) if given."""
+        # Conteggio per prefisso della chiave ("<università sanificata>/..."): i corsi importati da un albero
+        # esistente hanno solo il nome della cartella, quelli del crawl il nome originale dell'università
+        prefix = sanitize_directory_name(university) + "/"
+        query = "SELECT COUNT(*) FROM courses WHERE substr(course_key, 1, ?) = ?"
+        parameters = (len(prefix), prefix)
+        if since is not None:
+            query += " AND seen_at >= ?"
+            parameters += (since,)
+        return self._connection().execute(query, parameters).fetchone()[0]
+
+    def record_course(self, course_key, university, course_dict, pdf_path, status=PENDING):
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO courses (course_key, university, name, sua_code, status, url_pdf, pdf_path, created_at, "
+            "updated_at, seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(course_key) DO UPDATE SET name = excluded.name, sua_code = excluded.sua_code, "
+            "status = excluded.status, url_pdf = COALESCE(excluded.url_pdf, courses.url_pdf), "
+            "pdf_path = excluded.pdf_path, error = NULL, updated_at = excluded.updated_at, seen_at = excluded.seen_at",
+            (course_key, university, course_dict.get("name"), course_dict.get("sua_code"), status,
+             course_dict.get("url_pdf"), pdf_path, now, now, now),
+        )
+
+    def mark_seen(self, course_key):
+        """Record that an already known course is still listed by the site."""
+        self._connection().execute("UPDATE courses SET seen_at = ? WHERE course_key = ?", (time.time(), course_key))
+
+    def mark_downloaded(self, pdf_path, pdf_hash, pdf_size, etag=None, last_modified=None):
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "UPDATE courses SET status = ?, pdf_hash = ?, pdf_size = ?, attempts = attempts + 1, error = NULL, "
+            "etag = ?, last_modified = ?, downloaded_at = ?, checked_at = ?, updated_at = ? WHERE pdf_path = ?",
+            (DONE, pdf_hash, pdf_size, etag, last_modified, now, now, now, pdf_path),
+        )
+        for row in connection.execute("SELECT course_key FROM courses WHERE pdf_path = ?", (pdf_path,)).fetchall():
+            self.record_change(row["course_key"], PDF_CHANGED)
+
+    def mark_checked(self, pdf_path, etag=None, last_modified=None):
+        """Record a refresh that found the PDF unchanged (keeping the known validators if none are given)."""
+        self._connection().execute(
+            "UPDATE courses SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), checked_at = ? "
+            "WHERE pdf_path = ?",
+            (etag, last_modified, time.time(), pdf_path),
+        )
+
+    def mark_download_failed(self, pdf_path, error):
+        self._connection().execute(
+            "UPDATE courses SET status = ?, attempts = attempts + 1, error = ?, updated_at = ? WHERE pdf_path = ?",
+            (FAILED, str(error)[:1000], time.time(), pdf_path),
+        )
+
+    def downloads_to_retry(self):
+        """Return the (url_pdf, pdf_path) of the courses whose PDF is not downloaded yet."""
+        return [(row["url_pdf"], row["pdf_path"]) for row in self._connection().execute(
+            "SELECT url_pdf, pdf_path FROM courses WHERE status IN (?, ?) AND url_pdf IS NOT NULL ORDER BY course_key",
+            (PENDING, FAILED),
+        )]
+
+    def courses_to_refresh(self):
+        """Return the downloaded courses (with URL, path, hash and HTTP validators) to check for changes."""
+        return [dict(row) for row in self._connection().execute(
+            "SELECT course_key, url_pdf, pdf_path, pdf_hash, etag, last_modified FROM courses "
+            "WHERE status = ? AND url_pdf IS NOT NULL ORDER BY course_key",
+            (DONE,),
+        )]
+
+    # Modifiche per l'indicizzazione
+
+    def record_change(self, course_key, change):
+        self._connection().execute(
+            "INSERT INTO changes (course_key, change, detected_at) VALUES (?, ?, ?)", (course_key, change, time.time())
+        )
+
+    def changes_since(self, since=0.0):
+        """Return the changed courses since ``since`` (epoch seconds): one entry per course, latest change first."""
+        changes = {}
+        for row in self._connection().execute(
+            "SELECT course_key, change, detected_at FROM changes WHERE detected_at >= ? ORDER BY detected_at",
+            (since,),
+        ):
+            entry = changes.setdefault(row["course_key"], {"course_key": row["course_key"], "changes": []})
+            if row["change"] not in entry["changes"]:
+                entry["changes"].append(row["change"])
+            entry["detected_at"] = row["detected_at"]
+        return sorted(changes.values(), key=lambda entry: entry["detected_at"], reverse=True)
+
+    def summary(self):
+        connection = self._connection()
+        return {
+            "universities": dict(connection.execute("SELECT status, COUNT(*) FROM universities GROUP BY status").fetchall()),
+            "courses": dict(connection.execute("SELECT status, COUNT(*) FROM courses GROUP BY status").fetchall()),
+        }
+
+    # Albero esistente
+
+    def import_tree(self, root='./universities'):
+        """Record as done the courses of an existing tree (PDF and metadata.txt present); return how many."""
+        imported = 0
+        for university in sorted(os.listdir(root)):
+            university_dir = os.path.join(root, university)
+            if not os.path.isdir(university_dir):
+                continue
+            for course in sorted(os.listdir(university_dir)):
+                course_dir = os.path.join(university_dir, course)
+                pdf_path = os.path.join(course_dir, course + ".pdf")
+                metadata_path = os.path.join(course_dir, "metadata.txt")
+                if not (os.path.exists(pdf_path) and os.path.exists(metadata_path)):
+                    continue
+                course_key = university + "/" + course
+                if self.course(course_key) is not None:
+                    continue
+                with open(metadata_path) as file:
+                    course_dict = json.load(file)
+                self.record_course(course_key, university, course_dict, pdf_path, status=PENDING)
+                self.mark_downloaded(pdf_path, *file_hash(pdf_path))
+                imported += 1
+        return imported
+
+
+def write_change_list(manifest, path, since=0.0):
+    """Write the changes since ``since`` as JSON ({"since", "generated_at", "changes"}); return how many."""
+    changes = manifest.changes_since(since)
+    with open(path, "w") as file:
+        json.dump({"since": since, "generated_at": time.time(), "changes": changes}, file, indent=1)
+    return len(changes)
+
+
+def print_report(manifest):
+    summary = manifest.summary()
+    print("Università:", summary["universities"])
+    print("Corsi:", summary["courses"])
+    for row in manifest.mismatch_report():
+        print(f"{row['status'].upper():<9} {row['name']}: trovati {row['found']}, attesi {row['expected']}"
+              f" ({_format_time(row['finished_at'])})" + (f" - {row['error']}" if row["error"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Universitaly crawl manifest")
+    parser.add_argument("--path", default=CRAWL_MANIFEST_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("report", help="print the crawl status and the found/expected mismatches")
+    import_parser = subparsers.add_parser("import", help="record the courses already present in the universities tree")
+    import_parser.add_argument("--root", default='./universities')
+    changes_parser = subparsers.add_parser("changes", help="write the courses changed since a date, for the indexing")
+    changes_parser.add_argument("--since", default=None, help="ISO date or datetime (default: all the changes)")
+    changes_parser.add_argument("--output", default='crawl_changes.json')
+    args = parser.parse_args()
+
+    manifest = CrawlManifest(args.path)
+    if args.command == "changes":
+        since = datetime.fromisoformat(args.since).timestamp() if args.since else 0.0
+        print(f"Corsi modificati: {write_change_list(manifest, args.output, since)} -> {args.output}")
+    else:
+        if args.command == "import":
+            print(f"Corsi importati: {manifest.import_tree(args.root)}")
+        print_report(manifest)
@@ -0,0 +1,61 @@
+"""
+Parity of the bulk and the per-field extraction of the Universitaly results table.
+
+A saved results page is opened from disk in headless Chrome, so the check
+needs no network: every row must give the same course dict on both paths,
+icons without a title included. Skipped where selenium or Chrome are missing.
+"""
+
+import os
+
+import pytest
+
+webdriver = pytest.importorskip("selenium.webdriver")
+from selenium.common.exceptions import WebDriverException
+
+from crawl_manifest import CrawlManifest
+from universitaly_bot import Browser, CourseScraper, DirectoryManager, PdfDownloader
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "universitaly_results.html")
+
+
+@pytest.fixture
+def scraper(tmp_path):
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    try:
+        driver = webdriver.Chrome(options=options)
+    except WebDriverException as e:
+        pytest.skip(f"Chrome non disponibile: {e.msg}")
+    browser = Browser("file://" + FIXTURE, driver=driver)
+    manifest = CrawlManifest(str(tmp_path / "crawl_manifest.sqlite"))
+    downloader = PdfDownloader(manifest=manifest)
+    yield CourseScraper(DirectoryManager(), browser, downloader=downloader, manifest=manifest)
+    downloader.close()
+    browser.quit()
+
+
+def test_bulk_matches_per_field(scraper):
+    table = scraper.browser.find_element("//table[@id='results']")
+    single, _, _, mismatches, fallbacks = scraper.compare_extractions(table)
+
+    assert len(single) == 5
+    assert mismatches == 0
+    assert fallbacks == 0
+
+
+def test_icons_without_title(scraper):
+    table = scraper.browser.find_element("//table[@id='results']")
+    courses = table.find_elements("xpath", "./tbody/tr")
+    bulk = scraper._extract_courses_bulk(table, courses)
+    by_name = {course["name"]: course for course in bulk[1:]}
+
+    # Icone assenti: valori predefiniti; icone presenti ma senza titolo: stringa vuota, come campo per campo
+    assert by_name["INFORMATICA"]["language"] == "Corso in lingua italiana"
+    assert by_name["INFORMATICA"]["degree_type"] == "Corso a rilascio titolo singolo"
+    assert by_name["SCIENZE DEL TURISMO E COMUNITÀ LOCALE"]["language"] == ""
+    assert by_name["SCIENZE DEL TURISMO E COMUNITÀ LOCALE"]["degree_type"] == ""
+    assert by_name["FISICA"]["type_of_access"] == ""
+    assert by_name["DATA SCIENCE"]["cds_codes"] == ["LM-91", "LM-Data"]
+    assert by_name["DATA SCIENCE"]["duration"] == "2 anni"
@@ -0,0 +1,58 @@
+"""
+Routing of skill requests when a skill-course graph is loaded.
+"""
+
+import pytest
+
+from aida_router import AGENT, COURSE, SKILL, IntentRouter
+
+
+class StubSkillGraph:
+    """Skill graph that knows every skill: answers any question it is asked."""
+
+    def __init__(self):
+        self.questions = []
+
+    def answer(self, question):
+        self.questions.append(question)
+        return "Questi sono i corsi che insegnano di più economia:"
+
+
+@pytest.fixture
+def router():
+    return IntentRouter(skill_graph=StubSkillGraph())
+
+
+@pytest.mark.parametrize("text", [
+    "Vorrei diventare financial manager",
+    "Mi piace studiare machine learning e voglio scoprire di più in questo ambito, ci sono corsi che mi consiglieresti?",
+    "Mi piacerebbe diventare un financial manager, vorrei acquisire competenze manageriali, informatiche e di "
+    "relazione con il cliente. Quale corso di laurea triennale potrei seguire?",
+])
+def test_skill_requests_are_answered_from_the_graph(router, text):
+    route = router.route(text)
+    assert route.intent == SKILL
+    assert route.answer is not None
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Mi interessa il corso di Economia e Management, quali esami ci sono al primo anno?", COURSE),
+    ("quali sono le competenze richieste per l'ammissione a informatica?", COURSE),
+    ("Voglio diventare data scientist, il corso di Data Science ha il test d'ingresso?", COURSE),
+    ("Quanti CFU ha la laurea magistrale in psicologia?", COURSE),
+    ("Mi interessa la finanza", AGENT),
+])
+def test_questions_about_a_course_or_without_a_request_skip_the_graph(router, text, intent):
+    route = router.route(text)
+    assert route.intent == intent
+    assert route.answer is None
+    assert router.skill_graph.questions == []
+
+
+def test_unknown_skills_fall_through(router):
+    router.skill_graph.answer = lambda question: None
+    assert router.route("Vorrei diventare astronauta").intent == AGENT
+
+
+def test_without_graph_skill_requests_go_to_the_agent():
+    assert IntentRouter().route("Vorrei diventare financial manager").intent == AGENT
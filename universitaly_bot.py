@@ -1,306 +1,949 @@
-import json
-import os
-import random
-import re
-import shutil
-import requests
-import time
-from pathlib import Path
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.core.utils import ChromeType
-
-class Browser:
-    def __init__(self):
-        # Configure Chrome options
-        chrome_options = Options()
-        chrome_options.add_argument("--start-maximized")
-        chrome_options.add_argument("--headless")  # Disattiva la visualizzazione GUI
-
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=chrome_options)
-        self.driver.get("https://www.universitaly.it/index.php/cercacorsi/universita")
-
-    def get_element_attribute(self, xpath, attribute):
-        return self.find_element(xpath).get_attribute(attribute)
-    
-    def close_tab(self):
-        self.driver.close()
-
-    def switch_to_new_tab(self):
-        self.driver.switch_to.window(self.driver.window_handles[-1])
-
-    def switch_to_main_tab(self):
-        self.driver.switch_to.window(self.driver.window_handles[0])
-
-    def find_elements(self, xpath):
-        return self.driver.find_elements(By.XPATH, xpath)
-
-    def find_element(self, xpath):
-        return self.driver.find_element(By.XPATH, xpath)
-
-    def sleep(self, seconds):
-        time.sleep(seconds)
-
-
-class DirectoryManager:
-        
-    def create_directory(self, path_name):
-        path = Path(path_name)
-        path.mkdir(parents=True, exist_ok=True)
-
-    @staticmethod
-    def sanitize_directory_name(name):
-        sanitized_name = re.sub(r'[<>:"/\\|?*]', '', name)
-        return sanitized_name
-    
-    def file_exists(self, file_path):
-        if os.path.exists(file_path):
-            print("ALREADY DONE")
-            return True
-        else:
-            return False
-    
-    def write_to_file(self, path, data):
-        if os.path.exists(path):
-            print("ALREADY DONE")
-            return
-
-        with open(path, "w") as file:
-            file.write(data)
-    
-    def delete_folder_content(self, folder_path):
-        try:
-            # Check if the folder exists
-            if os.path.exists(folder_path):
-                # Delete all contents of the folder
-                shutil.rmtree(folder_path)
-                # Recreate an empty folder
-                os.makedirs(folder_path)
-                print(f"Successfully deleted the contents of {folder_path}.")
-            else:
-                print(f"The folder {folder_path} does not exist.")
-        except Exception as e:
-            print(f"An error occurred while deleting the contents of {folder_path}: {str(e)}")
-
-
-
-class CourseInfoExtractor:
-    def __init__(self, directory_manager, browser):
-        self.directory_manager = directory_manager
-        self.browser = browser
-
-    def create_university_tree(self):
-        self.directory_manager.create_directory("/universities")
-
-        print("****Start Uni Dir Creation****")
-
-        select_element = self.browser.find_element("/html/body/div[4]/div/div[2]/div[1]/form/div[2]/div[2]/fieldset/select[4]")
-        options = select_element.find_elements(By.XPATH, "./option")
-        for i in range(1, len(options)):
-            option = options[i]
-            university_name = option.text
-            print(university_name)
-            self.directory_manager.create_directory("./universities/"+self.directory_manager.sanitize_directory_name(university_name))
-
-class CourseScraper:
-    def __init__(self, directory_manager, browser):
-        self.directory_manager = directory_manager
-        self.browser = browser
-
-    def scrape(self):
-        print("****Start Uni Scraping****")
-
-        main_path = self._get_main_path()
-
-        select_element = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/div[2]/div[2]/fieldset/select[4]")
-        search = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/p/input[1]")
-        options = select_element.find_elements(By.XPATH, "./option")
-
-        for i in range(1, len(options)):
-            self._scrape_option(main_path, options[i], search)
-            self._check_scraped_courses(main_path, options[i].text)
-
-    def _get_main_path(self):
-        self.browser.sleep(0.5)
-        try:
-            banner_button = self.browser.find_element("/html/body/div[1]/div/a[1]")
-            banner_button.click()
-            
-            return "/html/body/div[3]"
-        except:
-            return "/html/body/div[4]"
-
-    def _scrape_option(self, main_path, option, search):
-        university_name = option.text
-        print(university_name)
-
-        option.click()
-        search.click()
-
-        self.browser.sleep(2)
-        random_wait_time = random.uniform(2, 3)
-        self.browser.sleep(random_wait_time)
-
-        self._scrape_courses(main_path, university_name)
-
-    def _scrape_courses(self, main_path, university_name):
-        table_element = self.browser.find_element(main_path+"/div/div[2]/div[2]/div[2]/div/table")
-        courses = table_element.find_elements(By.XPATH, "./tbody/tr")
-        resume = self.browser.find_element(main_path+"/div/div[2]/div[2]/div[1]/div[1]/h3")
-        resume.click()
-
-        for i in range(1, len(courses)):
-            self._scrape_course(main_path, courses[i], university_name)
-
-    def _scrape_course(self, main_path, course, university_name):
-
-        
-
-
-        course_dict = self._extract_course_info(course)
-        course_name = course_dict['name']
-        sua_code = course_dict['sua_code']
-        path = "./universities/"+self.directory_manager.sanitize_directory_name(university_name)+"/"+self.directory_manager.sanitize_directory_name(course_name)+"_"+sua_code
-
-
-        print("-----"+course_name)
-
-        if(self.directory_manager.file_exists(path+"/"+self.directory_manager.sanitize_directory_name(course_name)+"_"+sua_code+".pdf") and self.directory_manager.file_exists(path+"/metadata.txt")):
-            return
-        else:
-            self.directory_manager.delete_folder_content(path)
-
-        
-        self.directory_manager.create_directory(path)
-
-        course.find_element(By.XPATH, "./td[2]/a[1]").click()
-        self.browser.switch_to_new_tab()
-
-        self.browser.sleep(2)
-        random_wait_time = random.uniform(3, 4)
-        self.browser.sleep(random_wait_time)
-
-        url_pdf = self.browser.get_element_attribute(main_path+"/div/div[2]/div[1]/div[4]/a", "href")
-        print(url_pdf)
-        self._download_pdf(url_pdf, path+"/"+self.directory_manager.sanitize_directory_name(course_name)+"_"+sua_code+".pdf")
-        self.browser.sleep(1)
-        print("------PDF OK")
-
-        self.browser.close_tab()
-        self.browser.switch_to_main_tab()
-
-        self.directory_manager.write_to_file(path+"/metadata.txt", json.dumps(course_dict))
-
-        self.browser.sleep(1)
-
-    
-
-    
-    def _download_pdf(self, url, file_path):
-        
-        print("Download PDF")
-        response = requests.get(url, stream=True)
-        print("Download PDF done")
-
-        try:
-            with open(file_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        file.write(chunk)
-        except Exception as e:
-            print("Errore durante il salvataggio del file:", str(e))
-        
-        response.close()
-
-        del response
-        print("connessione chiusa")
-
-
-    def _extract_course_info(self, course):
-        course_dict = {}
-
-        title = course.find_element(By.XPATH, "./td[2]/strong")
-        levels = course.find_element(By.XPATH, "./td[3]").find_elements(By.XPATH, "./span")
-        cities = course.find_element(By.XPATH, "./td[2]")
-
-        language_text = self._extract_language_text(course)
-        access_text = self._extract_attribute_text(course, "./td[4]/img")
-        test_access_text = self._extract_attribute_text(course, "./td[6]/img")
-        mod_text = self._extract_attribute_text(course, "./td[7]/img")
-        duration_text = self._extract_duration_text(course)
-        degree_text = self._extract_degree_text(course)
-
-        sua_window = course.find_element(By.XPATH, "./td[2]/a[1]")
-        sua_href = sua_window.get_attribute("href")
-        sua_code = re.sub(r".*/(\d+)$", r"\1", sua_href)
-
-        course_dict["name"] = title.text
-        course_dict["cds_codes"] = [level.text for level in levels]
-        course_dict["cities"] = self._extract_cities_text(cities.text)
-        course_dict["language"] = language_text
-        course_dict["type_of_access"] = access_text
-        course_dict["test_access"] = test_access_text
-        course_dict["mod"] = mod_text
-        course_dict["duration"] = duration_text
-        course_dict["degree_type"] = degree_text
-        course_dict["sua_code"] = sua_code
-
-        return course_dict
-
-    def _extract_language_text(self, course):
-        try:
-            language = course.find_element(By.XPATH, "./td[10]/img")
-            return language.get_attribute("title")
-        except:
-            return "Corso in lingua italiana"
-
-    def _extract_degree_text(self, course):
-        try:
-            degree = course.find_element(By.XPATH, "./td[9]/img")
-            return degree.get_attribute("title")
-        except:
-            return "Corso a rilascio titolo singolo"
-
-    def _extract_attribute_text(self, course, xpath):
-        element = course.find_element(By.XPATH, xpath)
-        return element.get_attribute("title")
-
-    def _extract_duration_text(self, course):
-        duration = course.find_element(By.XPATH, "./td[8]/img")
-        duration_text = duration.get_attribute("src")
-        match = re.search(r'anni(\d+).png', duration_text)
-        if match:
-            return match.group(1) + " anni"
-        return ""
-
-    def _extract_cities_text(self, cities_text):
-        match = re.findall(r"(, ([^,\n\[\]]+))(?!\[)(?!.*\bInterateneo\b)", cities_text)
-        citta = [m[1].strip() for m in match]
-        return citta
-    
-    def _check_scraped_courses(self, main_path, university_name):
-        resume_text = self.browser.find_element(main_path + "/div/div[2]/div[2]/div[1]/div[1]/div/p[1]").text
-        match = re.search(r"Trovati (\d+) corsi", resume_text)
-        expected = int(match.group(1)) if match else 0
-        dire = f"./universities/{self.directory_manager.sanitize_directory_name(university_name)}"
-        found = len([name for name in os.listdir(dire) if os.path.isdir(os.path.join(dire, name))])
-        if found != expected:
-            print(f"ERROR IN {university_name}")
-            print(f"FOUND: {found}")
-            print(f"EXPECTED: {expected}")
-            input("Press Enter to continue...")
-
-
-# Usage
-directory_manager = DirectoryManager()
-browser = Browser()
-time.sleep(2)
-course_info_extractor = CourseInfoExtractor(directory_manager, browser)
-course_info_extractor.create_university_tree()
-time.sleep(2)
-course_extractor = CourseScraper(directory_manager, browser)
-course_extractor.scrape()
\ No newline at end of file
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from webdriver_manager.chrome import ChromeDriverManager
+from webdriver_manager.core.utils import ChromeType
+from crawl_manifest import (CRAWL_MANIFEST_PATH, DONE, METADATA_CHANGED, STALE_AFTER_DAYS, CrawlManifest, file_hash,
+                            print_report, sanitize_directory_name, write_change_list)
+
+POLITENESS_INTERVAL = 1.0   # secondi tra due richieste al sito (sommando tutti i browser del pool) all'avvio
+MIN_INTERVAL = 0.5          # intervallo minimo raggiungibile quando il sito risponde bene
+MAX_INTERVAL = 15.0         # intervallo massimo dopo errori e risposte 429
+INTERVAL_STEP = 0.05        # riduzione dell'intervallo dopo ogni risposta regolare
+RATE_LIMIT_BURST = 2        # richieste che possono partire insieme dopo una pausa
+THROTTLED_PAUSE = 60        # secondi di pausa per tutto il pool quando il sito risponde 429 senza Retry-After
+WAIT_TIMEOUT = 20           # secondi massimi di attesa di un elemento o di una nuova scheda
+RESULTS_REFRESH_TIMEOUT = 5 # secondi massimi di attesa della sostituzione della tabella dei risultati
+BANNER_TIMEOUT = 2          # secondi massimi di attesa del banner dei cookie
+DOWNLOAD_WORKERS = 8        # download dei PDF in parallelo (per processo)
+DOWNLOAD_PER_HOST = 4       # connessioni contemporanee verso lo stesso host
+DOWNLOAD_TIMEOUT = (10, 60) # secondi: connessione, lettura
+DOWNLOAD_ATTEMPTS = 4       # tentativi per PDF (ognuno riprende dal file .part)
+CHANGES_PATH = 'crawl_changes.json'
+UNIVERSITALY_URL = "https://www.universitaly.it/index.php/cercacorsi/universita"
+
+# Estrazione in blocco della tabella dei risultati: un solo execute_script restituisce i campi grezzi di tutte
+# le righe (tbody/tr), con gli stessi elementi letti da CourseScraper._extract_course_info. Una riga a cui manca
+# un campo obbligatorio vale null e viene estratta campo per campo. Il titolo delle icone è letto dalla proprietà
+# title, come fa get_attribute di Selenium: stringa vuota se l'attributo manca, null solo se manca l'icona.
+BULK_EXTRACT_SCRIPT = """
+const text = (element) => element ? element.innerText.trim() : null;
+const title = (element) => element ? element.title : null;
+return Array.from(arguments[0].querySelectorAll(":scope > tbody > tr"), (row) => {
+    const cells = row.querySelectorAll(":scope > td");
+    const child = (n, selector) => cells[n - 1] ? cells[n - 1].querySelector(":scope > " + selector) : null;
+    const name = child(2, "strong"), link = child(2, "a"), duration = child(8, "img");
+    const access = child(4, "img"), testAccess = child(6, "img"), mod = child(7, "img");
+    if (!name || !link || !duration || !access || !testAccess || !mod) {
+        return null;
+    }
+    return {
+        name: text(name),
+        levels: Array.from(cells[2].querySelectorAll(":scope > span"), text),
+        cities: text(cells[1]),
+        language: title(child(10, "img")),
+        type_of_access: title(access),
+        test_access: title(testAccess),
+        mod: title(mod),
+        duration_src: duration.src,
+        degree_type: title(child(9, "img")),
+        sua_href: link.href,
+    };
+});
+"""
+
+
+class Browser:
+    def __init__(self, url=UNIVERSITALY_URL, driver=None):
+        if driver is None:
+            # Configure Chrome options
+            chrome_options = Options()
+            chrome_options.add_argument("--start-maximized")
+            chrome_options.add_argument("--headless")  # Disattiva la visualizzazione GUI
+
+            service = Service(ChromeDriverManager().install())
+            driver = webdriver.Chrome(service=service, options=chrome_options)
+        self.driver = driver
+        self.driver.get(url)
+        # Secondi passati ad attendere la pagina (attese su condizione e sleep)
+        self.waited = 0.0
+
+    def get_element_attribute(self, xpath, attribute):
+        return self.find_element(xpath).get_attribute(attribute)
+    
+    def close_tab(self):
+        self.driver.close()
+
+    def switch_to_new_tab(self):
+        self.driver.switch_to.window(self.driver.window_handles[-1])
+
+    def switch_to_main_tab(self):
+        self.driver.switch_to.window(self.driver.window_handles[0])
+
+    def find_elements(self, xpath):
+        return self.driver.find_elements(By.XPATH, xpath)
+
+    def find_element(self, xpath):
+        return self.driver.find_element(By.XPATH, xpath)
+
+    def sleep(self, seconds):
+        self.waited += seconds
+        time.sleep(seconds)
+
+    # Attese su condizione: terminano appena la pagina è pronta, TimeoutException dopo timeout secondi
+
+    def wait_for_element(self, xpath, timeout=WAIT_TIMEOUT, clickable=False):
+        condition = EC.element_to_be_clickable if clickable else EC.presence_of_element_located
+        return self._wait(condition((By.XPATH, xpath)), timeout)
+
+    def wait_for_staleness(self, element, timeout=WAIT_TIMEOUT):
+        return self._wait(EC.staleness_of(element), timeout)
+
+    def wait_for_new_tab(self, handles, timeout=WAIT_TIMEOUT):
+        # handles: le schede aperte prima del click
+        self._wait(EC.new_window_is_opened(handles), timeout)
+        self.switch_to_new_tab()
+
+    def _wait(self, condition, timeout):
+        start = time.perf_counter()
+        try:
+            return WebDriverWait(self.driver, timeout, poll_frequency=0.2).until(condition)
+        finally:
+            self.waited += time.perf_counter() - start
+
+    def is_throttled(self):
+        title = (self.driver.title or "").lower()
+        return "429" in title or "too many requests" in title
+
+    def execute_script(self, script, *args):
+        return self.driver.execute_script(script, *args)
+
+    def quit(self):
+        self.driver.quit()
+
+
+class PolitenessLimiter:
+    # Limite globale di cortesia verso il sito, adattivo: token bucket condiviso da tutti i processi del pool
+    # (stato in memoria condivisa), con un token ogni interval secondi e al massimo RATE_LIMIT_BURST token.
+    # * success(): risposta regolare, l'intervallo scende di INTERVAL_STEP fino a min_interval.
+    # * error(): timeout o errore del sito, l'intervallo raddoppia fino a max_interval.
+    # * error(retry_after): risposta 429, in più tutto il pool si ferma per retry_after secondi.
+    _TOKENS, _UPDATED, _INTERVAL, _BLOCKED_UNTIL = range(4)
+
+    def __init__(self, interval=POLITENESS_INTERVAL, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 burst=RATE_LIMIT_BURST):
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.burst = burst
+        self._state = multiprocessing.Array("d", [1.0, time.time(), interval, 0.0])
+
+    @property
+    def interval(self):
+        return self._state[self._INTERVAL]
+
+    def wait(self):
+        # Attende un token; restituisce i secondi di attesa
+        waited = 0.0
+        while True:
+            with self._state.get_lock():
+                now = time.time()
+                state = self._state
+                interval = state[self._INTERVAL]
+                tokens = min(self.burst, state[self._TOKENS] + (now - state[self._UPDATED]) / interval)
+                state[self._UPDATED] = now
+                if now >= state[self._BLOCKED_UNTIL] and tokens >= 1:
+                    state[self._TOKENS] = tokens - 1
+                    return waited
+                state[self._TOKENS] = tokens
+                delay = max(state[self._BLOCKED_UNTIL] - now, (1 - tokens) * interval, 0.01)
+            time.sleep(delay)
+            waited += delay
+
+    def success(self):
+        with self._state.get_lock():
+            self._state[self._INTERVAL] = max(self.min_interval, self._state[self._INTERVAL] - INTERVAL_STEP)
+
+    def error(self, retry_after=None):
+        with self._state.get_lock():
+            self._state[self._INTERVAL] = min(self.max_interval, self._state[self._INTERVAL] * 2)
+            if retry_after:
+                self._state[self._BLOCKED_UNTIL] = max(self._state[self._BLOCKED_UNTIL], time.time() + retry_after)
+                self._state[self._TOKENS] = 0.0
+        print(f"RATE LIMIT: intervallo {self.interval:.2f}s" + (f", pausa {retry_after}s" if retry_after else ""))
+
+
+class PdfDownloader:
+    # Download dei PDF SUA separato dal browser: lo scraper raccoglie le coppie (url_pdf, percorso) e le passa a
+    # submit(), che le scarica in un pool di thread su una Session condivisa (connessioni riusate).
+    # * Retry con backoff esponenziale su errori di connessione e risposte 429/5xx.
+    # * Al massimo per_host connessioni contemporanee verso lo stesso host.
+    # * Il file viene scritto in <percorso>.part e rinominato con os.replace solo a download completato, quindi
+    #   un PDF presente è sempre completo; un .part rimasto da un'interruzione viene ripreso con una richiesta Range
+    #   e If-Range (ETag o Last-Modified della risposta che l'ha iniziato, salvati in <percorso>.part.json): se il
+    #   PDF è cambiato il server risponde 200 con il file intero e il .part viene riscritto da capo.
+    # * L'esito (sha256 e dimensione del PDF, ETag e Last-Modified, oppure l'errore) viene registrato nel manifest.
+    # * Con un rate_limiter ogni richiesta prende un token del limite di cortesia; le risposte 429 lo rallentano.
+    # * refresh() controlla se un PDF già scaricato è cambiato sul server con una richiesta condizionale.
+    def __init__(self, workers=DOWNLOAD_WORKERS, per_host=DOWNLOAD_PER_HOST, timeout=DOWNLOAD_TIMEOUT,
+                 attempts=DOWNLOAD_ATTEMPTS, manifest=None, rate_limiter=None):
+        self.manifest = manifest
+        self.rate_limiter = rate_limiter
+        self.per_host = per_host
+        self.timeout = timeout
+        self.attempts = attempts
+        self.session = requests.Session()
+        # Le risposte 429 non vengono ripetute qui: passano dal rate limiter condiviso (_get)
+        retry = Retry(total=5, backoff_factor=1, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]), respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=per_host, pool_maxsize=max(workers, per_host), max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+        self.failed = []
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def submit(self, url, file_path):
+        future = self.executor.submit(self._download, url, file_path)
+        self.futures.append(future)
+        return future
+
+    def submit_refresh(self, entry):
+        return self.executor.submit(self.refresh, entry)
+
+    def close(self):
+        # Attende i download ancora in corso e chiude le connessioni
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        done = sum(1 for future in self.futures if future.result())
+        print(f"PDF scaricati: {done}, non riusciti: {len(self.failed)}")
+        for url, file_path in self.failed:
+            print(f"DOWNLOAD FAILED {file_path} ({url})")
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def _download(self, url, file_path):
+        part_path = file_path + ".part"
+        error = None
+        with self._host_slot(url):
+            for attempt in range(self.attempts):
+                try:
+                    validators = self._fetch(url, part_path)
+                    os.replace(part_path, file_path)
+                    self._remove_part_validators(part_path)
+                    print("------PDF OK " + file_path)
+                    if self.manifest is not None:
+                        self.manifest.mark_downloaded(file_path, *file_hash(file_path), *validators)
+                    return True
+                except (requests.RequestException, OSError) as e:
+                    error = e
+                    print(f"Errore durante il download di {url} (tentativo {attempt + 1}): {str(e)}")
+                    if attempt + 1 < self.attempts:
+                        time.sleep(2 ** attempt)
+        with self._lock:
+            self.failed.append((url, file_path))
+        if self.manifest is not None:
+            self.manifest.mark_download_failed(file_path, error)
+        return False
+
+    def _fetch(self, url, part_path):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validators = self._part_validators(part_path) if offset else (None, None)
+        etag, last_modified = validators
+        # If-Range accetta solo un ETag forte; senza validatori il .part non si può riprendere in sicurezza
+        if_range = etag if etag and not etag.startswith("W/") else last_modified
+        headers = {"Range": f"bytes={offset}-", "If-Range": if_range} if offset and if_range else {}
+        with self._get(url, headers) as response:
+            if headers and response.status_code == 416:
+                # Il .part contiene già tutto il file (ancora la stessa versione)
+                return validators
+            response.raise_for_status()
+            if headers and response.status_code == 206:
+                # Stessa versione del PDF: il server riprende dal byte richiesto
+                self._write(response, part_path, "ab")
+                return validators
+            # 200: file intero (nuovo download, oppure PDF cambiato dopo il .part): il .part viene riscritto
+            validators = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            self._save_part_validators(part_path, validators)
+            self._write(response, part_path, "wb")
+            return validators
+
+    @staticmethod
+    def _part_validators(part_path):
+        try:
+            with open(part_path + ".json") as file:
+                saved = json.load(file)
+            return saved.get("etag"), saved.get("last_modified")
+        except (OSError, ValueError):
+            return None, None
+
+    @staticmethod
+    def _save_part_validators(part_path, validators):
+        with open(part_path + ".json", "w") as file:
+            json.dump({"etag": validators[0], "last_modified": validators[1]}, file)
+
+    @staticmethod
+    def _remove_part_validators(part_path):
+        try:
+            os.remove(part_path + ".json")
+        except FileNotFoundError:
+            pass
+
+    def _get(self, url, headers):
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+        response = self.session.get(url, stream=True, timeout=self.timeout, headers=headers)
+        if self.rate_limiter is not None:
+            if response.status_code == 429:
+                retry_after = response.headers.get("Retry-After", "")
+                self.rate_limiter.error(int(retry_after) if retry_after.isdigit() else THROTTLED_PAUSE)
+            elif response.status_code < 400:
+                self.rate_limiter.success()
+        return response
+
+    def _write(self, response, part_path, mode="wb"):
+        with open(part_path, mode) as file:
+            for chunk in response.iter_content(chunk_size=65536):
+                if chunk:
+                    file.write(chunk)
+
+    def refresh(self, entry):
+        # entry: riga del manifest (url_pdf, pdf_path, pdf_hash, etag, last_modified).
+        # Con ETag/Last-Modified salvati il server risponde 304 se il PDF non è cambiato; altrimenti (o se il server
+        # non li gestisce) il PDF viene riscaricato in .part e confrontato per sha256 con quello salvato.
+        # Il file viene sostituito solo se il contenuto è diverso. Restituisce "unchanged", "changed" o "failed".
+        url, file_path = entry["url_pdf"], entry["pdf_path"]
+        part_path = file_path + ".part"
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        with self._host_slot(url):
+            try:
+                with self._get(url, headers) as response:
+                    if response.status_code == 304:
+                        self.manifest.mark_checked(file_path)
+                        return "unchanged"
+                    response.raise_for_status()
+                    self._write(response, part_path)
+                    validators = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                digest, size = file_hash(part_path)
+                if digest == entry.get("pdf_hash") and os.path.exists(file_path):
+                    os.remove(part_path)
+                    self.manifest.mark_checked(file_path, *validators)
+                    return "unchanged"
+                os.replace(part_path, file_path)
+                self.manifest.mark_downloaded(file_path, digest, size, *validators)
+                print("------PDF CHANGED " + file_path)
+                return "changed"
+            except (requests.RequestException, OSError) as e:
+                print(f"Errore durante il controllo di {url}: {str(e)}")
+                return "failed"
+
+
+class DirectoryManager:
+        
+    def create_directory(self, path_name):
+        path = Path(path_name)
+        path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def sanitize_directory_name(name):
+        return sanitize_directory_name(name)
+    
+    def file_exists(self, file_path):
+        if os.path.exists(file_path):
+            print("ALREADY DONE")
+            return True
+        else:
+            return False
+    
+    def write_to_file(self, path, data):
+        if os.path.exists(path):
+            print("ALREADY DONE")
+            return
+
+        with open(path, "w") as file:
+            file.write(data)
+    
+    def delete_folder_content(self, folder_path):
+        try:
+            # Check if the folder exists
+            if os.path.exists(folder_path):
+                # Delete all contents of the folder
+                shutil.rmtree(folder_path)
+                # Recreate an empty folder
+                os.makedirs(folder_path)
+                print(f"Successfully deleted the contents of {folder_path}.")
+            else:
+                print(f"The folder {folder_path} does not exist.")
+        except Exception as e:
+            print(f"An error occurred while deleting the contents of {folder_path}: {str(e)}")
+
+
+
+class CourseInfoExtractor:
+    def __init__(self, directory_manager, browser):
+        self.directory_manager = directory_manager
+        self.browser = browser
+
+    def create_university_tree(self):
+        self.directory_manager.create_directory("/universities")
+
+        print("****Start Uni Dir Creation****")
+
+        select_element = self.browser.find_element("/html/body/div[4]/div/div[2]/div[1]/form/div[2]/div[2]/fieldset/select[4]")
+        options = select_element.find_elements(By.XPATH, "./option")
+        university_names = []
+        for i in range(1, len(options)):
+            option = options[i]
+            university_name = option.text
+            print(university_name)
+            self.directory_manager.create_directory("./universities/"+self.directory_manager.sanitize_directory_name(university_name))
+            university_names.append(university_name)
+        return university_names
+
+class CourseScraper:
+    def __init__(self, directory_manager, browser, rate_limiter=None, downloader=None, manifest=None):
+        self.directory_manager = directory_manager
+        self.browser = browser
+        self.rate_limiter = rate_limiter
+        self.throttled = 0.0
+        self.manifest = manifest if manifest is not None else CrawlManifest()
+        self.downloader = downloader if downloader is not None else PdfDownloader(manifest=self.manifest)
+
+    def scrape(self, university_names=None):
+        # university_names: solo queste università (ad esempio quelle da rivisitare secondo il manifest)
+        print("****Start Uni Scraping****")
+
+        main_path = self._get_main_path()
+
+        select_element = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/div[2]/div[2]/fieldset/select[4]")
+        search = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/p/input[1]")
+        options = select_element.find_elements(By.XPATH, "./option")
+
+        for i in range(1, len(options)):
+            university_name = options[i].text
+            if university_names is not None and university_name not in university_names:
+                continue
+            self._scrape_university(main_path, options[i], search, university_name)
+
+    def scrape_queue(self, queue):
+        # Modalità pool: le università (indice nel menu, nome) arrivano da una coda condivisa tra i processi,
+        # None indica che la coda è finita. Ogni università viene presa da un solo worker.
+        print("****Start Uni Scraping (worker %d)****" % os.getpid())
+
+        main_path = self._get_main_path()
+
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            index, university_name = item
+
+            try:
+                select_element = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/div[2]/div[2]/fieldset/select[4]")
+                search = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/p/input[1]")
+                option = select_element.find_elements(By.XPATH, "./option")[index]
+            except Exception as e:
+                print(f"ERROR IN {university_name}: {str(e)}")
+                continue
+            if option.text != university_name:
+                print(f"ERROR IN {university_name}: OPTION {index} IS {option.text}")
+                continue
+            self._scrape_university(main_path, option, search, university_name)
+
+    def _scrape_university(self, main_path, option, search, university_name):
+        self.manifest.start_university(university_name)
+        start = time.perf_counter()
+        waited = self.browser.waited + self.throttled
+        try:
+            self._scrape_option(main_path, option, search)
+            self._check_scraped_courses(main_path, university_name)
+        except Exception as e:
+            # Un errore su un'università non ferma il crawl: resta "failed" nel manifest e i corsi già
+            # registrati verranno saltati al prossimo giro
+            print(f"ERROR IN {university_name}: {str(e)}")
+            self.manifest.fail_university(university_name, e)
+            if len(self.browser.driver.window_handles) > 1:
+                self.browser.switch_to_new_tab()
+                self.browser.close_tab()
+            self.browser.switch_to_main_tab()
+        finally:
+            # Tempo passato ad attendere (pagine e limite di cortesia) rispetto al tempo di lavoro effettivo
+            elapsed = time.perf_counter() - start
+            waited = self.browser.waited + self.throttled - waited
+            print(f"TIME {university_name}: {elapsed:.1f}s, attesa {waited:.1f}s, lavoro {elapsed - waited:.1f}s"
+                  + (f", intervallo {self.rate_limiter.interval:.2f}s" if self.rate_limiter is not None else ""))
+
+    def _throttle(self):
+        if self.rate_limiter is not None:
+            self.throttled += self.rate_limiter.wait()
+
+    def _page_ready(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.success()
+
+    def _page_timeout(self):
+        # La pagina non è arrivata in tempo: il sito è lento o sta limitando le richieste
+        if self.rate_limiter is not None:
+            self.rate_limiter.error(THROTTLED_PAUSE if self.browser.is_throttled() else None)
+
+    def _get_main_path(self):
+        try:
+            banner_button = self.browser.wait_for_element("/html/body/div[1]/div/a[1]", timeout=BANNER_TIMEOUT, clickable=True)
+            banner_button.click()
+            
+            return "/html/body/div[3]"
+        except:
+            return "/html/body/div[4]"
+
+    def verify_bulk(self):
+        # Confronto tra l'estrazione campo per campo e quella in blocco: per ogni università vengono stampati i
+        # tempi dei due estrattori e le righe con campi diversi. Non scarica nulla e non scrive su disco.
+        print("****Start Bulk Extraction Check****")
+
+        main_path = self._get_main_path()
+
+        select_element = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/div[2]/div[2]/fieldset/select[4]")
+        search = self.browser.find_element(main_path+"/div/div[2]/div[1]/form/p/input[1]")
+        options = select_element.find_elements(By.XPATH, "./option")
+
+        total_rows = total_mismatches = 0
+        total_single = total_bulk = 0.0
+        for i in range(1, len(options)):
+            university_name = options[i].text
+            self._search_university(main_path, options[i], search)
+
+            table_element = self.browser.find_element(main_path+"/div/div[2]/div[2]/div[2]/div/table")
+            single, single_time, bulk_time, mismatches, fallbacks = self.compare_extractions(table_element)
+
+            print(f"{university_name}: {len(single)} corsi, campo per campo {single_time:.2f}s, "
+                  f"in blocco {bulk_time:.2f}s, differenze {mismatches}, righe campo per campo {fallbacks}")
+            total_rows += len(single)
+            total_mismatches += mismatches
+            total_single += single_time
+            total_bulk += bulk_time
+
+        print(f"TOTALE: {total_rows} corsi, campo per campo {total_single:.2f}s, in blocco {total_bulk:.2f}s, "
+              f"differenze {total_mismatches}")
+        return total_mismatches == 0
+
+    def compare_extractions(self, table_element):
+        """Extract the rows of a results table field by field and in bulk and print the fields that differ.
+
+        Returns the per-field dicts, the time of the two extractions, the
+        number of rows that differ and of the rows the bulk path left to the
+        per-field extraction. Used by verify_bulk on the live site and by the
+        tests on a saved results page.
+        """
+        courses = table_element.find_elements(By.XPATH, "./tbody/tr")
+
+        start = time.perf_counter()
+        single = [self._extract_course_info(courses[j]) for j in range(1, len(courses))]
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bulk = self._extract_courses_bulk(table_element, courses)[1:]
+        bulk_time = time.perf_counter() - start
+
+        mismatches = fallbacks = 0
+        for single_dict, bulk_dict in zip(single, bulk):
+            if bulk_dict is None:
+                # Riga estratta campo per campo anche nella modalità in blocco
+                fallbacks += 1
+            elif single_dict != bulk_dict:
+                mismatches += 1
+                for key in single_dict:
+                    if single_dict[key] != bulk_dict.get(key):
+                        print(f"MISMATCH {single_dict['name']} [{key}]: {single_dict[key]!r} != {bulk_dict.get(key)!r}")
+        if len(single) != len(bulk):
+            mismatches += abs(len(single) - len(bulk))
+        return single, single_time, bulk_time, mismatches, fallbacks
+
+    def _search_university(self, main_path, option, search):
+        table_xpath = main_path+"/div/div[2]/div[2]/div[2]/div/table"
+        previous = self.browser.find_elements(table_xpath)
+
+        option.click()
+        self._throttle()
+        search.click()
+
+        # La ricerca sostituisce la tabella dei risultati: si attende che la precedente sparisca (se la pagina la
+        # aggiorna senza sostituirla l'attesa termina dopo RESULTS_REFRESH_TIMEOUT) e che la nuova sia presente
+        if previous:
+            try:
+                self.browser.wait_for_staleness(previous[0], timeout=RESULTS_REFRESH_TIMEOUT)
+            except TimeoutException:
+                pass
+        try:
+            self.browser.wait_for_element(table_xpath)
+        except TimeoutException:
+            self._page_timeout()
+            raise
+        self._page_ready()
+
+    def _scrape_option(self, main_path, option, search):
+        university_name = option.text
+        print(university_name)
+
+        self._search_university(main_path, option, search)
+
+        self._scrape_courses(main_path, university_name)
+
+    def _scrape_courses(self, main_path, university_name):
+        table_element = self.browser.find_element(main_path+"/div/div[2]/div[2]/div[2]/div/table")
+        courses = table_element.find_elements(By.XPATH, "./tbody/tr")
+        # Tutte le righe in un solo round trip con il browser, prima di iniziare ad aprire le schede dei corsi
+        course_dicts = self._extract_courses_bulk(table_element, courses)
+        resume = self.browser.find_element(main_path+"/div/div[2]/div[2]/div[1]/div[1]/h3")
+        resume.click()
+
+        for i in range(1, len(courses)):
+            self._scrape_course(main_path, courses[i], university_name, course_dicts[i])
+
+    def _scrape_course(self, main_path, course, university_name, course_dict=None):
+
+        
+
+
+        if course_dict is None:
+            course_dict = self._extract_course_info(course)
+        course_name = course_dict['name']
+        sua_code = course_dict['sua_code']
+        path = "./universities/"+self.directory_manager.sanitize_directory_name(university_name)+"/"+self.directory_manager.sanitize_directory_name(course_name)+"_"+sua_code
+
+
+        pdf_path = path+"/"+self.directory_manager.sanitize_directory_name(course_name)+"_"+sua_code+".pdf"
+        course_key = self.directory_manager.sanitize_directory_name(university_name)+"/"+self.directory_manager.sanitize_directory_name(course_name)+"_"+sua_code
+
+        print("-----"+course_name)
+
+        # Lo stato del corso viene letto dal manifest; il filesystem viene controllato solo per i corsi non
+        # ancora registrati (scaricati prima che esistesse il manifest)
+        entry = self.manifest.course(course_key)
+        if entry is not None and entry["status"] == DONE:
+            print("ALREADY DONE")
+            self.manifest.mark_seen(course_key)
+            self._update_metadata(path+"/metadata.txt", course_dict, course_key)
+            return
+        if entry is not None and entry["url_pdf"]:
+            # Corso già visitato ma PDF mancante (download interrotto o fallito): si riprende solo il download
+            self.manifest.mark_seen(course_key)
+            self.downloader.submit(entry["url_pdf"], pdf_path)
+            return
+        if(self.directory_manager.file_exists(pdf_path) and self.directory_manager.file_exists(path+"/metadata.txt")):
+            self.manifest.record_course(course_key, university_name, course_dict, pdf_path)
+            self.manifest.mark_downloaded(pdf_path, *file_hash(pdf_path))
+            return
+        url_pdf = self._saved_pdf_url(path+"/metadata.txt")
+        if url_pdf:
+            course_dict["url_pdf"] = url_pdf
+            self.manifest.record_course(course_key, university_name, course_dict, pdf_path)
+            self.downloader.submit(url_pdf, pdf_path)
+            return
+        self.directory_manager.delete_folder_content(path)
+
+        
+        self.directory_manager.create_directory(path)
+
+        handles = self.browser.driver.window_handles
+        self._throttle()
+        course.find_element(By.XPATH, "./td[2]/a[1]").click()
+        try:
+            self.browser.wait_for_new_tab(handles)
+            url_pdf = self.browser.wait_for_element(main_path+"/div/div[2]/div[1]/div[4]/a").get_attribute("href")
+        except TimeoutException:
+            self._page_timeout()
+            raise
+        self._page_ready()
+        print(url_pdf)
+
+        self.browser.close_tab()
+        self.browser.switch_to_main_tab()
+
+        # metadata.txt contiene anche l'URL del PDF: il download procede in background e, se non va a buon fine,
+        # viene ripreso al prossimo giro senza riaprire la scheda del corso
+        course_dict["url_pdf"] = url_pdf
+        self.directory_manager.write_to_file(path+"/metadata.txt", json.dumps(course_dict))
+        self.manifest.record_course(course_key, university_name, course_dict, pdf_path)
+        self.downloader.submit(url_pdf, pdf_path)
+
+    
+
+    
+    def _update_metadata(self, metadata_path, course_dict, course_key):
+        # I dati della riga della tabella sono già estratti: se differiscono da metadata.txt il file viene
+        # riscritto e la modifica registrata per l'indicizzazione
+        try:
+            with open(metadata_path) as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            saved = {}
+        if "url_pdf" in saved:
+            course_dict = dict(course_dict, url_pdf=saved["url_pdf"])
+        if course_dict == saved:
+            return
+        with open(metadata_path + ".tmp", "w") as file:
+            file.write(json.dumps(course_dict))
+        os.replace(metadata_path + ".tmp", metadata_path)
+        self.manifest.record_change(course_key, METADATA_CHANGED)
+        print("------METADATA CHANGED")
+
+    def _saved_pdf_url(self, metadata_path):
+        try:
+            with open(metadata_path) as file:
+                return json.load(file).get("url_pdf")
+        except (OSError, ValueError):
+            return None
+
+
+    def _extract_courses_bulk(self, table_element, courses):
+        # Stessa struttura di _extract_course_info per ogni riga di courses (compresa la prima, come nella
+        # tabella); se lo script non restituisce una riga per ogni tr si torna all'estrazione campo per campo
+        try:
+            rows = self.browser.execute_script(BULK_EXTRACT_SCRIPT, table_element)
+        except Exception as e:
+            print("Errore nell'estrazione in blocco:", str(e))
+            rows = None
+        if rows is None or len(rows) != len(courses):
+            rows = [None] * len(courses)
+
+        # Riga incompleta (o intestazione): None, l'estrazione campo per campo avviene solo quando serve
+        return [self._course_dict_from_row(row) if row is not None else None for row in rows]
+
+    def _course_dict_from_row(self, row):
+        course_dict = {}
+
+        course_dict["name"] = row["name"]
+        course_dict["cds_codes"] = row["levels"]
+        course_dict["cities"] = self._extract_cities_text(row["cities"])
+        # null solo se manca l'icona (come l'eccezione di _extract_language_text); un'icona senza titolo vale ""
+        course_dict["language"] = row["language"] if row["language"] is not None else "Corso in lingua italiana"
+        course_dict["type_of_access"] = row["type_of_access"]
+        course_dict["test_access"] = row["test_access"]
+        course_dict["mod"] = row["mod"]
+        match = re.search(r'anni(\d+).png', row["duration_src"])
+        course_dict["duration"] = match.group(1) + " anni" if match else ""
+        course_dict["degree_type"] = row["degree_type"] if row["degree_type"] is not None else "Corso a rilascio titolo singolo"
+        course_dict["sua_code"] = re.sub(r".*/(\d+)$", r"\1", row["sua_href"])
+
+        return course_dict
+
+    def _extract_course_info(self, course):
+        course_dict = {}
+
+        title = course.find_element(By.XPATH, "./td[2]/strong")
+        levels = course.find_element(By.XPATH, "./td[3]").find_elements(By.XPATH, "./span")
+        cities = course.find_element(By.XPATH, "./td[2]")
+
+        language_text = self._extract_language_text(course)
+        access_text = self._extract_attribute_text(course, "./td[4]/img")
+        test_access_text = self._extract_attribute_text(course, "./td[6]/img")
+        mod_text = self._extract_attribute_text(course, "./td[7]/img")
+        duration_text = self._extract_duration_text(course)
+        degree_text = self._extract_degree_text(course)
+
+        sua_window = course.find_element(By.XPATH, "./td[2]/a[1]")
+        sua_href = sua_window.get_attribute("href")
+        sua_code = re.sub(r".*/(\d+)$", r"\1", sua_href)
+
+        course_dict["name"] = title.text
+        course_dict["cds_codes"] = [level.text for level in levels]
+        course_dict["cities"] = self._extract_cities_text(cities.text)
+        course_dict["language"] = language_text
+        course_dict["type_of_access"] = access_text
+        course_dict["test_access"] = test_access_text
+        course_dict["mod"] = mod_text
+        course_dict["duration"] = duration_text
+        course_dict["degree_type"] = degree_text
+        course_dict["sua_code"] = sua_code
+
+        return course_dict
+
+    def _extract_language_text(self, course):
+        try:
+            language = course.find_element(By.XPATH, "./td[10]/img")
+            return language.get_attribute("title")
+        except:
+            return "Corso in lingua italiana"
+
+    def _extract_degree_text(self, course):
+        try:
+            degree = course.find_element(By.XPATH, "./td[9]/img")
+            return degree.get_attribute("title")
+        except:
+            return "Corso a rilascio titolo singolo"
+
+    def _extract_attribute_text(self, course, xpath):
+        element = course.find_element(By.XPATH, xpath)
+        return element.get_attribute("title")
+
+    def _extract_duration_text(self, course):
+        duration = course.find_element(By.XPATH, "./td[8]/img")
+        duration_text = duration.get_attribute("src")
+        match = re.search(r'anni(\d+).png', duration_text)
+        if match:
+            return match.group(1) + " anni"
+        return ""
+
+    def _extract_cities_text(self, cities_text):
+        match = re.findall(r"(, ([^,\n\[\]]+))(?!\[)(?!.*\bInterateneo\b)", cities_text)
+        citta = [m[1].strip() for m in match]
+        return citta
+    
+    def _check_scraped_courses(self, main_path, university_name):
+        resume_text = self.browser.find_element(main_path + "/div/div[2]/div[2]/div[1]/div[1]/div/p[1]").text
+        match = re.search(r"Trovati (\d+) corsi", resume_text)
+        expected = int(match.group(1)) if match else 0
+        # I corsi trovati sono quelli visti nel manifest durante questa visita; le differenze finiscono nel report
+        # di fine crawl
+        status, found = self.manifest.finish_university(university_name, expected)
+        if status != DONE:
+            print(f"ERROR IN {university_name}")
+            print(f"FOUND: {found}")
+            print(f"EXPECTED: {expected}")
+
+
+def scrape_worker(queue, rate_limiter, manifest_path):
+    directory_manager = DirectoryManager()
+    browser = Browser()
+    manifest = CrawlManifest(manifest_path)
+    downloader = PdfDownloader(manifest=manifest, rate_limiter=rate_limiter)
+    try:
+        CourseScraper(directory_manager, browser, rate_limiter, downloader=downloader, manifest=manifest).scrape_queue(queue)
+    finally:
+        browser.quit()
+        downloader.close()
+
+
+def retry_downloads(manifest, rate_limiter=None):
+    # PDF rimasti in sospeso o falliti nei crawl precedenti: si scaricano dagli URL salvati, senza browser
+    downloads = manifest.downloads_to_retry()
+    if not downloads:
+        return
+    print(f"****Retry of {len(downloads)} PDF downloads****")
+    downloader = PdfDownloader(manifest=manifest, rate_limiter=rate_limiter)
+    for url_pdf, pdf_path in downloads:
+        downloader.submit(url_pdf, pdf_path)
+    downloader.close()
+
+
+def refresh_pdfs(manifest, changes_path=CHANGES_PATH, rate_limiter=None):
+    # Aggiornamento incrementale senza browser: una richiesta condizionale per ogni PDF già scaricato.
+    # Le modifiche trovate (comprese quelle dei metadata.txt rilevate dai crawl) finiscono in changes_path.
+    start = time.time()
+    entries = manifest.courses_to_refresh()
+    print(f"****Refresh of {len(entries)} PDFs****")
+    downloader = PdfDownloader(manifest=manifest, rate_limiter=rate_limiter)
+    futures = [downloader.submit_refresh(entry) for entry in entries]
+    downloader.close()
+    outcomes = {}
+    for future in futures:
+        outcome = future.result()
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    print(f"PDF invariati: {outcomes.get('unchanged', 0)}, modificati: {outcomes.get('changed', 0)}, "
+          f"non controllati: {outcomes.get('failed', 0)}")
+    changed = write_change_list(manifest, changes_path, since=start)
+    print(f"Corsi modificati: {changed} -> {changes_path}")
+
+
+def scrape_in_parallel(university_names, workers, rate_limiter, manifest_path=CRAWL_MANIFEST_PATH):
+    # N processi, ognuno con il proprio Chrome headless, prendono le università dalla stessa coda
+    # university_names: (indice nel menu, nome) delle università da visitare
+    queue = multiprocessing.Queue()
+    for index, university_name in university_names:
+        queue.put((index, university_name))
+    for _ in range(workers):
+        queue.put(None)
+
+    processes = [multiprocessing.Process(target=scrape_worker, args=(queue, rate_limiter, manifest_path))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+# Usage
+# python universitaly_bot.py [--workers 4] [--interval 1.0] [--recrawl [--stale-days 30]] [--verify-bulk]
+# python universitaly_bot.py --refresh [--changes crawl_changes.json]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scraping dei corsi di laurea da Universitaly")
+    parser.add_argument("--workers", type=int, default=1, help="browser headless in parallelo (1 = un solo browser)")
+    parser.add_argument("--interval", type=float, default=POLITENESS_INTERVAL,
+                        help="secondi iniziali tra due richieste al sito, per tutto il pool (poi adattati alle risposte)")
+    parser.add_argument("--manifest", default=CRAWL_MANIFEST_PATH, help="database SQLite con lo stato del crawl")
+    parser.add_argument("--recrawl", action="store_true",
+                        help="visita solo le università fallite, incomplete o più vecchie di --stale-days")
+    parser.add_argument("--stale-days", type=float, default=STALE_AFTER_DAYS)
+    parser.add_argument("--refresh", action="store_true",
+                        help="controlla con richieste condizionali i PDF già scaricati e scrive l'elenco delle modifiche")
+    parser.add_argument("--changes", default=CHANGES_PATH, help="file JSON con l'elenco dei corsi modificati")
+    parser.add_argument("--verify-bulk", action="store_true",
+                        help="confronta estrazione campo per campo e in blocco (parità e tempi), senza scaricare nulla")
+    args = parser.parse_args()
+
+    if args.refresh:
+        manifest = CrawlManifest(args.manifest)
+        refresh_pdfs(manifest, args.changes, PolitenessLimiter(args.interval))
+        raise SystemExit(0)
+
+    crawl_start = time.time()
+    directory_manager = DirectoryManager()
+    browser = Browser()
+    browser.wait_for_element("/html/body/div[4]/div/div[2]/div[1]/form/div[2]/div[2]/fieldset/select[4]")
+    course_info_extractor = CourseInfoExtractor(directory_manager, browser)
+    university_names = course_info_extractor.create_university_tree()
+    rate_limiter = PolitenessLimiter(args.interval)
+    manifest = CrawlManifest(args.manifest)
+    if args.verify_bulk:
+        course_extractor = CourseScraper(directory_manager, browser, rate_limiter, manifest=manifest)
+        ok = course_extractor.verify_bulk()
+        browser.quit()
+        raise SystemExit(0 if ok else 1)
+
+    to_crawl = list(enumerate(university_names, start=1))
+    if args.recrawl:
+        retry_downloads(manifest, rate_limiter)
+        names = set(manifest.universities_to_crawl(university_names, args.stale_days))
+        to_crawl = [(index, name) for index, name in to_crawl if name in names]
+        print(f"****Recrawl of {len(to_crawl)} universities****")
+
+    if args.workers <= 1:
+        downloader = PdfDownloader(manifest=manifest, rate_limiter=rate_limiter)
+        course_extractor = CourseScraper(directory_manager, browser, rate_limiter, downloader=downloader, manifest=manifest)
+        course_extractor.scrape([name for _, name in to_crawl])
+        browser.quit()
+        downloader.close()
+    else:
+        browser.quit()
+        scrape_in_parallel(to_crawl, args.workers, rate_limiter, args.manifest)
+
+    print_report(manifest)
+    print(f"Corsi modificati: {write_change_list(manifest, args.changes, since=crawl_start)} -> {args.changes}")
\ No newline at end of file